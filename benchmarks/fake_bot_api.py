@@ -0,0 +1,234 @@
+"""
+Local stand-in for the Telegram Bot API
+
+Serves the methods the bot uses (getUpdates, sendMessage, editMessageText,
+sendPhoto, answerCallbackQuery and the startup calls) over HTTP on
+localhost, so a Bot pointed at it runs without network access. Updates are
+queued with push_message()/push_callback() and delivered by long polling;
+whatever the bot sends or edits is handed to the chat's reply queue.
+
+Every call waits for a configurable latency, and a share of the sending
+methods can be answered with 429 Too Many Requests to exercise retries.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+# Bot account returned by getMe
+BOT_USER = {"id": 1000000, "is_bot": True, "first_name": "Python Tutor", "username": "python_tutor_load_bot"}
+
+# Methods answered with a message object
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "editMessageText", "editMessageReplyMarkup", "editMessageCaption"}
+
+
+class FakeBotAPI:
+    """
+    Fake Bot API server
+
+    Args:
+        latency: Seconds every call takes
+        jitter: Random extra latency, up to this many seconds
+        rate_limit_ratio: Share of send/edit calls answered with 429
+        retry_after: retry_after of the injected 429 responses
+        seed: Random seed
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_ratio=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.url = None
+
+        # Number of calls and injected 429 responses per method
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        # Set once the bot starts polling
+        self.polling = asyncio.Event()
+
+        self._updates = deque()
+        self._last_update_id = 0
+        self._new_updates = asyncio.Event()
+        self._message_ids = defaultdict(int)
+        self._replies = defaultdict(asyncio.Queue)
+        self._runner = None
+        self._closing = False
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start serving, on a free port unless one is given"""
+        app = web.Application(client_max_size=20 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    async def stop(self):
+        """Stop serving, releasing pending long polls"""
+        self._closing = True
+        self._new_updates.set()
+        if self._runner:
+            await self._runner.cleanup()
+
+    def push_message(self, user, text):
+        """
+        Queue a text message from a user
+
+        Args:
+            user: Telegram user dictionary
+            text: Message text
+
+        Returns:
+            Update ID
+        """
+        message = {
+            "message_id": self._next_message_id(user["id"]),
+            "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self._push({"message": message})
+
+    def push_callback(self, user, message, data):
+        """
+        Queue a press of an inline button
+
+        Args:
+            user: Telegram user dictionary
+            message: Bot message the button belongs to
+            data: Callback data of the button
+
+        Returns:
+            Update ID
+        """
+        return self._push({"callback_query": {
+            "id": f"{user['id']}-{self._last_update_id + 1}",
+            "from": user,
+            "message": message,
+            "chat_instance": str(user["id"]),
+            "data": data
+        }})
+
+    async def next_reply(self, chat_id, timeout):
+        """
+        Wait for the next message the bot sent or edited in a chat
+
+        Args:
+            chat_id: Chat ID
+            timeout: Seconds to wait
+
+        Returns:
+            Tuple of (method name, message dictionary)
+
+        Raises:
+            asyncio.TimeoutError: If nothing arrives in time
+        """
+        return await asyncio.wait_for(self._replies[chat_id].get(), timeout)
+
+    def _push(self, update):
+        """Add an update to the polling queue"""
+        self._last_update_id += 1
+        update["update_id"] = self._last_update_id
+        self._updates.append(update)
+        self._new_updates.set()
+        return self._last_update_id
+
+    def _next_message_id(self, chat_id):
+        """Allocate the next message ID of a chat"""
+        self._message_ids[chat_id] += 1
+        return self._message_ids[chat_id]
+
+    async def _handle(self, request):
+        """Serve one Bot API call"""
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        params.update(request.query)
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method.startswith(("send", "edit")) and self.rng.random() < self.rate_limit_ratio:
+            self.rate_limited[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            }, status=429)
+
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method in MESSAGE_METHODS:
+            return self._ok(self._deliver(method, params))
+        if method.startswith("send"):
+            return web.json_response({
+                "ok": False, "error_code": 400, "description": f"Bad Request: {method} is not supported"
+            }, status=400)
+        # answerCallbackQuery, deleteWebhook and other calls without a payload
+        return self._ok(True)
+
+    async def _get_updates(self, params):
+        """Return confirmed-offset updates, long polling while there are none"""
+        offset = int(params.get("offset") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+
+        self.polling.set()
+        if not self._updates and not self._closing:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+
+        limit = int(params.get("limit") or 100)
+        return [update for _, update in zip(range(limit), self._updates)]
+
+    def _deliver(self, method, params):
+        """Build the message a send/edit call results in and pass it to the chat"""
+        chat_id = int(params["chat_id"])
+        if method.startswith("edit"):
+            message_id = int(params["message_id"])
+        else:
+            message_id = self._next_message_id(chat_id)
+
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER
+        }
+        if method == "sendPhoto":
+            message["photo"] = [{
+                "file_id": f"photo-{chat_id}-{message_id}",
+                "file_unique_id": f"u-{chat_id}-{message_id}",
+                "width": 1200,
+                "height": 630
+            }]
+            message["caption"] = params.get("caption", "")
+        elif "text" in params:
+            message["text"] = params["text"]
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+
+        self._replies[chat_id].put_nowait((method, message))
+        return message
+
+    @staticmethod
+    def _ok(result):
+        """Successful Bot API response"""
+        return web.json_response({"ok": True, "result": result})
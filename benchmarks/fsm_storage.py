@@ -0,0 +1,101 @@
+"""
+Benchmark of the database FSM storage against aiogram's MemoryStorage
+
+Simulates concurrent lesson sessions: every session starts a lesson, answers
+questions (reading state and data, then updating data on each answer) and
+finally clears its state, the same way lesson_handler does.
+
+Usage:
+    python -m benchmarks.fsm_storage [--sessions 500] [--answers 10]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.content.registry import get_catalogue
+from src.database.db import enable_sqlite_wal
+from src.database.fsm_storage import SQLAlchemyStorage
+from src.database.models import Base
+
+
+async def run_session(storage, user_id, answers, latencies):
+    """Run one lesson session and record the latency of every answer"""
+    key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+    catalogue = get_catalogue()
+
+    # Same data as start_practice, the questions stay in the catalogue
+    await storage.set_state(key, "LessonStates:answering_questions")
+    await storage.set_data(key, {
+        "lesson_id": 1,
+        "content_version": catalogue.version,
+        "question_count": len(catalogue.lesson(1).questions),
+        "current_question": 0,
+        "correct_answers": 0
+    })
+
+    for _ in range(answers):
+        started = time.perf_counter()
+        await storage.get_state(key)
+        data = await storage.get_data(key)
+        data["current_question"] += 1
+        await storage.update_data(key, data)
+        latencies.append(time.perf_counter() - started)
+        # Give other sessions a chance to run, like waiting for the next tap
+        await asyncio.sleep(0)
+
+    await storage.set_state(key, None)
+    await storage.set_data(key, {})
+
+async def bench(name, storage, sessions, answers):
+    """Run all sessions concurrently and print a summary line"""
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_session(storage, user_id, answers, latencies)
+        for user_id in range(1, sessions + 1)
+    ))
+    await storage.close()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print(
+        f"{name:<12} total {elapsed * 1000:8.1f} ms  "
+        f"answers/s {len(latencies) / elapsed:10.0f}  "
+        f"p50 {statistics.median(latencies) * 1000:7.3f} ms  "
+        f"p95 {p95 * 1000:7.3f} ms"
+    )
+
+async def main(sessions, answers):
+    """Benchmark both storages"""
+    await bench("memory", MemoryStorage(), sessions, answers)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'fsm.db')}")
+        enable_sqlite_wal(engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        await bench("sqlalchemy", SQLAlchemyStorage(engine=engine), sessions, answers)
+        await bench(
+            "sqla+cache",
+            SQLAlchemyStorage(engine=engine, cache_ttl=60),
+            sessions,
+            answers
+        )
+        await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--answers", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sessions, args.answers))
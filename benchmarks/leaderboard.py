@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the weekly leaderboard index
+
+Fills the index with a week of XP for many users, then measures awarding XP
+and answering "top 10 plus my rank", compared with sorting all users the
+way a leaderboard without an index would.
+
+Usage:
+    python -m benchmarks.leaderboard [--users 1000000] [--iterations 10000]
+"""
+import argparse
+import random
+import time
+import timeit
+
+from src.gamification.leaderboard import LEADERBOARD_SIZE, ScoreIndex
+
+
+def sorted_standings(scores, user_id):
+    """Build the top and find the rank by sorting all users"""
+    ranking = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    rank = next(i for i, (other_id, _) in enumerate(ranking, start=1) if other_id == user_id)
+    return ranking[:LEADERBOARD_SIZE], rank
+
+def report(name, seconds, iterations):
+    """Print the time per call in microseconds"""
+    print(f"{name:<28} {seconds / iterations * 1e6:10.2f} us/call")
+
+def main(users, iterations):
+    """Run the benchmark"""
+    rng = random.Random(42)
+
+    # Weekly XP is a handful of 10-50 XP awards for most users
+    scores = {user_id: rng.randint(1, 60) * 10 for user_id in range(users)}
+
+    started = time.perf_counter()
+    index = ScoreIndex()
+    for user_id, score in scores.items():
+        index.set(user_id, score)
+    print(f"Filled {users} users in {time.perf_counter() - started:.2f} s")
+
+    award_users = [rng.randrange(users) for _ in range(iterations)]
+    awards = iter(award_users)
+    report("award XP", timeit.timeit(
+        lambda: index.add(next(awards), 20), number=iterations
+    ), iterations)
+
+    asking = iter(award_users)
+    report("top 10 + rank", timeit.timeit(
+        lambda: (index.top(LEADERBOARD_SIZE), index.rank(next(asking))), number=iterations
+    ), iterations)
+
+    scores = {user_id: index.score(user_id) for user_id in range(users)}
+    sort_iterations = 3
+    report("top 10 + rank by sorting", timeit.timeit(
+        lambda: sorted_standings(scores, award_users[0]), number=sort_iterations
+    ), sort_iterations)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--iterations", type=int, default=10000)
+    args = parser.parse_args()
+
+    main(args.users, args.iterations)
@@ -0,0 +1,55 @@
+"""
+Micro-benchmark of the level lookup
+
+Compares the level of one XP amount found by sorting and scanning the
+threshold table on every call with a bisect on the precomputed curve, and
+maps a whole XP column to levels the way recompute_levels() does.
+
+Usage:
+    python -m benchmarks.level_curve [--users 1000000] [--iterations 100000]
+"""
+import argparse
+import random
+import time
+import timeit
+
+from src.gamification.level_curve import LEVEL_THRESHOLDS, level_curve
+
+
+def scan_level(xp):
+    """Find the level by sorting and scanning the thresholds"""
+    for level, threshold in sorted(LEVEL_THRESHOLDS.items(), key=lambda x: x[1], reverse=True):
+        if xp >= threshold:
+            return level
+    return 1
+
+def report(name, seconds, iterations):
+    """Print the time per call in microseconds"""
+    print(f"{name:<28} {seconds / iterations * 1e6:10.2f} us/call")
+
+def main(users, iterations):
+    """Run the benchmark"""
+    rng = random.Random(42)
+    xp_values = [rng.randint(0, 12000) for _ in range(users)]
+
+    amounts = iter(xp_values * (iterations // users + 1))
+    report("sort and scan", timeit.timeit(
+        lambda: scan_level(next(amounts)), number=iterations
+    ), iterations)
+
+    amounts = iter(xp_values * (iterations // users + 1))
+    report("bisect", timeit.timeit(
+        lambda: level_curve.level(next(amounts)), number=iterations
+    ), iterations)
+
+    started = time.perf_counter()
+    level_curve.levels(xp_values)
+    print(f"Mapped {users} users to levels in {time.perf_counter() - started:.3f} s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    main(args.users, args.iterations)
@@ -0,0 +1,280 @@
+"""
+Load test of the whole bot against a fake Bot API server
+
+Starts the bot from main.py with long polling against a local stand-in for
+the Bot API (benchmarks.fake_bot_api) and lets N virtual users go through
+/start -> /test -> answers -> /lesson -> practice -> share at the same time.
+Nothing leaves the machine and the database is a temporary SQLite file.
+
+Two latencies are reported per step: handler latency, measured by a
+dispatcher middleware around every update, and response latency, from the
+moment a user acts until the reply they wait for arrives (this includes
+polling and the outbound rate limits, so OUTBOUND_* settings apply).
+
+Usage:
+    python -m benchmarks.load_test [--users 500] [--ramp 10] [--think 1]
+        [--latency 0.05] [--jitter 0.05] [--rate-limit 0.01] [--double-tap 0.1]
+        [--fsm memory]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+
+from benchmarks.fake_bot_api import FakeBotAPI
+
+# Funnel steps in the order users take them
+STEPS = ("/start", "/test", "start_test", "answer", "/lesson", "practice", "option", "share")
+
+
+class LoadStats:
+    """Latencies and error counts of a load test run"""
+
+    def __init__(self):
+        self.handler = defaultdict(list)
+        self.response = defaultdict(list)
+        self.handler_errors = Counter()
+        self.timeouts = Counter()
+        self.rejected = Counter()
+        self.finished = 0
+
+    async def middleware(self, handler, event, data):
+        """Dispatcher middleware timing every update"""
+        step = update_step(event)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.handler_errors[step] += 1
+            raise
+        finally:
+            self.handler[step].append(time.perf_counter() - started)
+
+
+def update_step(update):
+    """Get the funnel step of an update: the command or the callback data prefix"""
+    if update.message and update.message.text:
+        return update.message.text.split()[0]
+    if update.callback_query and update.callback_query.data:
+        return re.sub(r"_\d.*$", "", update.callback_query.data)
+    return "other"
+
+def buttons(message, prefix):
+    """Get the callback data of the inline buttons starting with a prefix"""
+    rows = (message.get("reply_markup") or {}).get("inline_keyboard", [])
+    return [
+        button["callback_data"] for row in rows for button in row
+        if button.get("callback_data", "").startswith(prefix)
+    ]
+
+def has_url_buttons(message):
+    """Check if a message has link buttons"""
+    rows = (message.get("reply_markup") or {}).get("inline_keyboard", [])
+    return any(button.get("url") for row in rows for button in row)
+
+def percentile(values, q):
+    """Get a percentile of sorted values"""
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0
+
+
+class VirtualUser:
+    """
+    Scripted user going through the funnel
+
+    Args:
+        user_id: Telegram user ID, also the chat ID
+        api: Fake Bot API server
+        stats: Statistics to record into
+        think: Average pause between actions, in seconds
+        timeout: Seconds to wait for a reply before giving up
+        double_tap: Share of answers pressed twice in a row
+    """
+
+    def __init__(self, user_id, api, stats, think, timeout, double_tap=0.0):
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        self.api = api
+        self.stats = stats
+        self.think = think
+        self.timeout = timeout
+        self.double_tap = double_tap
+        self.rng = random.Random(user_id)
+
+    async def act(self, step, push, expect):
+        """
+        Take an action and wait for the reply it leads to
+
+        Args:
+            step: Funnel step name
+            push: Function queueing the update
+            expect: Predicate of the awaited bot message
+
+        Returns:
+            Awaited bot message
+        """
+        if self.think:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.think))
+
+        started = time.perf_counter()
+        push()
+        deadline = started + self.timeout
+        while True:
+            _, message = await self.api.next_reply(self.user["id"], max(0, deadline - time.perf_counter()))
+            if expect(message):
+                self.stats.response[step].append(time.perf_counter() - started)
+                return message
+
+    async def send(self, step, text, expect):
+        """Send a text message"""
+        return await self.act(step, lambda: self.api.push_message(self.user, text), expect)
+
+    async def press(self, step, message, data, expect):
+        """Press an inline button of a bot message"""
+        return await self.act(step, lambda: self.api.push_callback(self.user, message, data), expect)
+
+    async def quiz(self, step, message, expect_finish):
+        """Answer questions with random options until the quiz ends"""
+        while buttons(message, f"{step}_"):
+            answer = self.rng.choice(buttons(message, f"{step}_"))
+            question = message
+
+            def push():
+                self.api.push_callback(self.user, question, answer)
+                if self.rng.random() < self.double_tap:
+                    self.api.push_callback(self.user, question, answer)
+
+            message = await self.act(
+                step, push, lambda reply: buttons(reply, f"{step}_") or expect_finish(reply)
+            )
+        return message
+
+    async def run(self):
+        """Go through the whole funnel"""
+        step = "/start"
+        try:
+            await self.send(step, "/start", lambda reply: True)
+
+            step = "/test"
+            message = await self.send(step, "/test", lambda reply: buttons(reply, "start_test"))
+            step = "start_test"
+            message = await self.press(step, message, "start_test", lambda reply: buttons(reply, "answer_"))
+            step = "answer"
+            await self.quiz(step, message, lambda reply: "/lesson" in reply.get("text", ""))
+
+            step = "/lesson"
+            message = await self.send(step, "/lesson", lambda reply: buttons(reply, "practice_"))
+            step = "practice"
+            message = await self.press(step, message, buttons(message, "practice_")[0], lambda reply: buttons(reply, "option_"))
+            step = "option"
+            message = await self.quiz(step, message, lambda reply: buttons(reply, "share_"))
+
+            step = "share"
+            message = await self.press(step, message, buttons(message, "share_")[0], lambda reply: "text" in reply)
+        except asyncio.TimeoutError:
+            self.stats.timeouts[step] += 1
+            return
+
+        # The bot answers with a text instead of the card when it is overloaded
+        if not has_url_buttons(message):
+            self.stats.rejected[step] += 1
+            return
+
+        self.stats.finished += 1
+
+
+async def run(args):
+    """Start the fake server and the bot, run all users and print the report"""
+    # The bot reads its configuration on import, so set it up first
+    tmp = tempfile.TemporaryDirectory()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp.name, 'load_test.db')}"
+    os.environ["FSM_STORAGE"] = args.fsm
+    os.environ.setdefault("BOT_TOKEN", "123456:LOAD-TEST")
+
+    import main as bot_main
+    from src.database.db import engine
+
+    engine.echo = False
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+
+    api = FakeBotAPI(args.latency, args.jitter, args.rate_limit, args.retry_after, seed=42)
+    await api.start()
+
+    stats = LoadStats()
+    bot_main.dp.update.outer_middleware(stats.middleware)
+    bot = Bot(
+        token=os.environ["BOT_TOKEN"],
+        session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    bot_task = asyncio.create_task(bot_main.main("polling", bot))
+    await api.polling.wait()
+
+    async def start_user(i):
+        await asyncio.sleep(args.ramp * i / args.users)
+        await VirtualUser(100000 + i, api, stats, args.think, args.timeout, args.double_tap).run()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start_user(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    await bot_main.dp.stop_polling()
+    await bot_task
+    await api.stop()
+    tmp.cleanup()
+
+    report(args, stats, api, elapsed)
+
+def report(args, stats, api, elapsed):
+    """Print the results"""
+    updates = sum(len(latencies) for latencies in stats.handler.values())
+    api_calls = sum(count for method, count in api.calls.items() if method != "getUpdates")
+    errors = sum(stats.handler_errors.values())
+    timeouts = sum(stats.timeouts.values())
+    rejected = sum(stats.rejected.values())
+    rate_limited = sum(api.rate_limited.values())
+
+    print(f"Users: {args.users}, finished the funnel: {stats.finished} ({stats.finished / args.users:.1%}), "
+          f"timed out: {timeouts}, rejected: {rejected}")
+    print(f"Elapsed: {elapsed:.1f} s, updates: {updates} ({updates / elapsed:.1f}/s), "
+          f"Bot API calls: {api_calls} ({api_calls / elapsed:.1f}/s)")
+    print(f"Handler errors: {errors} ({errors / max(updates, 1):.2%}), "
+          f"429 injected: {rate_limited} ({rate_limited / max(api_calls, 1):.2%})")
+    print()
+    print(f"{'step':<12} {'count':>7}  {'handler p50/p95/p99 ms':>23}  {'response p50/p95/p99 ms':>26}  "
+          f"{'errors':>6} {'timeouts':>8} {'rejected':>8}")
+    for step in STEPS:
+        handler = sorted(stats.handler[step])
+        response = sorted(stats.response[step])
+        print(
+            f"{step:<12} {len(handler):>7}  "
+            + " ".join(f"{percentile(handler, q) * 1000:7.1f}" for q in (0.5, 0.95, 0.99))
+            + "  "
+            + " ".join(f"{percentile(response, q) * 1000:8.1f}" for q in (0.5, 0.95, 0.99))
+            + f"  {stats.handler_errors[step]:>6} {stats.timeouts[step]:>8} {stats.rejected[step]:>8}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which users start")
+    parser.add_argument("--think", type=float, default=1, help="average pause between actions, seconds")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for a reply")
+    parser.add_argument("--latency", type=float, default=0.05, help="Bot API latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="random extra Bot API latency, seconds")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of send/edit calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of injected 429 responses")
+    parser.add_argument("--double-tap", type=float, default=0.0, help="share of answers pressed twice")
+    parser.add_argument("--fsm", choices=("db", "memory"), default="db", help="FSM storage")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
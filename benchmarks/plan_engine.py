@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of learning plan generation
+
+Compares the plan built with the nested list scans of the original
+generate_learning_plan() with the memoized plan engine, over every subset of
+the built-in weak areas. A synthetic catalogue with hundreds of lessons, dozens
+of categories and a random prerequisite DAG shows the cost of cold plans, when
+every key misses the cache.
+
+Usage:
+    python -m benchmarks.plan_engine [--iterations 100000] [--lessons 500]
+        [--categories 40] [--days 30]
+"""
+import argparse
+import itertools
+import random
+import time
+import timeit
+
+from src.lessons.plan_generator import DEFAULT_PLAN, TOPIC_TO_LESSON, PlanEngine, generate_learning_plan
+
+
+def scan_plan(weak_areas):
+    """Build the plan with the list scans of the original implementation"""
+    if not weak_areas:
+        return DEFAULT_PLAN
+    plan = {}
+    day = 1
+    for area in weak_areas:
+        for lesson_id in TOPIC_TO_LESSON.get(area, ()):
+            if day <= 7 and DEFAULT_PLAN[lesson_id] not in [topic for topic in plan.values()]:
+                plan[day] = DEFAULT_PLAN[lesson_id]
+                day += 1
+    for topic in DEFAULT_PLAN.values():
+        if day <= 7 and topic not in plan.values():
+            plan[day] = topic
+            day += 1
+    return plan
+
+def report(name, seconds, iterations):
+    """Print the time per call in microseconds"""
+    print(f"{name:<28} {seconds / iterations * 1e6:10.2f} us/call")
+
+def synthetic_engine(lessons, categories, days, rng):
+    """Build an engine over random lessons with up to three prerequisites each"""
+    topics = {lesson_id: f"Урок {lesson_id}" for lesson_id in range(lessons)}
+    prerequisites = {
+        lesson_id: rng.sample(range(lesson_id), min(lesson_id, rng.randint(0, 3)))
+        for lesson_id in range(1, lessons)
+    }
+    ids = list(topics)
+    rng.shuffle(ids)
+    per_category = max(1, lessons // categories)
+    area_lessons = {
+        f"category_{i}": ids[i * per_category:(i + 1) * per_category] for i in range(categories)
+    }
+    return PlanEngine(area_lessons, topics, prerequisites, days=days, cache_size=0)
+
+def main(iterations, lessons, categories, days):
+    """Run the benchmark"""
+    areas = list(TOPIC_TO_LESSON)
+    subsets = [
+        [area for i, area in enumerate(areas) if mask & (1 << i)] for mask in range(1 << len(areas))
+    ]
+
+    weak_areas = itertools.cycle(subsets)
+    report("list scans", timeit.timeit(lambda: scan_plan(next(weak_areas)), number=iterations), iterations)
+
+    weak_areas = itertools.cycle(subsets)
+    report("memoized engine", timeit.timeit(
+        lambda: generate_learning_plan(next(weak_areas)), number=iterations
+    ), iterations)
+
+    rng = random.Random(42)
+    started = time.perf_counter()
+    engine = synthetic_engine(lessons, categories, days, rng)
+    print(f"Built an engine over {lessons} lessons in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    keys = [rng.sample(list(engine.area_lessons), rng.randint(1, 5)) for _ in range(1000)]
+    weak_areas = itertools.cycle(keys)
+    report(f"cold {days}-day plan", timeit.timeit(
+        lambda: engine.plan(next(weak_areas)), number=min(iterations, 10000)
+    ), min(iterations, 10000))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--lessons", type=int, default=500)
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    main(args.iterations, args.lessons, args.categories, args.days)
@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of drawing diagnostic test questions
+
+Compares random.sample() over the whole question bank with the stratified
+sampler, on the built-in bank and on a synthetic bank with tens of thousands
+of questions, with and without excluding questions a user has already seen.
+Also counts how many tests leave a category without questions, which
+finish_test can't score.
+
+Usage:
+    python -m benchmarks.question_sampler [--questions 20000] [--categories 40]
+        [--count 10] [--seen 0.3] [--iterations 20000]
+"""
+import argparse
+import random
+import timeit
+
+from src.content.registry import Question, get_catalogue
+from src.lessons.test_questions import QuestionSampler, get_sampler
+
+
+def report(name, seconds, iterations):
+    """Print the time per call in microseconds"""
+    print(f"{name:<40} {seconds / iterations * 1e6:10.2f} us/call")
+
+def synthetic_bank(questions, categories):
+    """Build question records spread over categories"""
+    return [
+        Question(f"test:{i}", i, None, f"category_{i % categories}", f"Вопрос {i}", ("A", "B", "C", "D"), 0)
+        for i in range(1, questions + 1)
+    ]
+
+def uncovered(draw, questions, count, tests):
+    """Share of tests that have no question of some category"""
+    categories = {question.category for question in questions}
+    category = {question.id: question.category for question in questions}
+    missing = 0
+    for _ in range(tests):
+        if len({category[question_id] for question_id in draw(count)}) < min(len(categories), count):
+            missing += 1
+    return missing / tests
+
+def run_bank(name, questions, sampler, args, rng):
+    """Time both ways of drawing a test from one bank"""
+    ids = [question.id for question in questions]
+    seen = set(rng.sample(ids, int(len(ids) * args.seen)))
+    count = min(args.count, len(questions))
+
+    report(f"{name}: random.sample", timeit.timeit(
+        lambda: rng.sample(questions, count), number=args.iterations
+    ), args.iterations)
+    report(f"{name}: stratified", timeit.timeit(
+        lambda: sampler.sample(count, rng=rng), number=args.iterations
+    ), args.iterations)
+    report(f"{name}: stratified, {args.seen:.0%} seen", timeit.timeit(
+        lambda: sampler.sample(count, seen, rng=rng), number=args.iterations
+    ), args.iterations)
+
+    plain = uncovered(lambda n: [question.id for question in rng.sample(questions, n)], questions, count, 2000)
+    stratified = uncovered(lambda n: sampler.sample(n, rng=rng), questions, count, 2000)
+    print(f"{name}: tests missing a category: random.sample {plain:.1%}, stratified {stratified:.1%}")
+
+def main(args):
+    """Run the benchmark"""
+    rng = random.Random(42)
+
+    catalogue = get_catalogue()
+    run_bank("built-in", list(catalogue.test_questions), get_sampler(catalogue), args, rng)
+
+    questions = synthetic_bank(args.questions, args.categories)
+    run_bank(f"{args.questions} questions", questions, QuestionSampler(questions), args, rng)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--questions", type=int, default=20000)
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--seen", type=float, default=0.3, help="share of the bank the user has seen")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,528 @@
+"""
+Micro-benchmark suite of the per-update hot paths
+
+Runs every case with 1, 1k and 100k users held in memory (XP records,
+leaderboard, test sessions, lesson data and FSM state), so costs that grow
+with the number of users show up. Handlers talk to a bot session that
+answers API calls in-process, so only the bot's own work is timed.
+
+Results can be saved as JSON and compared with an earlier run, e.g. one from
+the previous commit: cases that got slower by more than the threshold are
+flagged and the exit code is 1.
+
+Usage:
+    python -m benchmarks.suite [--users 1,1000,100000] [--cases xp.,test.]
+        [--min-time 0.2] [--repeat 5] [--output results.json]
+        [--compare baseline.json] [--threshold 0.1]
+"""
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# The bot reads its configuration on import: keep the XP store writes in a
+# throwaway database and let main.py import without a real token
+_database_dir = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_database_dir.name, 'benchmarks.db')}"
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import SendPhoto
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, User
+
+from src.content.registry import get_catalogue
+from src.content.templates import CORRECT_VERDICT
+from src.database.db import engine, init_db
+from src.gamification.leaderboard import leaderboard, week_key
+from src.gamification.level_curve import level_curve
+from src.gamification.rules import achievement_bits
+from src.gamification.xp_system import user_xp_data, xp_store
+from src.lessons.lesson_handler import LessonStates, user_lesson_data
+from src.lessons.review import Deck, review_store
+from src.lessons.test_handler import user_test_data
+from src.lessons.test_questions import get_test_questions
+
+# Test categories, as scored by finish_test
+CATEGORIES = ("syntax", "data_types", "functions", "loops", "oop")
+
+# Benchmark cases by name, in the order they run
+CASES = {}
+
+BOT_ID = 1000000
+
+
+def case(name):
+    """
+    Register a benchmark case
+
+    The decorated function receives a Fixture and returns the operation to
+    time: a function or coroutine function without arguments.
+    """
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+class LocalSession(BaseSession):
+    """Bot session answering every API call in-process"""
+
+    def __init__(self):
+        super().__init__()
+        self._user = User(id=BOT_ID, is_bot=True, first_name="Python Tutor")
+        self._chat = Chat(id=1, type="private")
+
+    async def make_request(self, bot, method, timeout=None):
+        """Return a sent message for send/edit calls and True for the rest"""
+        name = type(method).__name__
+        if not name.startswith(("Send", "Edit")):
+            return True
+        photo = None
+        if isinstance(method, SendPhoto):
+            photo = [PhotoSize(file_id="photo", file_unique_id="photo", width=1200, height=630)]
+        return Message(
+            message_id=1, date=datetime.now(), chat=self._chat, from_user=self._user, photo=photo
+        ).as_(bot)
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        """Downloads are not used by the handlers"""
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        """Nothing to release"""
+
+
+class Fixture:
+    """
+    In-memory state of a number of users and the updates they send
+
+    Args:
+        users: Number of users
+        bot: Bot the updates are bound to
+    """
+
+    def __init__(self, users, bot):
+        self.users = users
+        self.bot = bot
+        self.rng = random.Random(42)
+        self.storage = MemoryStorage()
+        # Random users and XP amounts drawn in advance, so drawing them costs nothing
+        user_ids = [self.rng.randint(1, users) for _ in range(4096)]
+        self._user_ids = itertools.cycle(user_ids)
+        self.xp_values = itertools.cycle([self.rng.randint(0, 20000) for _ in range(4096)])
+
+        # Updates of those users built in advance as well
+        self._messages = {}
+        self._callbacks = {}
+        for user_id in set(user_ids):
+            self.callback(user_id, f"answer_{user_id % 4}")
+            self.callback(user_id, f"option_{user_id % 4}")
+
+        catalogue = get_catalogue()
+        self.lesson = catalogue.lessons[0]
+        self.test_question_ids = get_test_questions(10, catalogue, rng=self.rng)
+        self.test_questions = [catalogue.test_question(question_id) for question_id in self.test_question_ids]
+        # Completed test sessions with different weak areas
+        self.finished_tests = [self.test_session(len(self.test_questions)) for _ in range(32)]
+
+    def test_session(self, answered):
+        """Build the test data of a user who answered some questions"""
+        counts = {category: 0 for category in CATEGORIES}
+        scores = {category: 0 for category in CATEGORIES}
+        answers = []
+        for question in self.test_questions[:answered]:
+            correct = self.rng.random() < 0.6
+            counts[question.category] += 1
+            scores[question.category] += correct
+            answers.append({"question_id": question.id, "selected_option": 0, "is_correct": correct})
+        return {
+            "content_version": get_catalogue().version,
+            "question_ids": self.test_question_ids,
+            "current_question": answered,
+            "answers": answers,
+            "category_scores": scores,
+            "category_counts": counts
+        }
+
+    async def populate(self):
+        """Fill the bot's in-memory state with the users"""
+        user_xp_data.clear()
+        user_test_data.clear()
+        user_lesson_data.clear()
+        review_store.decks.clear()
+        leaderboard.index.clear()
+
+        catalogue = get_catalogue()
+        week = week_key()
+        now = datetime.now()
+        for user_id in range(1, self.users + 1):
+            xp = self.rng.randint(0, 20000)
+            weekly_xp = self.rng.randint(1, 60) * 10
+            achievements = [
+                {"id": a.id, "name": a.name, "description": a.description, "earned_date": now}
+                for a in self.rng.sample(catalogue.achievements, self.rng.randint(0, 3))
+            ]
+            user_xp_data[user_id] = {
+                "xp": xp,
+                "level": level_curve.level(xp),
+                "streak_days": self.rng.randint(0, 30),
+                "last_activity": now - timedelta(hours=self.rng.randint(0, 48)),
+                "weekly_xp": weekly_xp,
+                "xp_week": week,
+                "first_name": f"User{user_id}",
+                "counters": {"lessons_completed": self.rng.randint(0, 7)},
+                "achievement_bits": achievement_bits(a["id"] for a in achievements),
+                "achievements": achievements
+            }
+            leaderboard.add(user_id, weekly_xp, week)
+            user_test_data[user_id] = self.test_session(self.rng.randrange(len(self.test_questions)))
+            user_lesson_data[user_id] = {
+                "current_lesson": 1,
+                "last_lesson_date": now,
+                "completed_lessons": []
+            }
+            # Users without review cards, so answers don't read the database
+            review_store.decks[user_id] = Deck()
+
+            key = self.key(user_id)
+            await self.storage.set_state(key, LessonStates.answering_questions)
+            await self.storage.set_data(key, {
+                "lesson_id": self.lesson.id,
+                "content_version": catalogue.version,
+                "question_count": len(self.lesson.questions),
+                "current_question": self.rng.randrange(len(self.lesson.questions)),
+                "correct_answers": 0
+            })
+
+    def user(self):
+        """Get a random user ID"""
+        return next(self._user_ids)
+
+    def key(self, user_id):
+        """Get the FSM storage key of a user"""
+        return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+    def state(self, user_id):
+        """Get the FSM context of a user"""
+        return FSMContext(storage=self.storage, key=self.key(user_id))
+
+    def message(self, user_id):
+        """Get a bot message in a user's chat, as handlers receive it"""
+        message = self._messages.get(user_id)
+        if message is None:
+            message = self._messages[user_id] = Message(
+                message_id=1,
+                date=datetime.now(),
+                chat=Chat(id=user_id, type="private"),
+                from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}"),
+                text="/progress"
+            ).as_(self.bot)
+        return message
+
+    def callback(self, user_id, data):
+        """Get a button press of a user on a bot message"""
+        callback = self._callbacks.get((user_id, data))
+        if callback is None:
+            callback = self._callbacks[(user_id, data)] = CallbackQuery(
+                id=f"{user_id}:{data}",
+                from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}"),
+                chat_instance=str(user_id),
+                message=self.message(user_id),
+                data=data
+            ).as_(self.bot)
+        return callback
+
+
+@case("test.send_question")
+def test_send_question(fixture):
+    from src.lessons.test_handler import send_question
+
+    async def op():
+        user_id = fixture.user()
+        await send_question(fixture.message(user_id), user_id, CORRECT_VERDICT)
+    return op
+
+@case("test.process_answer")
+def test_process_answer(fixture):
+    from src.lessons.test_handler import process_answer
+
+    async def op():
+        user_id = fixture.user()
+        test_data = user_test_data[user_id]
+        # Stay before the last question, which would finish the test
+        test_data["current_question"] = user_id % (len(test_data["question_ids"]) - 1)
+        del test_data["answers"][:]
+        await process_answer(fixture.callback(user_id, f"answer_{user_id % 4}"), fixture.state(user_id))
+    return op
+
+@case("test.get_test_questions")
+def test_get_test_questions(fixture):
+    seen = set(fixture.test_question_ids[:5])
+
+    return lambda: get_test_questions(10, exclude=seen, rng=fixture.rng)
+
+@case("test.finish_test")
+def test_finish_test(fixture):
+    from src.lessons.test_handler import finish_test
+
+    sessions = itertools.cycle(fixture.finished_tests)
+
+    async def op():
+        user_id = fixture.user()
+        session = user_test_data[user_id] = next(sessions)
+        await finish_test(fixture.message(user_id), user_id)
+        user_test_data[user_id] = session
+    return op
+
+@case("lesson.send_question")
+def lesson_send_question(fixture):
+    from src.lessons.lesson_handler import send_question
+
+    async def op():
+        user_id = fixture.user()
+        await send_question(fixture.message(user_id), fixture.state(user_id), CORRECT_VERDICT)
+    return op
+
+@case("lesson.process_practice_answer")
+def lesson_process_practice_answer(fixture):
+    from src.lessons.lesson_handler import process_practice_answer
+
+    last_question = len(fixture.lesson.questions) - 1
+
+    async def op():
+        user_id = fixture.user()
+        state = fixture.state(user_id)
+        # Stay before the last question, which would finish the practice
+        await state.update_data(current_question=user_id % max(last_question, 1))
+        await process_practice_answer(fixture.callback(user_id, f"option_{user_id % 4}"), state)
+    return op
+
+@case("plan.generate_learning_plan")
+def plan_generate_learning_plan(fixture):
+    from src.lessons.plan_generator import generate_learning_plan
+
+    weak_areas = itertools.cycle([
+        [category for i, category in enumerate(CATEGORIES) if mask & (1 << i)]
+        for mask in range(1 << len(CATEGORIES))
+    ])
+    return lambda: generate_learning_plan(next(weak_areas))
+
+@case("review.record")
+def review_record(fixture):
+    keys = itertools.cycle([question.key for question in fixture.test_questions])
+
+    async def op():
+        await review_store.record(fixture.user(), next(keys), fixture.rng.random() < 0.7)
+    return op
+
+@case("review.due")
+def review_due(fixture):
+    later = datetime.now() + timedelta(days=30)
+
+    async def op():
+        await review_store.due(fixture.user(), 10, later)
+    return op
+
+@case("xp.award_xp")
+def xp_award_xp(fixture):
+    from src.gamification.xp_system import award_xp
+
+    async def op():
+        await award_xp(fixture.user(), 20, "correct_answer", lesson_id=1, question_key="1:1")
+    return op
+
+@case("xp.award_achievement")
+def xp_award_achievement(fixture):
+    from src.gamification.rules import achievement_bit
+    from src.gamification.xp_system import award_achievement
+
+    bit = achievement_bit("perfect_score")
+
+    async def op():
+        user_id = fixture.user()
+        user_data = user_xp_data[user_id]
+        user_data["achievement_bits"] &= ~bit
+        await award_achievement(user_id, "perfect_score")
+        user_data["achievements"].pop()
+    return op
+
+@case("xp.calculate_level")
+def xp_calculate_level(fixture):
+    from src.gamification.xp_system import calculate_level
+
+    return lambda: calculate_level(next(fixture.xp_values))
+
+@case("share.generate_share_image")
+def share_generate_share_image(fixture):
+    from src.social.share_generator import generate_share_image
+
+    async def op():
+        await generate_share_image(user_xp_data[fixture.user()])
+    return op
+
+@case("progress.format")
+def progress_format(fixture):
+    from main import progress_handler
+
+    async def op():
+        await progress_handler(fixture.message(fixture.user()))
+    return op
+
+
+async def measure(op, min_time, repeat):
+    """
+    Time an operation
+
+    Args:
+        op: Function or coroutine function without arguments
+        min_time: Minimum duration of one timing run, in seconds
+        repeat: Number of timing runs
+
+    Returns:
+        Tuple of (best seconds per call, calls per run)
+    """
+    is_async = asyncio.iscoroutinefunction(op)
+
+    async def run(number):
+        # Like timeit, keep garbage collection out of the measurement
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            if is_async:
+                for _ in range(number):
+                    await op()
+            else:
+                for _ in range(number):
+                    op()
+            elapsed = time.perf_counter() - started
+        finally:
+            gc.enable()
+        # Write the buffered XP changes and review cards outside of the timed part
+        await xp_store.flush()
+        await review_store.flush()
+        return elapsed
+
+    await run(3)
+
+    # Grow the number of calls until one run takes at least min_time
+    number = 1
+    while (elapsed := await run(number)) < min_time:
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.2))
+
+    times = [elapsed] + [await run(number) for _ in range(repeat - 1)]
+    return min(times) / number, number
+
+def git_commit():
+    """Get the current commit hash, if the suite runs in a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with an earlier run
+
+    Args:
+        results: List of result dictionaries
+        baseline: Results file contents of the earlier run
+        threshold: Relative slowdown that counts as a regression
+
+    Returns:
+        Dictionary mapping (case, users) to the relative change
+    """
+    before = {(r["case"], r["users"]): r["us_per_op"] for r in baseline["results"]}
+    return {
+        (r["case"], r["users"]): r["us_per_op"] / before[(r["case"], r["users"])] - 1
+        for r in results if before.get((r["case"], r["users"]))
+    }
+
+async def main(args):
+    """Run the selected cases at every fixture size and print the results"""
+    engine.echo = False
+    logging.getLogger("aiogram").setLevel(logging.WARNING)
+    await init_db()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Comparing with {args.compare} (commit {baseline.get('commit')})")
+
+    selected = [
+        name for name in CASES
+        if not args.cases or any(name.startswith(prefix) for prefix in args.cases.split(","))
+    ]
+
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=LocalSession())
+    results = []
+    regressions = 0
+    try:
+        for users in (int(n) for n in args.users.split(",")):
+            fixture = Fixture(users, bot)
+            started = time.perf_counter()
+            await fixture.populate()
+            print(f"\n{users} users (fixture built in {time.perf_counter() - started:.1f} s)")
+
+            for name in selected:
+                seconds, number = await measure(CASES[name](fixture), args.min_time, args.repeat)
+                result = {"case": name, "users": users, "us_per_op": seconds * 1e6, "ops": number}
+                results.append(result)
+
+                line = f"  {name:<34} {seconds * 1e6:12.2f} us/op"
+                if baseline:
+                    change = compare([result], baseline, args.threshold).get((name, users))
+                    if change is not None:
+                        flag = "  REGRESSION" if change > args.threshold else ""
+                        regressions += bool(flag)
+                        line += f"  {change:+8.1%}{flag}"
+                print(line)
+    finally:
+        from src.social.renderer import share_renderer
+        share_renderer.shutdown()
+        await bot.session.close()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "commit": git_commit(),
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "results": results
+            }, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    if regressions:
+        print(f"\n{regressions} case(s) slower than the baseline by more than {args.threshold:.0%}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", default="1,1000,100000", help="comma-separated fixture sizes")
+    parser.add_argument("--cases", default="", help="comma-separated case name prefixes")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per case, the best one counts")
+    parser.add_argument("--output", help="save the results to a JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    sys.exit(1 if asyncio.run(main(args)) else 0)
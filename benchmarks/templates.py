@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of precompiled question and lesson templates
+
+Compares building the question message and keyboard on every update (as the
+handlers used to) with filling in a precompiled template.
+
+Usage:
+    python -m benchmarks.templates [--iterations 20000]
+"""
+import argparse
+import timeit
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from src.content.registry import get_catalogue
+from src.content.templates import get_templates
+
+
+def build_question(question, number, total):
+    """Build a question message the way the handlers did before templates"""
+    builder = InlineKeyboardBuilder()
+    letters = ['A', 'B', 'C', 'D']
+    for i, _ in enumerate(question.options):
+        if i < len(letters):
+            builder.button(text=letters[i], callback_data=f"answer_{i}")
+
+    options_text = ""
+    for i, option in enumerate(question.options):
+        if i < len(letters):
+            options_text += f"{letters[i]}. {option}\n"
+
+    return (
+        f"Вопрос {number} из {total}:\n\n"
+        f"{question.text}\n\n"
+        f"{options_text}",
+        builder.as_markup()
+    )
+
+def build_lesson(lesson):
+    """Build a lesson message the way the handler did before templates"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="Перейти к практике", callback_data=f"practice_{lesson.id}")
+    return (
+        f"<b>Урок {lesson.id}: {lesson.topic}</b>\n\n"
+        f"{lesson.theory}\n\n"
+        f"<code>{lesson.code_example}</code>\n\n"
+        f"Когда будете готовы, переходите к практическим заданиям.",
+        builder.as_markup()
+    )
+
+def report(name, seconds, iterations):
+    """Print the time per call in microseconds"""
+    print(f"{name:<28} {seconds / iterations * 1e6:8.2f} us/update")
+
+def main(iterations):
+    """Run the benchmark"""
+    catalogue = get_catalogue()
+    templates = get_templates(catalogue)
+    question = catalogue.test_questions[0]
+    lesson = catalogue.lessons[0]
+
+    report("question: build", timeit.timeit(
+        lambda: build_question(question, 3, 10), number=iterations
+    ), iterations)
+    report("question: template", timeit.timeit(
+        lambda: (templates.question(question.key).render(3, 10),
+                 templates.question(question.key).reply_markup),
+        number=iterations
+    ), iterations)
+    report("lesson: build", timeit.timeit(
+        lambda: build_lesson(lesson), number=iterations
+    ), iterations)
+    report("lesson: template", timeit.timeit(
+        lambda: templates.lesson(lesson.id).text, number=iterations
+    ), iterations)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    main(args.iterations)
@@ -1,18 +1,31 @@
 """
-Script to initialize the database with sample data
+Script to initialize the database and sync lesson content into it
+
+Creates missing tables, then compares the content (built-in or the content
+pack from CONTENT_DIR) with the database by a per-row content hash and
+applies only the needed inserts, updates and deletes in a single
+transaction. User tables are never touched.
+
+Usage:
+    python init_db.py [--dry-run] [--echo]
 """
+import argparse
 import asyncio
+import hashlib
+import json
 import os
+import time
 from dotenv import load_dotenv
+from sqlalchemy import delete, insert, select, update
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.future import select
 
 # Load environment variables
 load_dotenv()
 
 # Import models
-from src.database.models import Base, User, Question, Lesson, Achievement
+from src.database.db import init_db
+from src.database.models import Question, Lesson, Achievement
 
 # Get database URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database.db")
@@ -21,80 +34,176 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database.db")
 if DATABASE_URL.startswith("sqlite:"):
     DATABASE_URL = DATABASE_URL.replace("sqlite:", "sqlite+aiosqlite:", 1)
 
-# Create async engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Maximum number of IDs in one DELETE ... IN (...) statement
+DELETE_CHUNK_SIZE = 500
+
+def content_hash(row):
+    """
+    Hash the content of a row
+
+    Args:
+        row: Dictionary of column values
+
+    Returns:
+        Hex digest
+    """
+    return hashlib.sha256(json.dumps(row, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+def content_rows(catalogue):
+    """
+    Build the desired content rows from a catalogue
+
+    Args:
+        catalogue: Content catalogue
+
+    Returns:
+        Dictionary mapping models to {key: row} dictionaries
+    """
+    lessons = {}
+    questions = {}
+    achievements = {}
+
+    for lesson in catalogue.lessons:
+        lessons[lesson.id] = {
+            "id": lesson.id,
+            "topic": lesson.topic,
+            "theory": lesson.theory,
+            "code_example": lesson.code_example
+        }
+
+    for question in catalogue.test_questions + tuple(
+        question for lesson in catalogue.lessons for question in lesson.questions
+    ):
+        questions[question.key] = {
+            "content_key": question.key,
+            "lesson_id": question.lesson_id,
+            "is_test_question": question.lesson_id is None,
+            "category": question.category,
+            "text": question.text,
+            "options": list(question.options),
+            "correct_index": question.correct_index
+        }
+
+    for achievement in catalogue.achievements:
+        achievements[achievement.id] = {
+            "id": achievement.id,
+            "name": achievement.name,
+            "description": achievement.description,
+            "xp_reward": achievement.xp_reward
+        }
+
+    for rows in (lessons, questions, achievements):
+        for row in rows.values():
+            row["content_hash"] = content_hash(row)
+
+    return {Lesson: lessons, Question: questions, Achievement: achievements}
+
+async def diff_table(session, model, rows):
+    """
+    Compare desired rows with the database
+
+    Args:
+        session: Database session
+        model: Content model
+        rows: Desired rows by key
 
-# Create async session factory
-async_session = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
+    Returns:
+        Tuple of (rows to insert, rows to update, primary keys to delete)
+    """
+    key_column = model.content_key if model is Question else model.id
+    existing = {}
+    deletes = []
+    for key, row_id, row_hash in (await session.execute(
+        select(key_column, model.id, model.content_hash)
+    )).all():
+        # Rows without a key come from the old drop-and-reinsert script
+        if key is None or key not in rows:
+            deletes.append(row_id)
+        else:
+            existing[key] = (row_id, row_hash)
 
-async def init_db():
-    """Initialize the database, creating all tables"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+    inserts = []
+    updates = []
+    for key, row in rows.items():
+        if key not in existing:
+            inserts.append(row)
+        elif existing[key][1] != row["content_hash"]:
+            updates.append({**row, "id": existing[key][0]})
+
+    return inserts, updates, deletes
+
+async def sync_content(engine, catalogue, dry_run=False):
+    """
+    Sync content into the database
+
+    Args:
+        engine: Async engine
+        catalogue: Content catalogue
+        dry_run: Only report the changes
+
+    Returns:
+        Dictionary mapping table names to (inserted, updated, deleted) counts
+    """
+    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    report = {}
 
-async def populate_db():
-    """Populate the database with sample data"""
     async with async_session() as session:
-        # Import sample data
-        from src.lessons.test_questions import DIAGNOSTIC_TEST
-        from src.lessons.lesson_content import LESSONS
-        from src.gamification.achievements import ACHIEVEMENTS
-        
-        # Add test questions
-        for question_data in DIAGNOSTIC_TEST:
-            question = Question(
-                id=question_data["id"],
-                is_test_question=True,
-                category=question_data["category"],
-                text=question_data["text"],
-                options=question_data["options"],
-                correct_index=question_data["correct_index"]
-            )
-            session.add(question)
-        
-        # Add lessons and their questions
-        for lesson_data in LESSONS:
-            lesson = Lesson(
-                id=lesson_data["id"],
-                topic=lesson_data["topic"],
-                theory=lesson_data["theory"],
-                code_example=lesson_data["code_example"]
-            )
-            session.add(lesson)
-            
-            # Add lesson questions
-            for i, question_data in enumerate(lesson_data["questions"]):
-                question = Question(
-                    lesson_id=lesson_data["id"],
-                    is_test_question=False,
-                    category=lesson_data["topic"].split(":")[0].lower(),
-                    text=question_data["text"],
-                    options=question_data["options"],
-                    correct_index=question_data["correct_index"]
-                )
-                session.add(question)
-        
-        # Add achievements
-        for achievement_data in ACHIEVEMENTS:
-            achievement = Achievement(
-                id=achievement_data["id"],
-                name=achievement_data["name"],
-                description=achievement_data["description"],
-                xp_reward=achievement_data["xp_reward"]
-            )
-            session.add(achievement)
-        
-        # Commit all changes
-        await session.commit()
-
-async def main():
+        async with session.begin():
+            # Lessons go first so that their questions can refer to them
+            for model, rows in content_rows(catalogue).items():
+                inserts, updates, deletes = await diff_table(session, model, rows)
+                report[model.__tablename__] = (len(inserts), len(updates), len(deletes))
+                if dry_run:
+                    continue
+
+                if inserts:
+                    await session.execute(insert(model), inserts)
+                if updates:
+                    await session.execute(update(model), updates)
+                for i in range(0, len(deletes), DELETE_CHUNK_SIZE):
+                    await session.execute(
+                        delete(model).where(model.id.in_(deletes[i:i + DELETE_CHUNK_SIZE]))
+                    )
+
+    return report
+
+async def main(dry_run=False, echo=False):
     """Main function"""
-    await init_db()
-    await populate_db()
-    print("Database initialized and populated with sample data!")
+    from src.content.packs import reload_content
+    from src.content.registry import get_catalogue
+
+    started = time.perf_counter()
+    engine = create_async_engine(DATABASE_URL, echo=echo)
+
+    await init_db(engine)
+
+    reload_content()
+    catalogue = get_catalogue()
+    loaded = time.perf_counter()
+
+    report = await sync_content(engine, catalogue, dry_run=dry_run)
+    synced = time.perf_counter()
+
+    # XP earned before the ledger existed becomes an opening balance
+    seeded = 0
+    if not dry_run:
+        from src.gamification.xp_ledger import seed_opening_balances
+        seeded = await seed_opening_balances(
+            sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        )
+    await engine.dispose()
+
+    print(f"Content version {catalogue.version}" + (" (dry run, nothing written)" if dry_run else ""))
+    for table, (inserted, updated, deleted) in report.items():
+        print(f"  {table:<14} +{inserted} ~{updated} -{deleted}")
+    if seeded:
+        print(f"Recorded opening XP balances of {seeded} users")
+    print(f"Prepared in {(loaded - started) * 1000:.0f} ms, synced in {(synced - loaded) * 1000:.0f} ms")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create tables and sync lesson content into the database")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the changes")
+    parser.add_argument("--echo", action="store_true", help="Log SQL statements")
+    args = parser.parse_args()
+
+    asyncio.run(main(dry_run=args.dry_run, echo=args.echo))
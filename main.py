@@ -4,16 +4,33 @@ Main application file for Python Tutor Bot
 import asyncio
 import logging
 import os
+from html import escape
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandStart
 from aiogram.types import Message
 from aiogram.client.default import DefaultBotProperties
+from aiogram.fsm.storage.memory import MemoryStorage
 
-from src.database.db import init_db
+from src.bot.executor import update_executor
+from src.bot.metrics import api_metrics, handler_metrics, instrument_engine, metrics, metrics_server
+from src.bot.outbound import outbound
+from src.bot.timers import timers
+from src.bot.webhook import run_webhook
+from src.content.packs import CONTENT_WATCH_INTERVAL, has_pack, reload_content, watch_content
+from src.content.registry import ContentError
+from src.content.templates import get_templates
+from src.database.db import engine, init_db
+from src.database.fsm_storage import SQLAlchemyStorage
+from src.gamification.leaderboard import get_display_names, leaderboard
+from src.gamification.xp_system import get_user_data, remember_name, user_xp_data, xp_store
+from src.social.renderer import share_renderer
 from src.lessons.test_handler import router as test_router
 from src.lessons.lesson_handler import router as lesson_router
+from src.lessons.reminders import reminders
+from src.lessons.review import review_store
+from src.lessons.review_handler import router as review_router
 from src.social.share_handler import router as share_router
 
 # Load environment variables
@@ -24,11 +41,36 @@ logging.basicConfig(level=logging.INFO)
 
 # Initialize bot and dispatcher
 bot = Bot(token=os.getenv("BOT_TOKEN"), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+# Telegram user IDs allowed to use admin commands
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Keep FSM state in the database unless FSM_STORAGE=memory
+storage = MemoryStorage() if os.getenv("FSM_STORAGE") == "memory" else SQLAlchemyStorage()
+dp = Dispatcher(storage=storage, name="main")
+
+# Time every handler and report readiness on the metrics server
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+dp.startup.register(metrics_server.on_startup)
+dp.shutdown.register(metrics_server.on_shutdown)
+
+@dp.update.outer_middleware()
+async def remember_name_middleware(handler, event, data):
+    """
+    Keep the first names of users with progress up to date for the leaderboard
+    """
+    user = data.get("event_from_user")
+    if user is not None:
+        remember_name(user.id, user.first_name)
+    return await handler(event, data)
+
+# Run updates of one chat in order and of different chats in parallel
+dp.update.outer_middleware(update_executor)
 
 # Register routers
 dp.include_router(test_router)
 dp.include_router(lesson_router)
+dp.include_router(review_router)
 dp.include_router(share_router)
 
 @dp.message(CommandStart())
@@ -53,7 +95,9 @@ async def help_handler(message: Message) -> None:
         "/start - Начать взаимодействие с ботом\n"
         "/test - Пройти диагностический тест\n"
         "/lesson - Начать или продолжить урок\n"
+        "/review - Повторить пройденные вопросы\n"
         "/progress - Посмотреть свой прогресс\n"
+        "/leaderboard - Рейтинг недели\n"
         "/help - Показать это сообщение\n\n"
         "Как это работает:\n"
         "1. Пройдите тест для определения ваших слабых мест\n"
@@ -67,18 +111,15 @@ async def progress_handler(message: Message) -> None:
     """
     Handle the /progress command
     """
-    from src.gamification.xp_system import user_xp_data
-    
     user_id = message.from_user.id
     
-    if user_id not in user_xp_data:
+    user_data = await get_user_data(user_id)
+    if user_data is None:
         await message.answer(
             "У вас пока нет прогресса. Начните обучение с команды /test!"
         )
         return
     
-    user_data = user_xp_data[user_id]
-    
     # Format achievements
     achievements_text = "Нет достижений"
     if user_data.get("achievements"):
@@ -89,7 +130,7 @@ async def progress_handler(message: Message) -> None:
     lessons_text = "Нет пройденных уроков"
     if completed_lessons:
         from src.lessons.lesson_content import get_lesson_by_id
-        lessons_text = "\n".join([f"• Урок {lesson_id}: {get_lesson_by_id(lesson_id)['topic']}" for lesson_id in completed_lessons])
+        lessons_text = "\n".join([f"• Урок {lesson_id}: {get_lesson_by_id(lesson_id).topic}" for lesson_id in completed_lessons])
     
     await message.answer(
         f"📊 Ваш прогресс:\n\n"
@@ -100,18 +141,156 @@ async def progress_handler(message: Message) -> None:
         f"📚 Пройденные уроки:\n{lessons_text}"
     )
 
-async def main() -> None:
+@dp.message(Command("leaderboard"))
+async def leaderboard_handler(message: Message) -> None:
+    """
+    Handle the /leaderboard command - show the weekly top and the user's place
+    """
+    user_id = message.from_user.id
+    
+    top, place, weekly_xp = leaderboard.standings(user_id)
+    if not top:
+        await message.answer("На этой неделе еще никто не заработал XP. Станьте первым - начните с /lesson!")
+        return
+    
+    names = await get_display_names([top_user_id for top_user_id, _ in top], user_xp_data)
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    top_text = "\n".join(
+        f"{medals.get(i, f'{i}.')} {names[top_user_id]} - {xp} XP"
+        for i, (top_user_id, xp) in enumerate(top, start=1)
+    )
+    
+    if place is None:
+        place_text = "Вы пока не заработали XP на этой неделе."
+    else:
+        place_text = f"Ваше место: {place} из {len(leaderboard.index)} ({weekly_xp} XP)"
+    
+    await message.answer(f"🏆 Рейтинг недели:\n\n{top_text}\n\n{place_text}")
+
+@dp.message(Command("reload_content"))
+async def reload_content_handler(message: Message) -> None:
+    """
+    Handle the /reload_content admin command - reload the content pack
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    
+    try:
+        changed = await asyncio.to_thread(reload_content)
+    except ContentError as e:
+        await message.answer(f"Контент не обновлен, найдены ошибки:\n{escape(str(e))}")
+        return
+    
+    if changed:
+        await message.answer("Контент обновлен. Начатые уроки завершатся на старой версии.")
+    else:
+        await message.answer("Контент не изменился.")
+
+@dp.message(Command("queue_stats"))
+async def queue_stats_handler(message: Message) -> None:
+    """
+    Handle the /queue_stats admin command - show outbound queue metrics
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    
+    stats = outbound.stats()
+    lanes_text = "\n".join(
+        f"{name}: {lane['depth']} в очереди, ожидание {lane['wait_avg']:.2f} с "
+        f"(p95 {lane['wait_p95']:.2f} с, макс. {lane['wait_max']:.2f} с)"
+        for name, lane in stats["lanes"].items()
+    )
+    await message.answer(
+        f"📤 Очередь отправки: {stats['queued']} сообщений в {stats['chats']} чатах\n\n"
+        f"{lanes_text}\n\n"
+        f"Отправлено: {stats['sent']}, объединено: {stats['coalesced']}, "
+        f"повторов после 429: {stats['retried']}, ошибок: {stats['failed']}"
+    )
+
+async def main(mode: str = None, bot_instance: Bot = None) -> None:
     """
     Main function to start the bot
+    
+    Args:
+        mode: "polling" or "webhook", defaults to the BOT_MODE environment variable
+        bot_instance: Bot to run, defaults to one talking to the Telegram Bot API
     """
+    mode = mode or os.getenv("BOT_MODE", "polling")
+    
     # Initialize database
+    instrument_engine(engine)
     await init_db()
     
+    # Serve metrics and health probes
+    metrics.gauge("bot_outbound_queued_messages", "Messages waiting in the outbound queue",
+                  lambda: outbound.stats()["queued"])
+    await metrics_server.start()
+    
+    # Load the content pack, if any, and prebuild question and lesson messages
+    await asyncio.to_thread(reload_content)
+    get_templates()
+    watch_task = None
+    if has_pack() and CONTENT_WATCH_INTERVAL > 0:
+        watch_task = asyncio.create_task(watch_content())
+    
     # Initialize Bot instance with a default parse mode which will be passed to all API calls
-    bot_instance = Bot(token=os.getenv("BOT_TOKEN"), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    if bot_instance is None:
+        bot_instance = Bot(token=os.getenv("BOT_TOKEN"), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    
+    # Send all messages through the rate-limited outbound queue
+    bot_instance.session.middleware(outbound)
+    outbound.start()
+    
+    # Time Bot API requests as they are sent, after waiting in the queue
+    bot_instance.session.middleware(api_metrics)
+    
+    # Start writing XP data to the database in the background
+    xp_store.start()
+    
+    # Restore the weekly leaderboard
+    await leaderboard.load()
+    
+    # Restore the spaced-repetition due index and start writing review outcomes
+    await review_store.start()
+    metrics.gauge("bot_review_users_due", "Users with review questions due",
+                  review_store.count_users_due)
+    
+    # Start sending "next lesson is available" reminders
+    await reminders.start(bot_instance)
+    
+    # Start expiring lesson time limits and idle sessions
+    timers.start()
     
-    # Start polling
-    await dp.start_polling(bot_instance)
+    # Start receiving updates
+    try:
+        if mode == "webhook":
+            await run_webhook(dp, bot_instance)
+        else:
+            # The executor runs updates in the background, so the polling
+            # loop only hands them over and waits when the executor is full;
+            # the bot session is closed below, after the queued updates
+            await dp.start_polling(bot_instance, handle_as_tasks=False, close_bot_session=False)
+    finally:
+        if watch_task:
+            watch_task.cancel()
+        
+        # Stop timers, finish the accepted updates, stop reminders and
+        # deliver messages that are still queued
+        await timers.stop()
+        await update_executor.stop()
+        await reminders.stop()
+        await outbound.stop()
+        
+        # The dispatcher shutdown already closed the FSM storage, closing it
+        # again writes the state changed by the updates finished above
+        await dp.storage.close()
+        await bot_instance.session.close()
+        
+        # Save pending XP changes and review outcomes before exiting
+        await xp_store.stop()
+        await review_store.stop()
+        share_renderer.shutdown()
+        await metrics_server.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,6 +1,7 @@
 """
 Script to run the bot
 """
+import argparse
 import asyncio
 import logging
 import os
@@ -13,7 +14,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def main():
+async def main(mode=None):
     """Main function"""
     # Load environment variables
     load_dotenv()
@@ -28,10 +29,19 @@ async def main():
     
     # Import and run the bot
     from main import main as run_bot
-    await run_bot()
+    await run_bot(mode)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run Python Tutor Bot")
+    parser.add_argument(
+        "--mode",
+        choices=["polling", "webhook"],
+        default=None,
+        help="How to receive updates (default: BOT_MODE from .env or polling)"
+    )
+    args = parser.parse_args()
+    
     try:
-        asyncio.run(main())
+        asyncio.run(main(args.mode))
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped!")
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Per-chat ordered update executor
+
+Updates of different chats are processed in parallel, but the updates of one
+chat run strictly one after another, in the order they arrived. Without
+that, a double tap on an answer button runs two handlers against the same
+session data at once. The executor is installed as an outer update
+middleware: it puts the rest of the update processing into the chat's queue
+and returns, and each chat with queued updates has one worker task draining
+its queue.
+
+At most UPDATE_CONCURRENCY handlers run at a time across all chats. Once
+UPDATE_QUEUE_LIMIT updates are waiting, accepting the next update blocks,
+which stops long polling (or delays the webhook response) until the bot
+catches up.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Number of updates processed at the same time across all chats
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "100"))
+
+# Number of accepted but unprocessed updates before new ones have to wait
+UPDATE_QUEUE_LIMIT = int(os.getenv("UPDATE_QUEUE_LIMIT", "1000"))
+
+# Seconds to wait for queued updates when the bot stops
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "10"))
+
+
+class ChatExecutor(BaseMiddleware):
+    """
+    Outer update middleware running updates per chat in order
+
+    Args:
+        concurrency: Maximum number of updates processed at the same time
+        queue_limit: Maximum number of accepted but unprocessed updates
+    """
+
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, queue_limit=UPDATE_QUEUE_LIMIT):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+
+        # Queued jobs of each chat that has a worker
+        self._chats = {}
+        self._workers = set()
+        self._pending = 0
+        self._semaphore = None
+        self._space = None
+
+    @property
+    def pending(self):
+        """Number of accepted updates not processed yet"""
+        return self._pending
+
+    async def __call__(self, handler, event, data):
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        if chat is not None:
+            key = chat.id
+        elif user is not None:
+            key = ("user", user.id)
+        else:
+            # Updates without a chat or user have nothing to be ordered with
+            return await handler(event, data)
+
+        await self.submit(key, lambda: handler(event, data))
+
+    async def submit(self, key, job):
+        """
+        Queue a job after the other jobs of its chat
+
+        Waits while the executor is full.
+
+        Args:
+            key: Chat key, jobs with the same key run in order
+            job: Coroutine function without arguments
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._space = asyncio.Event()
+
+        while self._pending >= self.queue_limit:
+            self._space.clear()
+            await self._space.wait()
+
+        self._pending += 1
+        queue = self._chats.get(key)
+        if queue is None:
+            queue = self._chats[key] = deque()
+            worker = asyncio.create_task(self._drain(key, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        queue.append(job)
+
+    async def _drain(self, key, queue):
+        """Run the jobs of a chat one by one until its queue is empty"""
+        try:
+            while queue:
+                async with self._semaphore:
+                    try:
+                        await queue[0]()
+                    except Exception:
+                        logger.exception("Error while processing an update of chat %s", key)
+                queue.popleft()
+                self._pending -= 1
+                self._space.set()
+        finally:
+            del self._chats[key]
+
+    async def stop(self, timeout=UPDATE_DRAIN_TIMEOUT):
+        """
+        Wait for the queued updates to be processed
+
+        Args:
+            timeout: Seconds to wait before cancelling the rest
+        """
+        if not self._workers:
+            return
+        _, unfinished = await asyncio.wait(set(self._workers), timeout=timeout)
+        for worker in unfinished:
+            worker.cancel()
+        if unfinished:
+            logger.warning("Dropped the updates of %d chats on shutdown", len(unfinished))
+
+
+# Executor of all incoming updates
+update_executor = ChatExecutor()
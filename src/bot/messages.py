@@ -0,0 +1,60 @@
+"""
+Module for updating quiz messages
+
+In the default "edit" mode an answer replaces the question message with the
+verdict followed by the next question, so every tap costs one editMessageText
+call instead of two sendMessage calls. The "send" mode keeps the old
+behaviour of posting each verdict and question as new messages.
+"""
+import logging
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# How quiz answers are shown: "edit" the question message or "send" new messages
+QUIZ_MODE = os.getenv("QUIZ_MODE", "edit")
+
+
+def quiz_edits_messages():
+    """Check whether quiz answers edit the question message"""
+    return QUIZ_MODE == "edit"
+
+async def edit_or_answer(message, text, reply_markup=None):
+    """
+    Replace the text of a bot message, sending a new message if it can't be edited
+
+    Args:
+        message: Bot message to edit, e.g. the message of a callback query
+        text: New message text
+        reply_markup: New inline keyboard, or None to remove it
+    """
+    # Messages older than 48 hours arrive as InaccessibleMessage
+    if isinstance(message, Message):
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+            return
+        except TelegramBadRequest as e:
+            logger.debug("Can't edit message %s, sending a new one: %s", message.message_id, e)
+
+    await message.answer(text, reply_markup=reply_markup)
+
+async def show_quiz_message(message, text, reply_markup=None, verdict=None):
+    """
+    Show the next quiz message, together with the verdict on the previous answer
+
+    Args:
+        message: Message the user answered, or any message of the chat
+        text: Text of the next question or of the results
+        reply_markup: Inline keyboard of the next message
+        verdict: Feedback on the previous answer, None for the first question
+    """
+    if verdict is None:
+        await message.answer(text, reply_markup=reply_markup)
+    elif quiz_edits_messages():
+        await edit_or_answer(message, f"{verdict}\n\n{text}", reply_markup=reply_markup)
+    else:
+        await message.answer(verdict)
+        await message.answer(text, reply_markup=reply_markup)
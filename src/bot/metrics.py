@@ -0,0 +1,386 @@
+"""
+Metrics and health endpoint
+
+Collects latency histograms and error counts of:
+
+- update handlers, per router and handler (an inner dispatcher middleware)
+- Bot API calls, per method (a session middleware placed behind the outbound
+  queue, so it times the request itself and not the wait in the queue)
+- database statements, per statement type and table (SQLAlchemy engine events)
+
+and samples the event loop lag. A small aiohttp server on a local port
+serves them in the Prometheus text format on /metrics, next to /health (the
+process is alive) and /ready (the bot has started and the database answers).
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+# Address of the metrics and health server, METRICS_PORT=0 turns it off
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+
+# Seconds between event loop lag samples
+METRICS_LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+# Seconds the readiness probe waits for the database
+READY_DB_TIMEOUT = 1
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Table name after the keyword that introduces it in a statement
+_TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+[\"`]?(\w+)", re.IGNORECASE)
+
+
+def _escape(value):
+    """Escape a label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=""):
+    """Format a label set like {router="test",handler="start_test"}"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Monotonic counter with labels
+
+    Args:
+        name: Metric name
+        help_text: Description
+        labelnames: Names of the labels
+    """
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        """Add to the counter of a label set"""
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        """Get the Prometheus text lines"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """
+    Value read when the metrics are collected
+
+    Args:
+        name: Metric name
+        help_text: Description
+        read: Function returning the current value
+    """
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        """Get the Prometheus text lines"""
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+    """
+    Histogram with labels and fixed buckets
+
+    Args:
+        name: Metric name
+        help_text: Description
+        labelnames: Names of the labels
+        buckets: Sorted bucket upper bounds
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: count in each bucket (the last one is +Inf), then the sum
+        self._series = {}
+
+    def observe(self, labels, value):
+        """
+        Record a value
+
+        Args:
+            labels: Tuple of label values
+            value: Observed value
+        """
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        """Get the Prometheus text lines"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        """Create and register a counter"""
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, read):
+        """Create and register a gauge read by a function"""
+        return self._register(Gauge(name, help_text, read))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        """Create and register a histogram"""
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Get all metrics in the Prometheus text format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of the bot
+metrics = MetricsRegistry()
+
+HANDLER_SECONDS = metrics.histogram(
+    "bot_handler_duration_seconds", "Time spent in update handlers", ("router", "handler")
+)
+HANDLER_ERRORS = metrics.counter(
+    "bot_handler_errors_total", "Exceptions raised by update handlers", ("router", "handler", "error")
+)
+API_SECONDS = metrics.histogram(
+    "bot_api_request_duration_seconds", "Duration of Bot API requests", ("method",)
+)
+API_ERRORS = metrics.counter(
+    "bot_api_errors_total", "Failed Bot API requests", ("method", "error")
+)
+DB_SECONDS = metrics.histogram(
+    "bot_db_statement_duration_seconds", "Duration of database statements", ("statement", "table")
+)
+DB_ERRORS = metrics.counter(
+    "bot_db_errors_total", "Failed database statements", ("statement", "table")
+)
+LOOP_LAG_SECONDS = metrics.histogram(
+    "bot_event_loop_lag_seconds", "Delay of event loop callbacks beyond their scheduled time"
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner dispatcher middleware timing every handler call"""
+
+    async def __call__(self, handler, event, data):
+        router = data.get("event_router")
+        handler_object = data.get("handler")
+        labels = (
+            router.name if router else "",
+            handler_object.callback.__name__ if handler_object else ""
+        )
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(labels + (type(e).__name__,))
+            raise
+        finally:
+            HANDLER_SECONDS.observe(labels, time.perf_counter() - started)
+
+
+class APIMetricsMiddleware(BaseRequestMiddleware):
+    """Session middleware timing every Bot API request"""
+
+    async def __call__(self, make_request, bot, method):
+        labels = (method.__api_method__,)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(labels + (type(e).__name__,))
+            raise
+        finally:
+            API_SECONDS.observe(labels, time.perf_counter() - started)
+
+
+@lru_cache(maxsize=1024)
+def statement_labels(statement):
+    """
+    Get the metric labels of an SQL statement
+
+    Args:
+        statement: SQL text
+
+    Returns:
+        Tuple of (statement type, table), e.g. ("INSERT", "xp_events")
+    """
+    words = statement.split(None, 1)
+    match = _TABLE_PATTERN.search(statement)
+    return (words[0].upper() if words else "", match.group(1) if match else "")
+
+def instrument_engine(engine):
+    """
+    Time the statements of an async engine
+
+    Args:
+        engine: Async engine
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        DB_SECONDS.observe(statement_labels(statement), time.perf_counter() - conn.info["metrics_started"].pop())
+
+    @event.listens_for(sync_engine, "handle_error")
+    def count_error(context):
+        started = context.connection.info.get("metrics_started") if context.connection else None
+        if started:
+            started.pop()
+        DB_ERRORS.inc(statement_labels(context.statement or ""))
+
+
+class MetricsServer:
+    """
+    Local HTTP server for the metrics and health probes
+
+    Args:
+        registry: Metrics to serve
+        host: Address to listen on
+        port: Port to listen on, 0 to not serve at all
+        lag_interval: Seconds between event loop lag samples
+    """
+
+    def __init__(self, registry, host=METRICS_HOST, port=METRICS_PORT, lag_interval=METRICS_LOOP_LAG_INTERVAL):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        # Set when the bot starts receiving updates, cleared when it stops
+        self.ready = False
+        # Most recent event loop lag sample, in seconds
+        self.loop_lag = 0.0
+        self._runner = None
+        self._lag_task = None
+
+        registry.gauge("bot_ready", "1 when the bot is receiving updates", lambda: int(self.ready))
+        registry.gauge("bot_event_loop_lag_last_seconds", "Most recent event loop lag sample", lambda: self.loop_lag)
+
+    async def start(self):
+        """Start sampling the event loop lag and serving HTTP requests"""
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._sample_loop_lag())
+
+        if not self.port or self._runner is not None:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        app.router.add_get("/health", self._health)
+        app.router.add_get("/ready", self._ready)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError as e:
+            # Metrics are not worth failing the bot over
+            logger.warning("Metrics server not started on %s:%s: %s", self.host, self.port, e)
+            await runner.cleanup()
+            return
+        self._runner = runner
+        logger.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        """Stop the server and the lag sampling"""
+        self.ready = False
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def on_startup(self):
+        """Dispatcher startup handler marking the bot as ready"""
+        self.ready = True
+
+    async def on_shutdown(self):
+        """Dispatcher shutdown handler marking the bot as not ready"""
+        self.ready = False
+
+    async def _sample_loop_lag(self):
+        """Measure how late a sleep wakes up, which is how long callbacks wait for the loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(0.0, loop.time() - expected)
+            LOOP_LAG_SECONDS.observe((), self.loop_lag)
+
+    async def _metrics(self, request):
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def _health(self, request):
+        return web.Response(text="ok")
+
+    async def _ready(self, request):
+        from src.database.db import engine
+
+        if not self.ready:
+            return web.Response(status=503, text="starting")
+        try:
+            async with engine.connect() as conn:
+                await asyncio.wait_for(conn.execute(text("SELECT 1")), READY_DB_TIMEOUT)
+        except Exception as e:
+            return web.Response(status=503, text=f"database unavailable: {type(e).__name__}")
+        return web.Response(text="ready")
+
+
+# Middlewares and server of the bot
+handler_metrics = HandlerMetricsMiddleware()
+api_metrics = APIMetricsMiddleware()
+metrics_server = MetricsServer(metrics)
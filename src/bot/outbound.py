@@ -0,0 +1,445 @@
+"""
+Outbound message scheduler
+
+All messages the bot sends go through a single queue installed as a session
+middleware, so handlers keep calling message.answer() as before. The queue
+keeps the bot under Telegram's limits instead of running into 429 errors:
+
+- a global token bucket (about 30 messages per second)
+- a token bucket per chat (about 1 message per second, 20 per minute in groups)
+- priority lanes, so interactive replies go ahead of reminders and broadcasts
+- plain text messages queued for the same chat are merged into one
+- a 429 response pauses the chat for retry_after seconds and retries the message;
+  a retry_after longer than the chat's own interval comes from the global flood
+  limit, so it pauses all chats
+
+Messages to one chat are always sent in order, one request at a time.
+"""
+import asyncio
+import heapq
+import logging
+import os
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+logger = logging.getLogger(__name__)
+
+# Messages per second across all chats
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+
+# Messages per second to one private chat, and how many may be sent at once
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+
+# Messages per minute to one group chat
+OUTBOUND_GROUP_PER_MINUTE = float(os.getenv("OUTBOUND_GROUP_PER_MINUTE", "20"))
+
+# Number of times a message is retried after a 429 response
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Seconds to wait for queued messages when the bot stops
+OUTBOUND_DRAIN_TIMEOUT = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", "5"))
+
+# Priority lanes, lower goes first
+INTERACTIVE = 0
+REMINDER = 1
+BROADCAST = 2
+LANE_NAMES = ("interactive", "reminder", "broadcast")
+
+# API methods that post to a chat and count against the limits
+QUEUED_METHOD_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+# Maximum length of a text message
+MAX_MESSAGE_LENGTH = 4096
+
+# Number of recent wait times kept per lane for the metrics
+WAIT_SAMPLES = 1000
+
+_priority = ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority):
+    """
+    Send the messages of the enclosed code with a priority
+
+    Args:
+        priority: INTERACTIVE, REMINDER or BROADCAST
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter
+
+    Args:
+        rate: Tokens added per second
+        capacity: Maximum number of tokens
+        now: Current loop time
+    """
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Get the number of seconds until a token is available"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """Take a token"""
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now, seconds):
+        """Make the next token available no sooner than in the given number of seconds"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_full(self, now):
+        """Check whether the bucket has refilled completely"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class _Job:
+    """Queued API request, possibly merged from several messages"""
+    make_request: object
+    bot: object
+    method: object
+    priority: int
+    enqueued: float
+    futures: list = field(default_factory=list)
+    attempts: int = 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Session middleware that queues outgoing messages and sends them within the rate limits
+
+    Requests pass straight through until start() is called, so scripts that
+    create their own Bot are not affected.
+
+    Args:
+        global_rate: Messages per second across all chats
+        chat_rate: Messages per second to one private chat
+        chat_burst: Messages that may be sent to one chat at once
+        group_per_minute: Messages per minute to one group chat
+        max_retries: Number of retries after a 429 response
+    """
+
+    def __init__(self, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE,
+                 chat_burst=OUTBOUND_CHAT_BURST, group_per_minute=OUTBOUND_GROUP_PER_MINUTE,
+                 max_retries=OUTBOUND_MAX_RETRIES):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.max_retries = max_retries
+
+        # Pending jobs of each chat, in order
+        self._chats = {}
+        # Chats ready to send, one lane per priority
+        self._lanes = [deque() for _ in LANE_NAMES]
+        # Chats waiting for their bucket, as (ready time, sequence, chat ID)
+        self._delayed = []
+        self._sequence = 0
+        # Chats that are in a lane or delayed
+        self._scheduled = set()
+        # Chats with a request in progress
+        self._in_flight = set()
+        self._sending = set()
+
+        self._global_bucket = None
+        self._chat_buckets = {}
+
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+        # Metrics
+        self._depth = [0] * len(LANE_NAMES)
+        self._waits = [deque(maxlen=WAIT_SAMPLES) for _ in LANE_NAMES]
+        self._max_wait = [0.0] * len(LANE_NAMES)
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if (
+            self._task is None
+            or chat_id is None
+            or not type(method).__name__.startswith(QUEUED_METHOD_PREFIXES)
+        ):
+            return await make_request(bot, method)
+
+        loop = asyncio.get_running_loop()
+        job = _Job(make_request, bot, method, _priority.get(), loop.time(), [loop.create_future()])
+        self._depth[job.priority] += 1
+
+        queue = self._chats.setdefault(chat_id, deque())
+        queue.append(job)
+        if chat_id not in self._scheduled and chat_id not in self._in_flight:
+            self._schedule(chat_id, loop.time())
+            self._wakeup.set()
+
+        return await job.futures[0]
+
+    def _chat_bucket(self, chat_id, now):
+        """Get the token bucket of a chat"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Group and channel IDs are negative
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst, now)
+            else:
+                bucket = TokenBucket(self.group_rate, 1, now)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule(self, chat_id, now):
+        """Put a chat with pending jobs into its lane, or delay it until its bucket allows"""
+        self._scheduled.add(chat_id)
+        delay = self._chat_bucket(chat_id, now).delay(now)
+        if delay > 0:
+            self._sequence += 1
+            heapq.heappush(self._delayed, (now + delay, self._sequence, chat_id))
+        else:
+            self._lanes[self._chats[chat_id][0].priority].append(chat_id)
+
+    def _next_chat(self, now):
+        """Get the next ready chat from the highest priority lane, or None"""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._delayed)
+            self._lanes[self._chats[chat_id][0].priority].append(chat_id)
+
+        for lane in self._lanes:
+            if lane:
+                return lane.popleft()
+        return None
+
+    def _take_job(self, chat_id):
+        """Take the next job of a chat, merging the plain text messages queued behind it"""
+        queue = self._chats[chat_id]
+        job = queue.popleft()
+        self._depth[job.priority] -= len(job.futures)
+        while queue and _can_merge(job, queue[0]):
+            following = queue.popleft()
+            self._depth[following.priority] -= len(following.futures)
+            job = _Job(
+                following.make_request,
+                following.bot,
+                following.method.model_copy(
+                    update={"text": f"{job.method.text}\n\n{following.method.text}"}
+                ),
+                min(job.priority, following.priority),
+                job.enqueued,
+                job.futures + following.futures
+            )
+            self.coalesced += 1
+        return job
+
+    async def _run(self):
+        """Background loop handing ready chats to senders within the global limit"""
+        loop = asyncio.get_running_loop()
+        self._global_bucket = TokenBucket(self.global_rate, self.global_rate, loop.time())
+
+        while True:
+            now = loop.time()
+            global_delay = self._global_bucket.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            chat_id = self._next_chat(now)
+            if chat_id is None:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._scheduled.discard(chat_id)
+            job = self._take_job(chat_id)
+            if all(future.done() for future in job.futures):
+                # Every caller gave up waiting
+                self._finish(chat_id, job, now)
+                continue
+
+            self._global_bucket.take(now)
+            self._chat_bucket(chat_id, now).take(now)
+            self._in_flight.add(chat_id)
+
+            task = asyncio.create_task(self._send(chat_id, job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id, job):
+        """Make one request and resolve the futures of the messages it carries"""
+        loop = asyncio.get_running_loop()
+        job.attempts += 1
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            self.retried += 1
+            now = loop.time()
+            bucket = self._chat_bucket(chat_id, now)
+            bucket.pause(now, e.retry_after)
+            if e.retry_after > 1 / bucket.rate:
+                # Longer than the chat limit asks for, so the whole bot is over
+                # the global limit and every chat has to wait
+                self._global_bucket.pause(now, e.retry_after)
+            if job.attempts <= self.max_retries:
+                logger.warning("Rate limited in chat %s, retrying in %s s", chat_id, e.retry_after)
+                self._chats[chat_id].appendleft(job)
+                self._depth[job.priority] += len(job.futures)
+                self._in_flight.discard(chat_id)
+                self._schedule(chat_id, now)
+                self._wakeup.set()
+                return
+            self._fail(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.sent += 1
+            for future in job.futures:
+                if not future.done():
+                    future.set_result(result)
+
+        self._in_flight.discard(chat_id)
+        self._finish(chat_id, job, loop.time())
+
+    def _fail(self, job, error):
+        """Pass a request error to every message of a job"""
+        self.failed += 1
+        for future in job.futures:
+            if not future.done():
+                future.set_exception(error)
+
+    def _finish(self, chat_id, job, now):
+        """Record the wait time of a finished job and schedule the rest of the chat"""
+        wait = now - job.enqueued
+        self._waits[job.priority].append(wait)
+        self._max_wait[job.priority] = max(self._max_wait[job.priority], wait)
+
+        if self._chats[chat_id]:
+            self._schedule(chat_id, now)
+            self._wakeup.set()
+        else:
+            del self._chats[chat_id]
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is not None and bucket.is_full(now):
+                # Idle chats don't need to keep a bucket
+                del self._chat_buckets[chat_id]
+
+        if not self._chats:
+            # Drop the buckets of chats that became idle since
+            for idle_id in [c for c, b in self._chat_buckets.items() if b.is_full(now)]:
+                del self._chat_buckets[idle_id]
+
+    def stats(self):
+        """
+        Get queue metrics
+
+        Returns:
+            Dictionary with the queue depth and recent wait times (seconds) per lane,
+            and the numbers of sent, merged, retried and failed requests
+        """
+        lanes = {}
+        for priority, name in enumerate(LANE_NAMES):
+            waits = sorted(self._waits[priority])
+            lanes[name] = {
+                "depth": self._depth[priority],
+                "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": self._max_wait[priority]
+            }
+
+        return {
+            "queued": sum(self._depth),
+            "chats": len(self._chats),
+            "in_flight": len(self._in_flight),
+            "lanes": lanes,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "failed": self.failed
+        }
+
+    def start(self):
+        """Start queueing outgoing messages"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=OUTBOUND_DRAIN_TIMEOUT):
+        """
+        Send the queued messages and stop queueing
+
+        Args:
+            timeout: Seconds to wait for the queue to drain
+        """
+        if self._task is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self._chats or self._sending) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        for queue in self._chats.values():
+            for job in queue:
+                for future in job.futures:
+                    future.cancel()
+        self._chats.clear()
+        self._lanes = [deque() for _ in LANE_NAMES]
+        self._delayed.clear()
+        self._scheduled.clear()
+
+
+def _can_merge(job, following):
+    """Check whether two queued messages can be sent as one"""
+    first, second = job.method, following.method
+    if type(first) is not SendMessage or type(second) is not SendMessage:
+        return False
+    # A keyboard has to stay on the last message
+    if first.reply_markup is not None or first.entities or second.entities:
+        return False
+    if len(first.text) + len(second.text) + 2 > MAX_MESSAGE_LENGTH:
+        return False
+    return (
+        first.model_dump(exclude={"text", "reply_markup"})
+        == second.model_dump(exclude={"text", "reply_markup"})
+    )
+
+
+# Scheduler shared by all handlers
+outbound = OutboundScheduler()
@@ -0,0 +1,200 @@
+"""
+Hierarchical timer wheel for session deadlines
+
+Lesson time limits and idle session eviction need one timer per user, and
+most of those timers are cancelled or pushed back long before they fire.
+Instead of a sleeping asyncio task per user, all timers live in a few
+arrays of slots: the first level holds the next 64 ticks, each following
+level covers 64 times as long. Scheduling and cancelling a timer is a dict
+insert or delete, and one background task advances the wheel every tick,
+moving timers down a level when their slot comes up.
+"""
+import asyncio
+import inspect
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds per tick of the wheel
+TIMER_TICK = float(os.getenv("TIMER_TICK", "1"))
+
+# Slots per level (power of two) and number of levels; with 1 second ticks
+# the default wheel covers 64 ** 4 seconds, about 194 days
+WHEEL_BITS = 6
+WHEEL_LEVELS = 4
+
+
+class _Timer:
+    """Scheduled callback"""
+    __slots__ = ("key", "expires", "callback", "level", "slot")
+
+    def __init__(self, key, expires, callback):
+        self.key = key
+        self.expires = expires
+        self.callback = callback
+        self.level = 0
+        self.slot = 0
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel
+
+    Args:
+        tick: Seconds per tick
+        bits: Log2 of the number of slots per level
+        levels: Number of levels
+    """
+
+    def __init__(self, tick=TIMER_TICK, bits=WHEEL_BITS, levels=WHEEL_LEVELS):
+        self.tick = tick
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._levels = levels
+        self._wheels = [[{} for _ in range(1 << bits)] for _ in range(levels)]
+
+        # Timers by key
+        self._timers = {}
+        # Next tick to process, counted from the origin
+        self._origin = time.monotonic()
+        self._tick = 0
+
+        self._task = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def schedule(self, key, delay, callback):
+        """
+        Call a function after a delay, replacing the timer with the same key
+
+        Args:
+            key: Timer key, e.g. ("lesson", user_id)
+            delay: Seconds from now
+            callback: Function without arguments, may be a coroutine function
+        """
+        self.cancel(key)
+        if not self._timers:
+            # Nothing to process in between, so skip the idle ticks
+            self._tick = max(self._tick, self._current_tick())
+
+        expires = math.ceil((time.monotonic() - self._origin + delay) / self.tick)
+        timer = _Timer(key, max(expires, self._tick), callback)
+        self._timers[key] = timer
+        self._insert(timer)
+
+    def cancel(self, key):
+        """
+        Cancel a timer
+
+        Args:
+            key: Timer key
+
+        Returns:
+            True if the timer was pending
+        """
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        del self._wheels[timer.level][timer.slot][key]
+        return True
+
+    def _current_tick(self):
+        """Get the tick that the current time falls into"""
+        return int((time.monotonic() - self._origin) / self.tick)
+
+    def _insert(self, timer):
+        """Put a timer into the slot of the level covering its expiry"""
+        delta = timer.expires - self._tick
+        level = 0
+        while level < self._levels - 1 and delta >> (self._bits * (level + 1)):
+            level += 1
+
+        if delta >> (self._bits * self._levels):
+            # Beyond the wheel, park it in the last slot it can reach
+            timer.expires = self._tick + (1 << (self._bits * self._levels)) - 1
+
+        timer.level = level
+        timer.slot = (max(timer.expires, self._tick) >> (self._bits * level)) & self._mask
+        self._wheels[level][timer.slot][timer.key] = timer
+
+    def _step(self):
+        """Process the next tick and return the timers expiring in it"""
+        index = self._tick & self._mask
+        if index == 0:
+            # The first level wrapped around, move the timers of the next
+            # slot of each higher level down
+            for level in range(1, self._levels):
+                slot = (self._tick >> (self._bits * level)) & self._mask
+                timers = self._wheels[level][slot]
+                self._wheels[level][slot] = {}
+                for timer in timers.values():
+                    self._insert(timer)
+                if slot != 0:
+                    break
+
+        expired = self._wheels[0][index]
+        self._wheels[0][index] = {}
+        self._tick += 1
+
+        for key in expired:
+            del self._timers[key]
+        return list(expired.values())
+
+    def advance(self):
+        """
+        Advance the wheel to the current time
+
+        Returns:
+            Callbacks of the expired timers
+        """
+        target = self._current_tick()
+        expired = []
+        while self._tick <= target:
+            if not self._timers:
+                self._tick = target + 1
+                break
+            expired.extend(self._step())
+        return [timer.callback for timer in expired]
+
+    async def _call(self, callback):
+        """Run a timer callback"""
+        try:
+            result = callback()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception("Timer callback failed")
+
+    async def _run(self):
+        """Background loop advancing the wheel every tick"""
+        while True:
+            await asyncio.sleep(self.tick)
+            callbacks = self.advance()
+            if callbacks:
+                await asyncio.gather(*(self._call(callback) for callback in callbacks))
+
+    def start(self):
+        """Start the background loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background loop, pending timers are dropped"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Timers shared by all handlers
+timers = TimerWheel()
@@ -0,0 +1,101 @@
+"""
+Webhook serving mode for the bot
+
+Runs the dispatcher behind an aiohttp server instead of long polling, so that
+several bot workers can sit behind a load balancer.
+"""
+import asyncio
+import logging
+import os
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+# Address the aiohttp server listens on
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+
+# Public URL registered with Telegram (left untouched if not set)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+
+# Value Telegram sends back in the X-Telegram-Bot-Api-Secret-Token header
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# Number of simultaneous connections Telegram opens to the webhook
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+
+def create_app(dispatcher: Dispatcher, bot: Bot) -> web.Application:
+    """
+    Create an aiohttp application serving the dispatcher
+
+    Args:
+        dispatcher: Dispatcher with all routers included
+        bot: Bot instance used to process updates
+
+    Returns:
+        aiohttp Application
+    """
+    app = web.Application()
+
+    # Emit dispatcher startup/shutdown events together with the app, before
+    # the request handler closes the bot session on shutdown
+    setup_application(app, dispatcher, bot=bot)
+
+    # The update executor queues each update and returns, so updates are fed
+    # within the request: a full executor delays the response, and its
+    # UPDATE_CONCURRENCY limits the handlers running at once
+    handler = SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=WEBHOOK_SECRET
+    )
+    handler.register(app, path=WEBHOOK_PATH)
+
+    return app
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    """
+    Register the webhook and serve updates until the process is stopped
+
+    Args:
+        dispatcher: Dispatcher with all routers included
+        bot: Bot instance used to process updates
+    """
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is not set, incoming requests are not verified")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dispatcher.resolve_used_update_types()
+        )
+
+    runner = web.AppRunner(create_app(dispatcher, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info("Serving webhook on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    # Serve until SIGINT/SIGTERM so that shutdown hooks get a chance to run
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Signal handlers are not available on Windows
+            pass
+
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,3 @@
+"""
+Indexed, validated lesson, question and achievement content
+"""
@@ -0,0 +1,260 @@
+"""
+Module for loading content packs
+
+A content pack is a directory with JSON files that replace the built-in
+content:
+
+    lessons.json       list of lessons (see lesson_content.LESSONS)
+    questions.json     list of diagnostic questions (see test_questions.DIAGNOSTIC_TEST)
+    achievements.json  list of achievements (see achievements.ACHIEVEMENTS)
+
+Missing files fall back to the built-in content. A validated catalogue is
+cached in a binary snapshot next to the JSON files together with the hash of
+their contents, so an unchanged pack loads without parsing or validation.
+
+Usage:
+    python -m src.content.packs export [directory]   write built-in content as a pack
+    python -m src.content.packs compile [directory]  validate a pack and write its snapshot
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+
+from src.content.registry import Catalogue, ContentError, get_catalogue, set_catalogue
+
+logger = logging.getLogger(__name__)
+
+# Directory with the content pack
+CONTENT_DIR = os.getenv("CONTENT_DIR", "content")
+
+# Seconds between checks for changed pack files (0 disables watching)
+CONTENT_WATCH_INTERVAL = float(os.getenv("CONTENT_WATCH_INTERVAL", "5"))
+
+# Pack files and the catalogue argument each one replaces
+PACK_FILES = {
+    "lessons.json": "lessons",
+    "questions.json": "test_questions",
+    "achievements.json": "achievements"
+}
+
+SNAPSHOT_FILE = ".snapshot.pickle"
+
+# Bump when the pickled Catalogue layout changes
+SNAPSHOT_FORMAT = 1
+
+
+def _builtin_content():
+    """Get the built-in content as catalogue arguments"""
+    from src.gamification.achievements import ACHIEVEMENTS
+    from src.lessons.lesson_content import LESSONS
+    from src.lessons.plan_generator import DEFAULT_PLAN, TOPIC_TO_LESSON
+    from src.lessons.test_questions import DIAGNOSTIC_TEST
+
+    return {
+        "lessons": LESSONS,
+        "test_questions": DIAGNOSTIC_TEST,
+        "achievements": ACHIEVEMENTS,
+        "area_lessons": TOPIC_TO_LESSON,
+        "default_plan": DEFAULT_PLAN
+    }
+
+def has_pack(directory=CONTENT_DIR):
+    """
+    Check whether a directory contains a content pack
+
+    Args:
+        directory: Pack directory
+
+    Returns:
+        True if at least one pack file exists
+    """
+    return any(os.path.exists(os.path.join(directory, name)) for name in PACK_FILES)
+
+def _read_pack_files(directory):
+    """Read the raw pack files and compute the hash of the content they produce"""
+    builtin = _builtin_content()
+    digest = hashlib.sha256()
+    files = {}
+    for name in sorted(PACK_FILES):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                files[name] = f.read()
+            digest.update(files[name])
+        else:
+            # Built-in content used instead of the file is part of the version too
+            digest.update(json.dumps(builtin[PACK_FILES[name]], sort_keys=True).encode())
+
+    # The weak-area mapping and default plan always come from the code
+    digest.update(json.dumps(builtin["area_lessons"], sort_keys=True).encode())
+    digest.update(json.dumps(builtin["default_plan"], sort_keys=True).encode())
+
+    return files, digest.hexdigest()[:16]
+
+def _find_malformed(content, names):
+    """Find the pack file whose entries break building the catalogue"""
+    builtin = _builtin_content()
+    for name in sorted(names):
+        try:
+            Catalogue(**{**builtin, PACK_FILES[name]: content[PACK_FILES[name]]})
+        except (KeyError, TypeError, AttributeError, IndexError):
+            return name
+        except ContentError:
+            # Cross-references with the built-in content may not match
+            pass
+    return ", ".join(sorted(names))
+
+def compile_pack(directory=CONTENT_DIR):
+    """
+    Load a content pack, using its snapshot when the files are unchanged
+
+    Args:
+        directory: Pack directory
+
+    Returns:
+        Validated catalogue whose version is the hash of the pack files
+
+    Raises:
+        ContentError: If the content is invalid
+    """
+    files, content_hash = _read_pack_files(directory)
+    snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+
+    try:
+        with open(snapshot_path, "rb") as f:
+            snapshot = pickle.load(f)
+        if snapshot["format"] == SNAPSHOT_FORMAT and snapshot["hash"] == content_hash:
+            return snapshot["catalogue"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError, AttributeError):
+        # Missing or stale snapshot, rebuild it
+        pass
+
+    content = _builtin_content()
+    for name, data in files.items():
+        try:
+            content[PACK_FILES[name]] = json.loads(data)
+        except ValueError as e:
+            # JSONDecodeError and UnicodeDecodeError
+            raise ContentError(f"{name} is not valid JSON: {e}") from e
+
+    try:
+        catalogue = Catalogue(version=content_hash, **content)
+    except (KeyError, TypeError, AttributeError, IndexError) as e:
+        # Entries of the wrong shape, e.g. a lesson without a topic
+        problem = f"missing field {e}" if isinstance(e, KeyError) else str(e)
+        raise ContentError(f"{_find_malformed(content, files)} has a malformed entry: {problem}") from e
+
+    # Write the snapshot atomically so that other workers never read half of it
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                {"format": SNAPSHOT_FORMAT, "hash": content_hash, "catalogue": catalogue},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL
+            )
+        os.replace(tmp_path, snapshot_path)
+    except OSError:
+        # The snapshot is only a cache, e.g. the directory may be read-only
+        logger.warning("Failed to write content snapshot %s", snapshot_path, exc_info=True)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    return catalogue
+
+def reload_content(directory=CONTENT_DIR):
+    """
+    Load the content pack and make it the current catalogue
+
+    Sessions that started on the previous catalogue keep using it. Reading
+    and compiling the pack blocks, so call it through asyncio.to_thread from
+    the event loop.
+
+    Args:
+        directory: Pack directory
+
+    Returns:
+        True if the catalogue changed
+
+    Raises:
+        ContentError: If the content is invalid (the current catalogue stays)
+    """
+    if not has_pack(directory):
+        return False
+
+    catalogue = compile_pack(directory)
+    if catalogue.version == get_catalogue().version:
+        return False
+
+    set_catalogue(catalogue)
+    logger.info("Loaded content pack %s (version %s)", directory, catalogue.version)
+    return True
+
+def _pack_mtimes(directory):
+    """Get the modification times of the pack files"""
+    mtimes = {}
+    for name in PACK_FILES:
+        try:
+            mtimes[name] = os.stat(os.path.join(directory, name)).st_mtime_ns
+        except OSError:
+            mtimes[name] = None
+    return mtimes
+
+async def watch_content(directory=CONTENT_DIR, interval=CONTENT_WATCH_INTERVAL):
+    """
+    Reload the content pack whenever its files change
+
+    Args:
+        directory: Pack directory
+        interval: Seconds between checks
+    """
+    mtimes = _pack_mtimes(directory)
+    while True:
+        await asyncio.sleep(interval)
+
+        current = _pack_mtimes(directory)
+        if current == mtimes:
+            continue
+        mtimes = current
+
+        try:
+            await asyncio.to_thread(reload_content, directory)
+        except Exception:
+            logger.exception("Failed to reload content pack %s, keeping the current content", directory)
+
+def export_builtin(directory=CONTENT_DIR):
+    """
+    Write the built-in content as a content pack
+
+    Args:
+        directory: Pack directory
+    """
+    os.makedirs(directory, exist_ok=True)
+    content = _builtin_content()
+    for name, key in PACK_FILES.items():
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            json.dump(content[key], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "compile"
+    directory = sys.argv[2] if len(sys.argv) > 2 else CONTENT_DIR
+
+    if command == "export":
+        export_builtin(directory)
+        print(f"Built-in content written to {directory}")
+    elif command == "compile":
+        catalogue = compile_pack(directory)
+        print(
+            f"Content pack {directory} is valid: {len(catalogue.lessons)} lessons, "
+            f"{len(catalogue.test_questions)} test questions, version {catalogue.version}"
+        )
+    else:
+        print(__doc__)
+        sys.exit(1)
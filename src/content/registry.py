@@ -0,0 +1,282 @@
+"""
+Module with the content registry
+
+Lessons, diagnostic questions and achievements are turned into immutable
+records and indexed once, when the module is imported. Lookups by ID, topic
+or category are then dictionary accesses instead of list scans. The same pass
+validates the content, so duplicate IDs or references to missing lessons fail
+at startup rather than in the middle of a user's lesson.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# Number of answer buttons (A, B, C, D)
+MAX_OPTIONS = 4
+
+# Number of replaced catalogues kept for sessions that started on them
+KEEP_VERSIONS = 8
+
+
+class ContentError(ValueError):
+    """Raised when lesson, question or achievement content is invalid"""
+
+
+@dataclass(frozen=True)
+class Question:
+    """A multiple choice question from the diagnostic test or a lesson"""
+    key: str  # "test:<id>" or "lesson:<lesson id>:<index>"
+    id: Optional[int]  # ID of diagnostic test questions
+    lesson_id: Optional[int]
+    category: str
+    text: str
+    options: Tuple[str, ...]
+    correct_index: int
+
+
+@dataclass(frozen=True)
+class Lesson:
+    """A daily lesson with theory, code example and practice questions"""
+    id: int
+    topic: str
+    category: str
+    theory: str
+    code_example: str
+    questions: Tuple[Question, ...]
+
+
+@dataclass(frozen=True)
+class Achievement:
+    """An achievement definition"""
+    id: str
+    name: str
+    description: str
+    xp_reward: int
+
+
+class Catalogue:
+    """
+    Immutable, indexed collection of all content
+
+    Args:
+        lessons: List of lesson dictionaries (see lesson_content.LESSONS)
+        test_questions: List of diagnostic question dictionaries
+        achievements: List of achievement dictionaries
+        area_lessons: Mapping of test categories to recommended lesson IDs
+        default_plan: Mapping of lesson IDs to topics used for the default plan
+        version: Content version, e.g. the hash of a content pack
+
+    Raises:
+        ContentError: If the content is invalid
+    """
+
+    def __init__(self, lessons, test_questions, achievements, area_lessons, default_plan=None,
+                 version="builtin"):
+        self.version = version
+        errors = []
+
+        self.lessons = tuple(sorted(
+            (_build_lesson(data, errors) for data in lessons),
+            key=lambda lesson: lesson.id
+        ))
+        self.test_questions = tuple(_build_test_question(data, errors) for data in test_questions)
+        self.achievements = tuple(
+            Achievement(data["id"], data["name"], data["description"], data["xp_reward"])
+            for data in achievements
+        )
+
+        self._lessons_by_id = _index(self.lessons, lambda lesson: lesson.id, "lesson", errors)
+        self._lessons_by_topic = _index(self.lessons, lambda lesson: lesson.topic, "lesson topic", errors)
+        self._test_questions_by_id = _index(
+            self.test_questions, lambda question: question.id, "test question", errors
+        )
+        self._achievements_by_id = _index(
+            self.achievements, lambda achievement: achievement.id, "achievement", errors
+        )
+        self._questions_by_key = {
+            question.key: question
+            for question in self.test_questions + tuple(
+                question for lesson in self.lessons for question in lesson.questions
+            )
+        }
+
+        self._lessons_by_category = _group(self.lessons, lambda lesson: lesson.category)
+        self._test_questions_by_category = _group(self.test_questions, lambda question: question.category)
+
+        # Weak test areas must point at existing lessons
+        self.area_lessons = {}
+        for area, lesson_ids in area_lessons.items():
+            for lesson_id in lesson_ids:
+                if lesson_id not in self._lessons_by_id:
+                    errors.append(f"area {area!r} refers to missing lesson {lesson_id}")
+            self.area_lessons[area] = tuple(lesson_ids)
+
+        for lesson_id, topic in (default_plan or {}).items():
+            lesson = self._lessons_by_id.get(lesson_id)
+            if lesson is None or lesson.topic != topic:
+                errors.append(f"default plan refers to missing lesson {lesson_id} {topic!r}")
+
+        for question in self.test_questions:
+            if question.category not in self.area_lessons:
+                errors.append(f"test question {question.id} has unknown category {question.category!r}")
+
+        if errors:
+            raise ContentError("Invalid content:\n" + "\n".join(errors))
+
+    def lesson(self, lesson_id):
+        """Get a lesson by ID, or None"""
+        return self._lessons_by_id.get(lesson_id)
+
+    def lesson_by_topic(self, topic):
+        """Get a lesson by topic, or None"""
+        return self._lessons_by_topic.get(topic)
+
+    def lessons_in_category(self, category):
+        """Get the lessons of a category, ordered by ID"""
+        return self._lessons_by_category.get(category, ())
+
+    def question(self, key):
+        """Get a test or lesson question by key, or None"""
+        return self._questions_by_key.get(key)
+
+    def test_question(self, question_id):
+        """Get a diagnostic test question by ID, or None"""
+        return self._test_questions_by_id.get(question_id)
+
+    def test_questions_in_category(self, category):
+        """Get the diagnostic test questions of a category"""
+        return self._test_questions_by_category.get(category, ())
+
+    def categories(self):
+        """Get the diagnostic test categories"""
+        return tuple(self.area_lessons)
+
+    def achievement(self, achievement_id):
+        """Get an achievement by ID, or None"""
+        return self._achievements_by_id.get(achievement_id)
+
+
+def _check_question(data, name, errors):
+    """Validate the options and correct answer of a question"""
+    options = data["options"]
+    if not 2 <= len(options) <= MAX_OPTIONS:
+        errors.append(f"{name} has {len(options)} options, expected 2 to {MAX_OPTIONS}")
+    if not 0 <= data["correct_index"] < len(options):
+        errors.append(f"{name} has correct_index {data['correct_index']} out of range")
+
+def _build_test_question(data, errors):
+    """Create a diagnostic test question record"""
+    _check_question(data, f"test question {data['id']}", errors)
+    return Question(
+        key=f"test:{data['id']}",
+        id=data["id"],
+        lesson_id=None,
+        category=data["category"],
+        text=data["text"],
+        options=tuple(data["options"]),
+        correct_index=data["correct_index"]
+    )
+
+def _build_lesson(data, errors):
+    """Create a lesson record with its practice questions"""
+    questions = []
+    for index, question in enumerate(data["questions"]):
+        _check_question(question, f"lesson {data['id']} question {index}", errors)
+        questions.append(Question(
+            key=f"lesson:{data['id']}:{index}",
+            id=None,
+            lesson_id=data["id"],
+            category=data["category"],
+            text=question["text"],
+            options=tuple(question["options"]),
+            correct_index=question["correct_index"]
+        ))
+
+    if not questions:
+        errors.append(f"lesson {data['id']} has no questions")
+
+    return Lesson(
+        id=data["id"],
+        topic=data["topic"],
+        category=data["category"],
+        theory=data["theory"],
+        code_example=data["code_example"],
+        questions=tuple(questions)
+    )
+
+def _index(records, get_key, name, errors):
+    """Build a dictionary index, reporting duplicate keys"""
+    index = {}
+    for record in records:
+        key = get_key(record)
+        if key in index:
+            errors.append(f"duplicate {name} {key!r}")
+        index[key] = record
+    return index
+
+def _group(records, get_key):
+    """Group records into tuples by key"""
+    groups = {}
+    for record in records:
+        groups.setdefault(get_key(record), []).append(record)
+    return {key: tuple(group) for key, group in groups.items()}
+
+
+def build_catalogue():
+    """
+    Build the catalogue from the built-in content
+
+    Returns:
+        Catalogue
+
+    Raises:
+        ContentError: If the content is invalid
+    """
+    from src.gamification.achievements import ACHIEVEMENTS
+    from src.lessons.lesson_content import LESSONS
+    from src.lessons.plan_generator import DEFAULT_PLAN, TOPIC_TO_LESSON
+    from src.lessons.test_questions import DIAGNOSTIC_TEST
+
+    return Catalogue(LESSONS, DIAGNOSTIC_TEST, ACHIEVEMENTS, TOPIC_TO_LESSON, DEFAULT_PLAN)
+
+
+# Catalogue built at import time, replaced when content packs are loaded
+_catalogue = build_catalogue()
+
+# Recent catalogues by version, so that sessions started before a reload
+# keep seeing the questions they started with
+_versions = OrderedDict([(_catalogue.version, _catalogue)])
+
+def get_catalogue(version=None):
+    """
+    Get the content catalogue
+
+    Args:
+        version: Version a session started with, defaults to the current one
+
+    Returns:
+        Catalogue of that version, or None if it is no longer kept; the
+        session then has to end, its questions may be gone or changed
+    """
+    if version is None:
+        return _catalogue
+    return _versions.get(version)
+
+def set_catalogue(catalogue):
+    """
+    Make a catalogue current
+
+    The swap is a single assignment, so handlers see either the old or the
+    new catalogue, never a mix of both.
+
+    Args:
+        catalogue: New catalogue
+    """
+    global _catalogue
+
+    _versions[catalogue.version] = catalogue
+    _versions.move_to_end(catalogue.version)
+    while len(_versions) > KEEP_VERSIONS:
+        _versions.popitem(last=False)
+
+    _catalogue = catalogue
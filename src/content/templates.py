@@ -0,0 +1,182 @@
+"""
+Module with precompiled message templates
+
+Question and lesson messages only depend on static content, so their HTML
+and inline keyboards are built once per catalogue. Handlers just add the
+per-user question counter.
+"""
+import weakref
+from dataclasses import dataclass
+from html import escape
+
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from src.content.registry import get_catalogue
+
+# Answer button labels
+LETTERS = ['A', 'B', 'C', 'D']
+
+# Feedback for a correct answer
+CORRECT_VERDICT = "✅ Правильно!"
+
+# Notification for a press on a question that was already answered
+STALE_ANSWER_TEXT = "Этот вопрос уже пройден"
+
+# Notice for a session whose content version is no longer kept
+OUTDATED_SESSION_TEXT = "Учебные материалы обновились, и начатые вопросы больше недоступны."
+
+
+@dataclass(frozen=True)
+class QuestionTemplate:
+    """Prebuilt question message"""
+    body: str  # question text and lettered options
+    reply_markup: InlineKeyboardMarkup
+    wrong_verdict: str  # feedback for a wrong answer, with the correct option
+
+    def render(self, number, total):
+        """
+        Get the message text for a question
+
+        Args:
+            number: Question number, starting from 1
+            total: Number of questions
+
+        Returns:
+            Message text
+        """
+        return f"Вопрос {number} из {total}:\n\n{self.body}"
+
+
+@dataclass(frozen=True)
+class LessonTemplate:
+    """Prebuilt lesson theory message"""
+    text: str
+    reply_markup: InlineKeyboardMarkup
+
+
+class Templates:
+    """
+    Compiled templates for all questions and lessons of a catalogue
+
+    Args:
+        catalogue: Content catalogue
+    """
+
+    def __init__(self, catalogue):
+        self._questions = {}
+        self._reviews = {}
+        for question in catalogue.test_questions:
+            self._questions[question.key] = _compile_question(question, "answer")
+            self._reviews[question.key] = _compile_question(question, "review")
+        for lesson in catalogue.lessons:
+            for question in lesson.questions:
+                self._questions[question.key] = _compile_question(question, "option")
+                self._reviews[question.key] = _compile_question(question, "review")
+
+        self._lessons = {lesson.id: _compile_lesson(lesson) for lesson in catalogue.lessons}
+
+    def question(self, key):
+        """Get the template of a question by key"""
+        return self._questions[key]
+
+    def review_question(self, key):
+        """Get the template of a question asked in a review by key"""
+        return self._reviews[key]
+
+    def lesson(self, lesson_id):
+        """Get the template of a lesson by ID"""
+        return self._lessons[lesson_id]
+
+
+def _compile_question(question, callback_prefix):
+    """Build the message body, keyboard and feedback of a question"""
+    options = question.options[:len(LETTERS)]
+
+    # Create keyboard with letter options (A, B, C, D)
+    builder = InlineKeyboardBuilder()
+    for i, _ in enumerate(options):
+        builder.button(text=LETTERS[i], callback_data=f"{callback_prefix}_{i}_{question.key}")
+
+    # Format options with letters
+    options_text = "".join(
+        f"{LETTERS[i]}. {escape(option, quote=False)}\n"
+        for i, option in enumerate(options)
+    )
+
+    correct_idx = question.correct_index
+    correct_letter = LETTERS[correct_idx] if correct_idx < len(LETTERS) else ""
+
+    return QuestionTemplate(
+        body=f"{escape(question.text, quote=False)}\n\n{options_text}",
+        reply_markup=builder.as_markup(),
+        wrong_verdict=(
+            f"❌ Неправильно. Правильный ответ: {correct_letter}. "
+            f"{escape(question.options[correct_idx], quote=False)}"
+        )
+    )
+
+def _compile_lesson(lesson):
+    """Build the theory message and keyboard of a lesson"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="Перейти к практике", callback_data=f"practice_{lesson.id}")
+
+    return LessonTemplate(
+        text=(
+            f"<b>Урок {lesson.id}: {escape(lesson.topic, quote=False)}</b>\n\n"
+            f"{escape(lesson.theory, quote=False)}\n\n"
+            f"<code>{escape(lesson.code_example, quote=False)}</code>\n\n"
+            f"Когда будете готовы, переходите к практическим заданиям."
+        ),
+        reply_markup=builder.as_markup()
+    )
+
+
+def parse_answer(data):
+    """
+    Split the callback data of an answer button
+
+    Args:
+        data: Callback data like "answer_2_test:7"
+
+    Returns:
+        Tuple of (option index, question key or None for buttons sent without one)
+    """
+    _, option, *key = data.split("_", 2)
+    return int(option), key[0] if key else None
+
+def is_stale_answer(question_key, questions, index):
+    """
+    Check if an answer button belongs to a question other than the current one
+
+    Args:
+        question_key: Question key from the button, None if unknown
+        questions: Questions of the quiz
+        index: Index of the current question
+
+    Returns:
+        True if the answer has to be ignored
+    """
+    if index >= len(questions):
+        return True
+    return question_key is not None and question_key != questions[index].key
+
+
+# Compiled templates for each catalogue that is still in use
+_compiled = weakref.WeakKeyDictionary()
+
+def get_templates(catalogue=None):
+    """
+    Get the compiled templates of a catalogue, compiling them on first use
+
+    Args:
+        catalogue: Content catalogue, defaults to the current one
+
+    Returns:
+        Templates
+    """
+    catalogue = catalogue or get_catalogue()
+    templates = _compiled.get(catalogue)
+    if templates is None:
+        templates = _compiled[catalogue] = Templates(catalogue)
+    return templates
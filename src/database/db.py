@@ -1,4 +1,5 @@
 import os
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
@@ -14,8 +15,39 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database.db")
 if DATABASE_URL.startswith("sqlite:"):
     DATABASE_URL = DATABASE_URL.replace("sqlite:", "sqlite+aiosqlite:", 1)
 
+# Milliseconds a SQLite connection waits for another writer before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+
+# Log every SQL statement (very verbose, for debugging only)
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+
 # Create async engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(DATABASE_URL, echo=SQL_ECHO)
+
+def enable_sqlite_wal(engine):
+    """
+    Switch SQLite connections of an engine to write-ahead logging
+    
+    WAL lets readers work while a batch is being written, so frequent writes
+    (FSM state, XP) don't block the rest of the bot. Writers still take turns:
+    the busy timeout makes a writer wait for the current one instead of
+    failing right away.
+    
+    Args:
+        engine: Async engine to configure
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        cursor.close()
+
+enable_sqlite_wal(engine)
 
 # Create async session factory
 async_session = sessionmaker(
@@ -25,11 +57,40 @@ async_session = sessionmaker(
 # Base class for models
 Base = declarative_base()
 
-async def init_db():
-    """Initialize the database, creating all tables"""
+# Columns added after the first release, created on existing databases
+ADDED_COLUMNS = {
+    "users": {"weekly_xp": "INTEGER DEFAULT 0", "xp_week": "VARCHAR", "counters": "JSON"},
+    "questions": {"content_key": "VARCHAR", "content_hash": "VARCHAR"},
+    "lessons": {"content_hash": "VARCHAR"},
+    "achievements": {"content_hash": "VARCHAR"}
+}
+
+def _add_missing_columns(conn):
+    """Add columns to tables created by older versions"""
+    inspector = inspect(conn)
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table)}
+        for column, column_type in columns.items():
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_questions_content_key ON questions (content_key)"
+    ))
+
+async def init_db(bind=None):
+    """
+    Initialize the database, creating missing tables and columns
+
+    create_all never alters an existing table, so columns added since the
+    database was created are added here before the bot reads them.
+
+    Args:
+        bind: Engine to initialize, defaults to the bot's engine
+    """
     from .models import Base
-    async with engine.begin() as conn:
+    async with (bind or engine).begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
 
 async def get_session() -> AsyncSession:
     """Get a database session"""
@@ -0,0 +1,205 @@
+"""
+FSM storage backed by the bot database
+
+Keeps test and lesson progress across restarts and lets several bot processes
+share conversation state. Writes are buffered per key and upserted in batches,
+so a burst of answers costs a single transaction.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.database.db import engine as default_engine
+from src.database.models import FSMRecord
+
+logger = logging.getLogger(__name__)
+
+# Seconds to collect writes before flushing them together
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.05"))
+
+# Flush immediately once this many keys have pending writes
+FSM_FLUSH_BATCH_SIZE = int(os.getenv("FSM_FLUSH_BATCH_SIZE", "500"))
+
+# Seconds to trust cached values without reading the database.
+# Keep 0 when several workers serve the same chats.
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "0"))
+
+
+def build_key(key: StorageKey) -> str:
+    """
+    Build the database key for a storage key
+
+    Args:
+        key: aiogram storage key
+
+    Returns:
+        String key
+    """
+    return ":".join(str(part) for part in (
+        key.bot_id,
+        key.chat_id,
+        key.user_id,
+        key.thread_id or "",
+        getattr(key, "business_connection_id", None) or "",
+        key.destiny
+    ))
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """
+    aiogram FSM storage on top of the async SQLAlchemy engine
+
+    Args:
+        engine: Async engine to use, defaults to the bot database
+        flush_interval: Seconds to collect writes before flushing them
+        batch_size: Number of pending keys that triggers an early flush
+        cache_ttl: Seconds to serve flushed values from memory (0 disables)
+    """
+
+    def __init__(self, engine=None, flush_interval=FSM_FLUSH_INTERVAL,
+                 batch_size=FSM_FLUSH_BATCH_SIZE, cache_ttl=FSM_CACHE_TTL):
+        self.engine = engine or default_engine
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache_ttl = cache_ttl
+
+        # Unflushed writes: key -> {"state": ..., "data": ...} (only the fields written)
+        self._pending = {}
+        # Writes of the batch currently being flushed
+        self._flushing = {}
+        # Flushed values: key -> (expires_at, {"state": ..., "data": ...})
+        self._cache = {}
+
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        self._write(build_key(key), "state", state)
+
+    async def get_state(self, key: StorageKey):
+        return await self._read(build_key(key), "state")
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        self._write(build_key(key), "data", dict(data))
+
+    async def get_data(self, key: StorageKey):
+        data = await self._read(build_key(key), "data")
+        return dict(data) if data else {}
+
+    async def close(self) -> None:
+        """Stop the flush loop and write all pending changes"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+    def _write(self, db_key, field, value):
+        """Record a write in the per-key cache and schedule a flush"""
+        self._pending.setdefault(db_key, {})[field] = value
+        self._cache.pop(db_key, None)
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _read(self, db_key, field):
+        """Read a field, preferring unflushed writes and fresh cached values"""
+        for writes in (self._pending, self._flushing):
+            pending = writes.get(db_key)
+            if pending is not None and field in pending:
+                return pending[field]
+
+        cached = self._cache.get(db_key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1][field]
+
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(
+                select(FSMRecord.state, FSMRecord.data).where(FSMRecord.key == db_key)
+            )).first()
+
+        values = {"state": row.state, "data": row.data} if row else {"state": None, "data": None}
+        if self.cache_ttl > 0:
+            self._cache[db_key] = (time.monotonic() + self.cache_ttl, values)
+        return values[field]
+
+    async def flush(self):
+        """
+        Write all pending changes in a single transaction
+
+        Returns:
+            Number of keys written
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            pending, self._pending = self._pending, {}
+            self._flushing = pending
+
+            # Cleared conversations are deleted, everything else is upserted
+            # in groups of rows that write the same columns
+            deleted = []
+            groups = {}
+            now = datetime.utcnow()
+            for db_key, fields in pending.items():
+                if fields.get("state", 0) is None and fields.get("data", 0) == {}:
+                    deleted.append(db_key)
+                    continue
+                groups.setdefault(tuple(sorted(fields)), []).append(
+                    {"key": db_key, "updated_at": now, **fields}
+                )
+
+            try:
+                async with self.engine.begin() as conn:
+                    if deleted:
+                        await conn.execute(delete(FSMRecord).where(FSMRecord.key.in_(deleted)))
+                    for columns, rows in groups.items():
+                        stmt = sqlite_insert(FSMRecord)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[FSMRecord.key],
+                            set_={
+                                column: stmt.excluded[column]
+                                for column in columns + ("updated_at",)
+                            }
+                        )
+                        await conn.execute(stmt, rows)
+            except Exception:
+                # Keep newer writes, put back the rest of the batch for retry
+                for db_key, fields in pending.items():
+                    self._pending[db_key] = {**fields, **self._pending.get(db_key, {})}
+                raise
+            finally:
+                self._flushing = {}
+
+            return len(pending)
+
+    async def _run(self):
+        """Background loop flushing pending writes"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush FSM storage, will retry")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -22,6 +22,9 @@ class User(Base):
     level = Column(Integer, default=1)
     streak_days = Column(Integer, default=0)
     last_lesson_date = Column(DateTime, nullable=True)
+    weekly_xp = Column(Integer, default=0)  # XP earned in xp_week
+    xp_week = Column(String, nullable=True)  # ISO week, e.g. "2024-W07"
+    counters = Column(JSON, nullable=True)  # event counters of the achievement rules
     
     # Relationships
     test_results = relationship("TestResult", back_populates="user")
@@ -65,6 +68,7 @@ class Lesson(Base):
     topic = Column(String, nullable=False)
     theory = Column(Text, nullable=False)
     code_example = Column(Text, nullable=True)
+    content_hash = Column(String, nullable=True)  # hash of the synced content
     
     # Relationships
     questions = relationship("Question", back_populates="lesson")
@@ -77,14 +81,19 @@ class Lesson(Base):
 class Question(Base):
     """Question model for both tests and lessons"""
     __tablename__ = "questions"
+    __table_args__ = (
+        Index("ix_questions_content_key", "content_key", unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
+    content_key = Column(String, nullable=True)  # "test:<id>" or "lesson:<lesson id>:<index>"
     lesson_id = Column(Integer, ForeignKey("lessons.id"), nullable=True)
     is_test_question = Column(Boolean, default=False)
     category = Column(String, nullable=False)  # syntax, functions, oop, etc.
     text = Column(Text, nullable=False)
     options = Column(JSON, nullable=False)  # List of options
     correct_index = Column(Integer, nullable=False)
+    content_hash = Column(String, nullable=True)  # hash of the synced content
     
     # Relationship
     lesson = relationship("Lesson", back_populates="questions")
@@ -116,10 +125,11 @@ class Achievement(Base):
     """Achievement definitions"""
     __tablename__ = "achievements"
     
-    id = Column(Integer, primary_key=True)
+    id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
     description = Column(Text, nullable=False)
     xp_reward = Column(Integer, default=0)
+    content_hash = Column(String, nullable=True)  # hash of the synced content
     
     # Relationship
     user_achievements = relationship("UserAchievement", back_populates="achievement")
@@ -134,7 +144,7 @@ class UserAchievement(Base):
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    achievement_id = Column(Integer, ForeignKey("achievements.id"))
+    achievement_id = Column(String, ForeignKey("achievements.id"))
     earned_date = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -155,4 +165,69 @@ class LearningPlan(Base):
     plan_data = Column(JSON, nullable=False)  # Store the plan as JSON
     
     def __repr__(self):
-        return f"<LearningPlan(user_id={self.user_id}, creation_date={self.creation_date})>"
\ No newline at end of file
+        return f"<LearningPlan(user_id={self.user_id}, creation_date={self.creation_date})>"
+
+class FSMRecord(Base):
+    """Store the FSM state and data of each conversation"""
+    __tablename__ = "fsm_states"
+    
+    key = Column(String, primary_key=True)  # bot:chat:user:thread:business:destiny
+    state = Column(String, nullable=True)
+    data = Column(JSON, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<FSMRecord(key={self.key}, state={self.state})>"
+
+class XPEvent(Base):
+    """Append-only ledger of XP awards"""
+    __tablename__ = "xp_events"
+    __table_args__ = (
+        Index("ix_xp_events_user_time", "telegram_id", "created_at"),
+        Index("ix_xp_events_time", "created_at"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, nullable=False)
+    amount = Column(Integer, nullable=False)
+    reason = Column(String, nullable=False)  # reason code, e.g. "lesson_completed" or "achievement:<id>"
+    lesson_id = Column(Integer, nullable=True)
+    question_key = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f"<XPEvent(telegram_id={self.telegram_id}, amount={self.amount}, reason={self.reason})>"
+
+
+class LessonReminder(Base):
+    """Pending reminder that the next lesson is available"""
+    __tablename__ = "lesson_reminders"
+    
+    telegram_id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, nullable=False)
+    lesson_id = Column(Integer, nullable=False)  # lesson that becomes available
+    due_at = Column(DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<LessonReminder(telegram_id={self.telegram_id}, due_at={self.due_at})>"
+
+
+class ReviewCard(Base):
+    """Spaced-repetition state of a question for a user"""
+    __tablename__ = "review_cards"
+    __table_args__ = (
+        Index("ix_review_cards_user_due", "telegram_id", "due_at"),
+        Index("ix_review_cards_due", "due_at"),
+    )
+    
+    telegram_id = Column(Integer, primary_key=True)
+    question_key = Column(String, primary_key=True)  # content key, e.g. "test:7" or "lesson:1:0"
+    ease = Column(Float, nullable=False)
+    interval = Column(Float, nullable=False)  # days until the next review
+    repetitions = Column(Integer, nullable=False)  # correct answers in a row
+    lapses = Column(Integer, nullable=False)  # wrong answers
+    due_at = Column(DateTime, nullable=False)
+    reviewed_at = Column(DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f"<ReviewCard(telegram_id={self.telegram_id}, question_key={self.question_key}, due_at={self.due_at})>"
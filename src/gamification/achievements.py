@@ -62,9 +62,7 @@ def get_achievement_by_id(achievement_id):
         achievement_id: ID of the achievement to retrieve
         
     Returns:
-        Achievement dictionary or None if not found
+        Achievement record or None if not found
     """
-    for achievement in ACHIEVEMENTS:
-        if achievement["id"] == achievement_id:
-            return achievement
-    return None
\ No newline at end of file
+    from src.content.registry import get_catalogue
+    return get_catalogue().achievement(achievement_id)
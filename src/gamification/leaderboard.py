@@ -0,0 +1,277 @@
+"""
+Module for the weekly XP leaderboard
+
+Weekly XP of every active user is kept in an order-statistics index: a
+Fenwick tree counting users per XP value plus the users having each value.
+An award moves one user between two values in O(log max XP), the rank of a
+user is one prefix sum, and the top of the board is found by walking down
+the tree, so neither needs to sort all users. The index covers the current
+ISO week and starts over when a new week begins; weekly XP itself is saved
+with the user records by the XP store.
+"""
+from datetime import datetime
+from html import escape
+
+from sqlalchemy import select
+
+from src.database.db import async_session
+from src.database.models import User
+
+# Number of users shown on the leaderboard
+LEADERBOARD_SIZE = 10
+
+
+def week_key(now=None):
+    """
+    Get the ISO week of a moment
+
+    Args:
+        now: Datetime, defaults to the current time
+
+    Returns:
+        Week key like "2024-W07"
+    """
+    year, week, _ = (now or datetime.now()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+class ScoreIndex:
+    """
+    Order-statistics index of non-negative integer scores
+
+    Args:
+        size: Initial number of distinct scores covered, grows as needed
+    """
+
+    def __init__(self, size=1024):
+        self._size = size
+        self._tree = [0] * (size + 1)
+        # Score of each user
+        self._scores = {}
+        # Users having each score, in the order they reached it
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._scores)
+
+    def _update(self, score, delta):
+        """Add delta to the number of users with a score"""
+        i = score + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _count_up_to(self, score):
+        """Count users with a score of at most the given one"""
+        i = min(score + 1, self._size)
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, k):
+        """Find the smallest score that at least k users have or are below"""
+        position = 0
+        step = 1 << self._size.bit_length()
+        while step:
+            nxt = position + step
+            if nxt <= self._size and self._tree[nxt] < k:
+                position = nxt
+                k -= self._tree[nxt]
+            step >>= 1
+        # Score s is counted at tree index s + 1
+        return position
+
+    def _grow(self, score):
+        """Make the tree cover a score, rebuilding it from the buckets"""
+        size = self._size
+        while size <= score:
+            size *= 2
+        self._size = size
+        self._tree = [0] * (size + 1)
+        for bucket_score, users in self._buckets.items():
+            self._tree[bucket_score + 1] += len(users)
+        # Build all prefix sums in O(size)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
+
+    def set(self, user_id, score):
+        """
+        Set the score of a user
+
+        Args:
+            user_id: User ID
+            score: New score, users with 0 are removed
+        """
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            bucket = self._buckets[old]
+            del bucket[user_id]
+            if not bucket:
+                del self._buckets[old]
+            self._update(old, -1)
+            del self._scores[user_id]
+
+        if score > 0:
+            if score >= self._size:
+                self._grow(score)
+            self._scores[user_id] = score
+            self._buckets.setdefault(score, {})[user_id] = None
+            self._update(score, 1)
+
+    def add(self, user_id, amount):
+        """
+        Add to the score of a user
+
+        Args:
+            user_id: User ID
+            amount: Score to add
+
+        Returns:
+            New score
+        """
+        score = max(0, self._scores.get(user_id, 0) + amount)
+        self.set(user_id, score)
+        return score
+
+    def score(self, user_id):
+        """Get the score of a user, 0 if absent"""
+        return self._scores.get(user_id, 0)
+
+    def rank(self, user_id):
+        """
+        Get the place of a user, users with equal scores share it
+
+        Args:
+            user_id: User ID
+
+        Returns:
+            Place starting from 1, or None if the user has no score
+        """
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return len(self._scores) - self._count_up_to(score) + 1
+
+    def top(self, k):
+        """
+        Get the users with the highest scores
+
+        Args:
+            k: Number of users
+
+        Returns:
+            List of (user ID, score) tuples, highest first
+        """
+        result = []
+        remaining = len(self._scores)
+        while remaining and len(result) < k:
+            score = self._find(remaining)
+            users = self._buckets[score]
+            for user_id in users:
+                result.append((user_id, score))
+                if len(result) == k:
+                    break
+            remaining -= len(users)
+        return result
+
+    def clear(self):
+        """Remove all scores"""
+        self._tree = [0] * (self._size + 1)
+        self._scores = {}
+        self._buckets = {}
+
+
+class WeeklyLeaderboard:
+    """Leaderboard of the XP earned in the current week"""
+
+    def __init__(self):
+        self.week = week_key()
+        self.index = ScoreIndex()
+
+    def _roll_over(self, week):
+        """Start a new week"""
+        if week != self.week:
+            self.week = week
+            self.index.clear()
+
+    def add(self, user_id, amount, week):
+        """
+        Add weekly XP of a user
+
+        Args:
+            user_id: User ID
+            amount: XP earned
+            week: Week the XP was earned in
+        """
+        self._roll_over(week)
+        self.index.add(user_id, amount)
+
+    async def load(self):
+        """Fill the index with the weekly XP saved for the current week"""
+        self._roll_over(week_key())
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(User.telegram_id, User.weekly_xp).where(User.xp_week == self.week)
+            )).all()
+
+        for user_id, xp in rows:
+            if xp:
+                self.index.set(user_id, xp)
+
+    def standings(self, user_id, k=LEADERBOARD_SIZE):
+        """
+        Get the top of the current week and the place of a user
+
+        Args:
+            user_id: User asking for the leaderboard
+            k: Number of users in the top
+
+        Returns:
+            Tuple of (top as (user ID, XP) list, user's place or None, user's weekly XP)
+        """
+        self._roll_over(week_key())
+        return self.index.top(k), self.index.rank(user_id), self.index.score(user_id)
+
+
+async def get_display_names(user_ids, records):
+    """
+    Get display names of users
+
+    Args:
+        user_ids: User IDs
+        records: In-memory XP records by user ID
+
+    Returns:
+        Dictionary mapping user IDs to HTML-escaped names
+    """
+    names = {}
+    missing = []
+    for user_id in user_ids:
+        name = (records.get(user_id) or {}).get("first_name")
+        if name:
+            names[user_id] = escape(name)
+        else:
+            missing.append(user_id)
+
+    if missing:
+        async with async_session() as session:
+            for user_id, first_name, username in (await session.execute(
+                select(User.telegram_id, User.first_name, User.username)
+                .where(User.telegram_id.in_(missing))
+            )).all():
+                if first_name or username:
+                    names[user_id] = escape(first_name or username)
+
+    for user_id in user_ids:
+        names.setdefault(user_id, f"Участник {user_id % 10000:04d}")
+    return names
+
+
+# Leaderboard of the current week
+leaderboard = WeeklyLeaderboard()
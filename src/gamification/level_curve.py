@@ -0,0 +1,160 @@
+"""
+Module with the XP level curve
+
+The XP needed for each level is computed once into a sorted array, so the
+level of a user is a binary search instead of a sort and scan per award.
+Levels 1-10 use the hand-tuned thresholds; beyond level 10 each level costs
+LEVEL_STEP_GROWTH more XP than the previous one.
+
+levels() maps a whole XP column at once (with NumPy searchsorted when NumPy is
+installed), and recompute_levels() uses it to move every user to a retuned
+curve in one pass.
+
+Usage:
+    python -m src.gamification.level_curve recompute
+"""
+import asyncio
+import sys
+from bisect import bisect_right
+
+from sqlalchemy import bindparam, select, update
+
+from src.database.db import async_session
+from src.database.models import User
+
+# XP thresholds for each level
+LEVEL_THRESHOLDS = {
+    1: 0,
+    2: 100,
+    3: 250,
+    4: 500,
+    5: 1000,
+    6: 2000,
+    7: 3500,
+    8: 5000,
+    9: 7500,
+    10: 10000
+}
+
+# Highest level of the curve
+MAX_LEVEL = 100
+
+# Extra XP each level beyond the table costs compared with the previous one
+LEVEL_STEP_GROWTH = 500
+
+# Users updated per statement by recompute_levels()
+RECOMPUTE_WRITE_SIZE = 5000
+
+
+class LevelCurve:
+    """
+    XP thresholds of all levels
+
+    Args:
+        thresholds: Dictionary mapping levels to the XP they start at
+        max_level: Highest level
+        step_growth: Extra XP per level beyond the table
+    """
+
+    def __init__(self, thresholds=LEVEL_THRESHOLDS, max_level=MAX_LEVEL, step_growth=LEVEL_STEP_GROWTH):
+        values = [xp for _, xp in sorted(thresholds.items())]
+
+        # Continue the curve with growing steps, starting from the last step of the table
+        step = values[-1] - values[-2] if len(values) > 1 else step_growth
+        while len(values) < max_level:
+            step += step_growth
+            values.append(values[-1] + step)
+
+        # thresholds[i] is the XP that level i + 1 starts at
+        self.thresholds = tuple(values)
+
+    @property
+    def max_level(self):
+        """Highest level of the curve"""
+        return len(self.thresholds)
+
+    def level(self, xp):
+        """
+        Get the level for an XP amount
+
+        Args:
+            xp: XP amount
+
+        Returns:
+            Level number, at least 1
+        """
+        return max(1, bisect_right(self.thresholds, xp))
+
+    def xp_for_level(self, level):
+        """Get the XP a level starts at"""
+        return self.thresholds[min(max(level, 1), self.max_level) - 1]
+
+    def levels(self, xp_values):
+        """
+        Get the levels for many XP amounts at once
+
+        Args:
+            xp_values: Sequence of XP amounts
+
+        Returns:
+            NumPy array of levels, or a list if NumPy is not installed
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            return [self.level(xp) for xp in xp_values]
+
+        levels = np.searchsorted(np.asarray(self.thresholds), np.asarray(xp_values), side="right")
+        return np.maximum(levels, 1)
+
+
+# Curve used for all awards
+level_curve = LevelCurve()
+
+
+async def recompute_levels(curve=level_curve):
+    """
+    Move every user to the level the curve gives for their XP
+
+    Run it while the bot is stopped, otherwise the in-memory records
+    overwrite the new levels on the next flush.
+
+    Args:
+        curve: Level curve
+
+    Returns:
+        Number of users whose level changed
+    """
+    async with async_session() as session:
+        async with session.begin():
+            rows = (await session.execute(select(User.id, User.xp, User.level))).all()
+            if not rows:
+                return 0
+
+            ids, xp_values, old_levels = zip(*rows)
+            new_levels = curve.levels([xp or 0 for xp in xp_values])
+
+            changed = [
+                {"user_pk": user_pk, "new_level": int(new_level)}
+                for user_pk, old_level, new_level in zip(ids, old_levels, new_levels)
+                if old_level != new_level
+            ]
+
+            connection = await session.connection()
+            stmt = (
+                update(User)
+                .where(User.id == bindparam("user_pk"))
+                .values(level=bindparam("new_level"))
+            )
+            for i in range(0, len(changed), RECOMPUTE_WRITE_SIZE):
+                await connection.execute(stmt, changed[i:i + RECOMPUTE_WRITE_SIZE])
+
+    return len(changed)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["recompute"]:
+        print(f"Changed the level of {asyncio.run(recompute_levels())} users")
+    else:
+        print(__doc__)
+        sys.exit(1)
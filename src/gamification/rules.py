@@ -0,0 +1,119 @@
+"""
+Module with the achievement rules
+
+Each rule names an achievement, the event types that can unlock it and a
+predicate over the user's event counters. Rules are indexed by event type
+once, so an event only evaluates the few rules listening to it, and
+ownership is a bit test on the user's achievement bitset instead of a scan
+of the earned list.
+
+Events and the counters they update:
+
+    lesson_completed   lessons_completed, perfect_lessons
+    question_answered  answered_<category>, correct_<category>, counting
+                       the diagnostic test, lesson practice and reviews
+    share             shares
+    streak            (uses streak_days of the user record)
+"""
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+from src.content.registry import get_catalogue
+
+# Minimum number of answers in a category before its accuracy counts
+MIN_CATEGORY_ANSWERS = 5
+
+
+@dataclass(frozen=True)
+class Rule:
+    """Condition for earning an achievement"""
+    achievement_id: str
+    events: Tuple[str, ...]
+    predicate: Callable[[dict, dict], bool]  # (counters, user record) -> earned
+
+
+def _accuracy(counters, category):
+    """Get the share of correct answers in a category, 0 until enough answers"""
+    answered = counters.get(f"answered_{category}", 0)
+    if answered < MIN_CATEGORY_ANSWERS:
+        return 0
+    return counters.get(f"correct_{category}", 0) / answered
+
+
+RULES = (
+    Rule("beginner", ("lesson_completed",),
+         lambda counters, user: counters.get("lessons_completed", 0) >= 1),
+    Rule("streaker", ("streak",),
+         lambda counters, user: user["streak_days"] >= 3),
+    Rule("functions_guru", ("question_answered",),
+         lambda counters, user: _accuracy(counters, "functions") >= 0.8),
+    Rule("oop_master", ("question_answered",),
+         lambda counters, user: _accuracy(counters, "oop") >= 0.8),
+    Rule("halfway", ("lesson_completed",),
+         lambda counters, user: counters.get("lessons_completed", 0) >= 4),
+    Rule("graduate", ("lesson_completed",),
+         lambda counters, user: counters.get("lessons_completed", 0) >= len(get_catalogue().lessons)),
+    Rule("perfect_score", ("lesson_completed",),
+         lambda counters, user: counters.get("perfect_lessons", 0) >= 1),
+    Rule("social_butterfly", ("share",),
+         lambda counters, user: counters.get("shares", 0) >= 3),
+)
+
+# Rules listening to each event type
+RULES_BY_EVENT = {}
+for _rule in RULES:
+    for _event in _rule.events:
+        RULES_BY_EVENT.setdefault(_event, []).append(_rule)
+
+# Bit of each achievement in the user bitsets, assigned on first use
+_bits = {}
+
+def achievement_bit(achievement_id):
+    """
+    Get the bitset mask of an achievement
+
+    Args:
+        achievement_id: Achievement ID
+
+    Returns:
+        Integer with a single bit set
+    """
+    bit = _bits.get(achievement_id)
+    if bit is None:
+        bit = _bits[achievement_id] = 1 << len(_bits)
+    return bit
+
+def achievement_bits(achievement_ids):
+    """Build the bitset of a collection of achievement IDs"""
+    bits = 0
+    for achievement_id in achievement_ids:
+        bits |= achievement_bit(achievement_id)
+    return bits
+
+def evaluate(user_data, events):
+    """
+    Find the achievements unlocked by events
+
+    Args:
+        user_data: User record with "counters" and "achievement_bits"
+        events: Event types that just happened
+
+    Returns:
+        List of newly earned achievement records, not yet marked as owned
+    """
+    catalogue = get_catalogue()
+    counters = user_data["counters"]
+    owned = user_data["achievement_bits"]
+    earned = []
+
+    for event in events:
+        for rule in RULES_BY_EVENT.get(event, ()):
+            bit = achievement_bit(rule.achievement_id)
+            if owned & bit or not rule.predicate(counters, user_data):
+                continue
+            achievement = catalogue.achievement(rule.achievement_id)
+            if achievement is not None:
+                owned |= bit
+                earned.append(achievement)
+
+    return earned
@@ -0,0 +1,231 @@
+"""
+Module for querying the XP ledger and rebuilding totals from it
+
+Every XP award is an xp_events row; User.xp, level, streak_days,
+last_activity and the weekly XP are aggregates of those rows. rebuild_totals()
+recomputes them for all users in one pass over the ledger, streamed in
+(user, time) index order. Time-range aggregates use the created_at indexes
+instead of scanning the table.
+
+Usage:
+    python -m src.gamification.xp_ledger seed      record XP earned before the ledger
+    python -m src.gamification.xp_ledger rebuild   recompute totals (with the bot stopped)
+"""
+import asyncio
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.database.db import async_session
+from src.database.models import User, XPEvent
+from src.gamification.leaderboard import week_key
+
+# Ledger rows fetched per round trip during a rebuild
+REBUILD_FETCH_SIZE = 10000
+
+# Users written per statement during a rebuild
+REBUILD_WRITE_SIZE = 1000
+
+# Reason of the rows holding XP earned before the ledger existed
+OPENING_BALANCE = "opening_balance"
+
+
+async def xp_totals(start, end):
+    """
+    Sum the XP each user earned in a time range
+
+    Args:
+        start: Range start, inclusive
+        end: Range end, exclusive
+
+    Returns:
+        Dictionary mapping user IDs to XP
+    """
+    async with async_session() as session:
+        rows = (await session.execute(
+            select(XPEvent.telegram_id, func.sum(XPEvent.amount))
+            .where(XPEvent.created_at >= start, XPEvent.created_at < end)
+            .group_by(XPEvent.telegram_id)
+        )).all()
+    return dict(rows)
+
+async def user_xp_between(user_id, start, end):
+    """
+    Sum the XP a user earned in a time range
+
+    Args:
+        user_id: User ID
+        start: Range start, inclusive
+        end: Range end, exclusive
+
+    Returns:
+        XP amount
+    """
+    async with async_session() as session:
+        total = (await session.execute(
+            select(func.sum(XPEvent.amount))
+            .where(XPEvent.telegram_id == user_id)
+            .where(XPEvent.created_at >= start, XPEvent.created_at < end)
+        )).scalar()
+    return total or 0
+
+async def daily_totals(start, end, user_id=None):
+    """
+    Sum XP per day
+
+    Args:
+        start: Range start, inclusive
+        end: Range end, exclusive
+        user_id: Only count this user's XP
+
+    Returns:
+        Dictionary mapping "YYYY-MM-DD" dates to XP
+    """
+    day = func.date(XPEvent.created_at)
+    query = (
+        select(day, func.sum(XPEvent.amount))
+        .where(XPEvent.created_at >= start, XPEvent.created_at < end)
+        .group_by(day)
+        .order_by(day)
+    )
+    if user_id is not None:
+        query = query.where(XPEvent.telegram_id == user_id)
+
+    async with async_session() as session:
+        rows = (await session.execute(query)).all()
+    return dict(rows)
+
+async def seed_opening_balances(session_factory=async_session):
+    """
+    Record the XP of users who earned it before the ledger existed
+
+    Args:
+        session_factory: Session factory of the database to seed
+
+    Returns:
+        Number of users seeded
+    """
+    async with session_factory() as session:
+        async with session.begin():
+            has_events = select(XPEvent.id).where(XPEvent.telegram_id == User.telegram_id).exists()
+            rows = (await session.execute(
+                select(User.telegram_id, User.xp, User.last_activity, User.registration_date)
+                .where(User.xp > 0, ~has_events)
+            )).all()
+
+            if rows:
+                await session.execute(insert(XPEvent), [
+                    {
+                        "telegram_id": user_id,
+                        "amount": xp,
+                        "reason": OPENING_BALANCE,
+                        "created_at": last_activity or registration_date or datetime.now()
+                    }
+                    for user_id, xp, last_activity, registration_date in rows
+                ])
+    return len(rows)
+
+def _replay(events, week, week_start):
+    """Compute the totals of one user from their events in time order"""
+    from src.gamification.xp_system import calculate_level
+
+    xp = 0
+    weekly_xp = 0
+    streak_days = 0
+    last_activity = None
+    for amount, reason, created_at in events:
+        xp += amount
+        if created_at >= week_start:
+            weekly_xp += amount
+
+        # Achievement rewards come with the award that unlocked them
+        if reason.startswith("achievement:"):
+            continue
+
+        # Same streak rules as award_xp
+        if last_activity:
+            time_diff = created_at - last_activity
+            if timedelta(hours=20) <= time_diff <= timedelta(hours=28):
+                streak_days += 1
+            elif time_diff > timedelta(hours=28):
+                streak_days = 1
+        last_activity = created_at
+
+    return {
+        "xp": xp,
+        "level": calculate_level(xp),
+        "streak_days": streak_days,
+        "last_activity": last_activity,
+        "weekly_xp": weekly_xp,
+        "xp_week": week
+    }
+
+async def _write_totals(session, rows):
+    """Upsert rebuilt user totals"""
+    stmt = sqlite_insert(User)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={column: stmt.excluded[column] for column in rows[0] if column != "telegram_id"}
+    )
+    await session.execute(stmt, rows)
+
+async def rebuild_totals():
+    """
+    Recompute the XP aggregates of every user from the ledger
+
+    Run it while the bot is stopped, otherwise the in-memory records
+    overwrite the rebuilt values on the next flush.
+
+    Returns:
+        Number of users rebuilt
+    """
+    now = datetime.now()
+    week = week_key(now)
+    week_start = datetime(now.year, now.month, now.day) - timedelta(days=now.weekday())
+    rebuilt = 0
+    batch = []
+
+    async with async_session() as session:
+        async with session.begin():
+            result = await session.stream(
+                select(XPEvent.telegram_id, XPEvent.amount, XPEvent.reason, XPEvent.created_at)
+                .order_by(XPEvent.telegram_id, XPEvent.created_at, XPEvent.id)
+                .execution_options(yield_per=REBUILD_FETCH_SIZE)
+            )
+
+            user_id = None
+            events = []
+            async for partition in result.partitions():
+                for telegram_id, amount, reason, created_at in partition:
+                    if telegram_id != user_id:
+                        if events:
+                            batch.append({"telegram_id": user_id, **_replay(events, week, week_start)})
+                        user_id, events = telegram_id, []
+                    events.append((amount, reason, created_at))
+
+                if len(batch) >= REBUILD_WRITE_SIZE:
+                    rebuilt += len(batch)
+                    await _write_totals(session, batch)
+                    batch = []
+
+            if events:
+                batch.append({"telegram_id": user_id, **_replay(events, week, week_start)})
+            if batch:
+                rebuilt += len(batch)
+                await _write_totals(session, batch)
+
+    return rebuilt
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command == "seed":
+        print(f"Seeded opening balances of {asyncio.run(seed_opening_balances())} users")
+    elif command == "rebuild":
+        print(f"Rebuilt totals of {asyncio.run(rebuild_totals())} users")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,249 @@
+"""
+Module for persisting XP and achievement data
+
+User records stay in memory for fast access and are written back to the
+database in batches (write-behind): every change marks the user as dirty and
+the dirty users are flushed together, either periodically or as soon as
+enough of them have accumulated. XP ledger events are buffered the same way
+and inserted in the transaction that updates the totals they add up to.
+"""
+import asyncio
+import logging
+import os
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.database.db import async_session
+from src.database.models import User, UserAchievement, XPEvent
+from src.gamification.achievements import get_achievement_by_id
+from src.gamification.rules import achievement_bits
+
+logger = logging.getLogger(__name__)
+
+# Flush dirty users at least this often (seconds)
+FLUSH_INTERVAL = float(os.getenv("XP_FLUSH_INTERVAL", "5"))
+
+# Flush immediately once this many users are dirty
+FLUSH_BATCH_SIZE = int(os.getenv("XP_FLUSH_BATCH_SIZE", "100"))
+
+
+class XPStore:
+    """
+    Write-behind store for the in-memory user XP records
+
+    Args:
+        records: Dictionary mapping user IDs to XP records, kept up to date in memory
+        flush_interval: Maximum number of seconds between flushes
+        batch_size: Number of dirty users that triggers an early flush
+    """
+
+    def __init__(self, records, flush_interval=FLUSH_INTERVAL, batch_size=FLUSH_BATCH_SIZE):
+        self.records = records
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        # Users that were already looked up in the database
+        self._loaded = set()
+        # Users with unsaved changes
+        self._dirty = set()
+        # Achievements earned since the last flush, by user ID
+        self._new_achievements = {}
+        # XP ledger rows not written yet
+        self._events = []
+
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def load(self, user_id):
+        """
+        Get a user record, reading it from the database on first access
+
+        Args:
+            user_id: User ID
+
+        Returns:
+            User record dictionary or None if the user has no saved progress
+        """
+        if user_id in self.records or user_id in self._loaded:
+            return self.records.get(user_id)
+
+        async with async_session() as session:
+            user = (await session.execute(
+                select(User).where(User.telegram_id == user_id)
+            )).scalar_one_or_none()
+
+            earned = []
+            if user is not None:
+                earned = (await session.execute(
+                    select(UserAchievement.achievement_id, UserAchievement.earned_date)
+                    .where(UserAchievement.user_id == user.id)
+                    .order_by(UserAchievement.earned_date)
+                )).all()
+
+        self._loaded.add(user_id)
+        if user is None:
+            return self.records.get(user_id)
+
+        achievements = []
+        for achievement_id, earned_date in earned:
+            achievement = get_achievement_by_id(achievement_id)
+            if achievement:
+                achievements.append({
+                    "id": achievement_id,
+                    "name": achievement.name,
+                    "description": achievement.description,
+                    "earned_date": earned_date
+                })
+
+        # Another coroutine may have created the record while we were waiting
+        return self.records.setdefault(user_id, {
+            "xp": user.xp or 0,
+            "level": user.level or 1,
+            "streak_days": user.streak_days or 0,
+            "last_activity": user.last_activity,
+            "weekly_xp": user.weekly_xp or 0,
+            "xp_week": user.xp_week,
+            "first_name": user.first_name,
+            "counters": dict(user.counters or {}),
+            "achievement_bits": achievement_bits(achievement_id for achievement_id, _ in earned),
+            "achievements": achievements
+        })
+
+    def mark_dirty(self, user_id, achievement=None):
+        """
+        Schedule a user record to be written to the database
+
+        Args:
+            user_id: User ID
+            achievement: Newly earned achievement dictionary, if any
+        """
+        self._dirty.add(user_id)
+        if achievement is not None:
+            self._new_achievements.setdefault(user_id, []).append(achievement)
+
+        if len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+
+    def record(self, event):
+        """
+        Buffer an XP ledger row
+
+        Args:
+            event: Dictionary of XPEvent column values
+        """
+        self._events.append(event)
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """
+        Write all dirty user records and buffered ledger rows in a single transaction
+
+        Returns:
+            Number of users written
+        """
+        async with self._flush_lock:
+            if not self._dirty and not self._events:
+                return 0
+
+            dirty, self._dirty = self._dirty, set()
+            new_achievements, self._new_achievements = self._new_achievements, {}
+            events, self._events = self._events, []
+
+            rows = [
+                {
+                    "telegram_id": user_id,
+                    "xp": self.records[user_id]["xp"],
+                    "level": self.records[user_id]["level"],
+                    "streak_days": self.records[user_id]["streak_days"],
+                    "last_activity": self.records[user_id]["last_activity"],
+                    "weekly_xp": self.records[user_id].get("weekly_xp", 0),
+                    "xp_week": self.records[user_id].get("xp_week"),
+                    "first_name": self.records[user_id].get("first_name"),
+                    "counters": dict(self.records[user_id].get("counters", {}))
+                }
+                for user_id in dirty if user_id in self.records
+            ]
+
+            try:
+                async with async_session() as session:
+                    async with session.begin():
+                        await self._write(session, rows, new_achievements)
+                        if events:
+                            await session.execute(insert(XPEvent), events)
+            except Exception:
+                # Put the batch back so that the next flush retries it
+                self._dirty |= dirty
+                self._events[:0] = events
+                for user_id, achievements in new_achievements.items():
+                    self._new_achievements.setdefault(user_id, [])[:0] = achievements
+                raise
+
+            return len(rows)
+
+    async def _write(self, session, rows, new_achievements):
+        """Upsert user rows and insert newly earned achievements"""
+        if rows:
+            stmt = sqlite_insert(User)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[User.telegram_id],
+                set_={
+                    "xp": stmt.excluded.xp,
+                    "level": stmt.excluded.level,
+                    "streak_days": stmt.excluded.streak_days,
+                    "last_activity": stmt.excluded.last_activity,
+                    "weekly_xp": stmt.excluded.weekly_xp,
+                    "xp_week": stmt.excluded.xp_week,
+                    "first_name": stmt.excluded.first_name,
+                    "counters": stmt.excluded.counters
+                }
+            )
+            await session.execute(stmt, rows)
+
+        if new_achievements:
+            user_ids = dict((await session.execute(
+                select(User.telegram_id, User.id)
+                .where(User.telegram_id.in_(list(new_achievements)))
+            )).all())
+            await session.execute(insert(UserAchievement), [
+                {
+                    "user_id": user_ids[telegram_id],
+                    "achievement_id": achievement["id"],
+                    "earned_date": achievement["earned_date"]
+                }
+                for telegram_id, achievements in new_achievements.items()
+                for achievement in achievements
+            ])
+
+    async def _run(self):
+        """Background loop flushing dirty users by time or by count"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush XP data, will retry")
+
+    def start(self):
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flush loop and write any remaining changes"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
@@ -2,84 +2,222 @@
 Module for handling XP and levels
 """
 from datetime import datetime, timedelta
+from html import escape
 
-# Store user XP data in memory (in a real app, this would be in a database)
+from src.content.registry import get_catalogue
+from src.gamification.leaderboard import leaderboard, week_key
+from src.gamification.level_curve import level_curve
+from src.gamification.rules import achievement_bit, evaluate
+from src.gamification.xp_store import XPStore
+
+# Store user XP data in memory, backed by the database through a write-behind store
 user_xp_data = {}
+xp_store = XPStore(user_xp_data)
 
-# XP thresholds for each level
-LEVEL_THRESHOLDS = {
-    1: 0,
-    2: 100,
-    3: 250,
-    4: 500,
-    5: 1000,
-    6: 2000,
-    7: 3500,
-    8: 5000,
-    9: 7500,
-    10: 10000
-}
+async def get_user_data(user_id):
+    """
+    Get user's XP data, loading it from the database on first access
+    
+    Args:
+        user_id: User ID
+        
+    Returns:
+        User data dictionary or None if the user has no progress yet
+    """
+    return await xp_store.load(user_id)
 
-async def award_xp(user_id, amount, reason):
+async def get_or_create_user_data(user_id):
     """
-    Award XP to a user
+    Get user's XP data, creating an empty record for new users
     
     Args:
         user_id: User ID
-        amount: Amount of XP to award
-        reason: Reason for awarding XP
         
     Returns:
-        Dictionary with new XP total and level
+        User data dictionary
     """
-    # Initialize user data if not exists
-    if user_id not in user_xp_data:
-        user_xp_data[user_id] = {
+    user_data = await xp_store.load(user_id)
+    if user_data is None:
+        user_data = user_xp_data.setdefault(user_id, {
             "xp": 0,
             "level": 1,
             "streak_days": 0,
             "last_activity": None,
+            "weekly_xp": 0,
+            "xp_week": None,
+            "first_name": None,
+            "counters": {},
+            "achievement_bits": 0,
             "achievements": []
-        }
+        })
+    return user_data
+
+def remember_name(user_id, first_name):
+    """
+    Remember the name of a user for the leaderboard
+    
+    Args:
+        user_id: User ID
+        first_name: Telegram first name
+    """
+    user_data = user_xp_data.get(user_id)
+    if user_data is not None and user_data.get("first_name") != first_name:
+        user_data["first_name"] = first_name
+        xp_store.mark_dirty(user_id)
+
+async def award_xp(user_id, amount, reason, event=None, lesson_id=None, question_key=None, **counters):
+    """
+    Award XP to a user and check the achievements listening to an event
+    
+    Every award is written to the XP ledger, achievement rewards as separate
+    rows with the reason "achievement:<id>".
+    
+    Args:
+        user_id: User ID
+        amount: Amount of XP to award
+        reason: Reason code, e.g. "lesson_completed"
+        event: Event type that triggered the award, e.g. "lesson_completed"
+        lesson_id: Lesson the award refers to
+        question_key: Question the award refers to
+        **counters: Amounts to add to the user's event counters
+        
+    Returns:
+        Dictionary with new XP total and level and the newly earned achievements
+    """
+    # Initialize user data if not exists
+    user_data = await get_or_create_user_data(user_id)
+    events = [event] if event else []
     
     # Update streak
     current_time = datetime.now()
-    if user_xp_data[user_id]["last_activity"]:
-        last_activity = user_xp_data[user_id]["last_activity"]
-        time_diff = current_time - last_activity
+    if user_data["last_activity"]:
+        time_diff = current_time - user_data["last_activity"]
         
         # If last activity was between 20-28 hours ago, increment streak
         if timedelta(hours=20) <= time_diff <= timedelta(hours=28):
-            user_xp_data[user_id]["streak_days"] += 1
-            
-            # Check for streak achievements
-            if user_xp_data[user_id]["streak_days"] == 3:
-                await award_achievement(user_id, "streaker", "Стрикер", "Вы занимались 3 дня подряд!")
+            user_data["streak_days"] += 1
+            events.append("streak")
         
         # If more than 28 hours, reset streak
         elif time_diff > timedelta(hours=28):
-            user_xp_data[user_id]["streak_days"] = 1
+            user_data["streak_days"] = 1
     
     # Update last activity
-    user_xp_data[user_id]["last_activity"] = current_time
+    user_data["last_activity"] = current_time
     
-    # Add XP
-    old_xp = user_xp_data[user_id]["xp"]
-    old_level = user_xp_data[user_id]["level"]
+    # Update event counters and check the rules listening to the events
+    for name, value in counters.items():
+        user_data["counters"][name] = user_data["counters"].get(name, 0) + value
     
-    user_xp_data[user_id]["xp"] += amount
+    _record(user_id, amount, reason, current_time, lesson_id, question_key)
     
-    # Check for level up
-    new_level = calculate_level(user_xp_data[user_id]["xp"])
-    user_xp_data[user_id]["level"] = new_level
+    earned = []
+    for achievement in evaluate(user_data, events):
+        earned.append(_grant_achievement(user_id, user_data, achievement, current_time))
+        amount += achievement.xp_reward
+    
+    # Add XP, including achievement rewards, in the same update
+    old_level = user_data["level"]
+    _add_xp(user_id, user_data, amount, current_time)
+    xp_store.mark_dirty(user_id)
     
     # Return updated data
     return {
-        "xp": user_xp_data[user_id]["xp"],
-        "level": new_level,
-        "level_up": new_level > old_level
+        "xp": user_data["xp"],
+        "level": user_data["level"],
+        "level_up": user_data["level"] > old_level,
+        "achievements": earned
     }
 
+async def record_answer(user_id, category, correct):
+    """
+    Count an answered question and check the achievements listening to answers
+    
+    Answers of the diagnostic test, lesson practice and reviews all count
+    towards the accuracy of their category. Only achievement rewards add XP
+    here; XP for correct answers is awarded by the handlers.
+    
+    Args:
+        user_id: User ID
+        category: Category of the question
+        correct: Whether the answer was correct
+        
+    Returns:
+        List of newly earned achievement dictionaries
+    """
+    user_data = await get_or_create_user_data(user_id)
+    counters = user_data["counters"]
+    counters[f"answered_{category}"] = counters.get(f"answered_{category}", 0) + 1
+    if correct:
+        counters[f"correct_{category}"] = counters.get(f"correct_{category}", 0) + 1
+    
+    current_time = datetime.now()
+    earned = []
+    reward = 0
+    for achievement in evaluate(user_data, ["question_answered"]):
+        earned.append(_grant_achievement(user_id, user_data, achievement, current_time))
+        reward += achievement.xp_reward
+    if reward:
+        _add_xp(user_id, user_data, reward, current_time)
+    
+    xp_store.mark_dirty(user_id)
+    return earned
+
+def achievements_text(earned):
+    """
+    Format newly earned achievements for a message
+    
+    Args:
+        earned: Achievement dictionaries
+        
+    Returns:
+        Lines of the achievements, empty if there are none
+    """
+    return "\n".join(
+        f"🏆 Новое достижение: {escape(achievement['name'])} - {escape(achievement['description'])}"
+        for achievement in earned
+    )
+
+def _add_xp(user_id, user_data, amount, current_time):
+    """Add XP to the total, the weekly leaderboard and the level"""
+    user_data["xp"] += amount
+    
+    # Add weekly XP, starting over in a new week
+    week = week_key(current_time)
+    if user_data.get("xp_week") != week:
+        user_data["xp_week"] = week
+        user_data["weekly_xp"] = 0
+    user_data["weekly_xp"] += amount
+    leaderboard.add(user_id, amount, week)
+    
+    # Check for level up
+    user_data["level"] = calculate_level(user_data["xp"])
+
+def _record(user_id, amount, reason, current_time, lesson_id=None, question_key=None):
+    """Buffer an XP ledger row"""
+    xp_store.record({
+        "telegram_id": user_id,
+        "amount": amount,
+        "reason": reason,
+        "lesson_id": lesson_id,
+        "question_key": question_key,
+        "created_at": current_time
+    })
+
+def _grant_achievement(user_id, user_data, achievement, current_time):
+    """Mark an achievement as earned and schedule it and its reward to be saved"""
+    _record(user_id, achievement.xp_reward, f"achievement:{achievement.id}", current_time)
+    user_data["achievement_bits"] |= achievement_bit(achievement.id)
+    earned = {
+        "id": achievement.id,
+        "name": achievement.name,
+        "description": achievement.description,
+        "earned_date": current_time
+    }
+    user_data["achievements"].append(earned)
+    xp_store.mark_dirty(user_id, achievement=earned)
+    return earned
+
 def calculate_level(xp):
     """
     Calculate level based on XP
@@ -90,10 +228,7 @@ def calculate_level(xp):
     Returns:
         Level number
     """
-    for level, threshold in sorted(LEVEL_THRESHOLDS.items(), key=lambda x: x[1], reverse=True):
-        if xp >= threshold:
-            return level
-    return 1
+    return level_curve.level(xp)
 
 async def get_user_level(user_id):
     """
@@ -105,48 +240,35 @@ async def get_user_level(user_id):
     Returns:
         Level number
     """
-    if user_id not in user_xp_data:
+    user_data = await get_user_data(user_id)
+    if user_data is None:
         return 1
     
-    return user_xp_data[user_id]["level"]
+    return user_data["level"]
 
-async def award_achievement(user_id, achievement_id, name, description):
+async def award_achievement(user_id, achievement_id):
     """
-    Award an achievement to a user
+    Award an achievement to a user outside of the rules
     
     Args:
         user_id: User ID
         achievement_id: Achievement ID
-        name: Achievement name
-        description: Achievement description
         
     Returns:
         True if the achievement was newly awarded, False if already had it
     """
     # Initialize user data if not exists
-    if user_id not in user_xp_data:
-        user_xp_data[user_id] = {
-            "xp": 0,
-            "level": 1,
-            "streak_days": 0,
-            "last_activity": None,
-            "achievements": []
-        }
+    user_data = await get_or_create_user_data(user_id)
     
     # Check if user already has this achievement
-    for achievement in user_xp_data[user_id]["achievements"]:
-        if achievement["id"] == achievement_id:
-            return False
-    
-    # Award the achievement
-    user_xp_data[user_id]["achievements"].append({
-        "id": achievement_id,
-        "name": name,
-        "description": description,
-        "earned_date": datetime.now()
-    })
+    achievement = get_catalogue().achievement(achievement_id)
+    if achievement is None or user_data["achievement_bits"] & achievement_bit(achievement_id):
+        return False
     
-    # Award XP for the achievement (50 XP per achievement)
-    await award_xp(user_id, 50, f"Достижение: {name}")
+    # Award the achievement and its XP in one update
+    current_time = datetime.now()
+    _grant_achievement(user_id, user_data, achievement, current_time)
+    _add_xp(user_id, user_data, achievement.xp_reward, current_time)
+    xp_store.mark_dirty(user_id)
     
-    return True
\ No newline at end of file
+    return True
@@ -6,6 +6,7 @@ LESSONS = [
     {
         "id": 1,
         "topic": "Функции: основы",
+        "category": "functions",
         "theory": """
 Функции в Python - это блоки кода, которые выполняются только при их вызове. Они позволяют структурировать код, избегать повторений и делать программы более читаемыми.
 
@@ -41,6 +42,7 @@ print(message)  # Выведет: Привет, Алексей!
     {
         "id": 2,
         "topic": "ООП: классы и объекты",
+        "category": "oop",
         "theory": """
 Объектно-ориентированное программирование (ООП) - это парадигма программирования, основанная на концепции "объектов". В Python всё является объектами, и мы можем создавать собственные типы объектов с помощью классов.
 
@@ -85,6 +87,7 @@ print(my_dog.bark())  # Выведет: Бобик говорит: Гав!
     {
         "id": 3,
         "topic": "Работа с файлами",
+        "category": "files",
         "theory": """
 Python предоставляет простые и мощные инструменты для работы с файлами. Вы можете открывать файлы для чтения, записи или добавления данных.
 
@@ -121,6 +124,7 @@ with open('example.txt', 'r') as file:
     {
         "id": 4,
         "topic": "Функции: декораторы",
+        "category": "functions",
         "theory": """
 Декораторы - это мощный инструмент в Python, который позволяет изменять поведение функций или методов. Декоратор принимает функцию в качестве аргумента, добавляет к ней новую функциональность и возвращает модифицированную функцию.
 
@@ -166,6 +170,7 @@ say_hello()
     {
         "id": 5,
         "topic": "Обработка исключений",
+        "category": "exceptions",
         "theory": """
 Исключения в Python - это события, которые возникают во время выполнения программы и нарушают нормальный поток инструкций. Когда происходит ошибка, Python создает исключение, которое можно обработать.
 
@@ -211,6 +216,7 @@ finally:
     {
         "id": 6,
         "topic": "Модули и пакеты",
+        "category": "modules",
         "theory": """
 Модули в Python - это файлы с расширением .py, содержащие определения и инструкции Python. Модули позволяют организовать код логически, делая его более понятным и повторно используемым.
 
@@ -256,6 +262,7 @@ print(now)  # Выведет текущую дату и время
     {
         "id": 7,
         "topic": "Итераторы и генераторы",
+        "category": "iterators",
         "theory": """
 Итераторы - это объекты, которые можно перебирать (итерировать). Они реализуют методы __iter__() и __next__(), позволяющие последовательно получать элементы.
 
@@ -311,12 +318,10 @@ def get_lesson_by_id(lesson_id):
         lesson_id: ID of the lesson to retrieve
         
     Returns:
-        Lesson dictionary or None if not found
+        Lesson record or None if not found
     """
-    for lesson in LESSONS:
-        if lesson["id"] == lesson_id:
-            return lesson
-    return None
+    from src.content.registry import get_catalogue
+    return get_catalogue().lesson(lesson_id)
 
 def get_lesson_by_topic(topic):
     """
@@ -326,9 +331,7 @@ def get_lesson_by_topic(topic):
         topic: Topic of the lesson to retrieve
         
     Returns:
-        Lesson dictionary or None if not found
+        Lesson record or None if not found
     """
-    for lesson in LESSONS:
-        if lesson["topic"] == topic:
-            return lesson
-    return None
\ No newline at end of file
+    from src.content.registry import get_catalogue
+    return get_catalogue().lesson_by_topic(topic)
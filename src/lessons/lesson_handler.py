@@ -1,7 +1,9 @@
 """
 Module for handling lessons
 """
+import os
 from datetime import datetime, timedelta
+from functools import partial
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
@@ -9,11 +11,19 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from src.lessons.lesson_content import get_lesson_by_id, get_lesson_by_topic, LESSONS
-from src.gamification.xp_system import award_xp, get_user_level
+from src.bot.executor import update_executor
+from src.bot.messages import show_quiz_message
+from src.bot.timers import timers
+from src.content.templates import (
+    CORRECT_VERDICT, OUTDATED_SESSION_TEXT, STALE_ANSWER_TEXT, get_templates, is_stale_answer, parse_answer
+)
+from src.content.registry import get_catalogue
+from src.gamification.xp_system import achievements_text, award_xp, get_user_level, record_answer
+from src.lessons.reminders import reminders
+from src.lessons.review import review_store
 
 # Create a router
-router = Router()
+router = Router(name="lesson_router")
 
 # Define states for the lesson flow
 class LessonStates(StatesGroup):
@@ -24,6 +34,25 @@ class LessonStates(StatesGroup):
 # Store user lesson data in memory (in a real app, this would be in a database)
 user_lesson_data = {}
 
+# Seconds allowed for the practice part of a lesson
+LESSON_TIME_LIMIT = float(os.getenv("LESSON_TIME_LIMIT", "1800"))
+
+async def expire_practice(bot, chat_id: int, state: FSMContext, lesson_id: int):
+    """
+    End a practice that ran past the time limit
+    """
+    if await state.get_state() != LessonStates.answering_questions.state:
+        return
+    if (await state.get_data()).get("lesson_id") != lesson_id:
+        return
+    
+    await state.clear()
+    await bot.send_message(
+        chat_id,
+        f"⏰ Время на урок {lesson_id} ({int(LESSON_TIME_LIMIT // 60)} минут) истекло.\n\n"
+        f"Нажмите /lesson, чтобы начать урок заново."
+    )
+
 @router.message(Command("lesson"))
 async def cmd_start_lesson(message: Message, state: FSMContext):
     """
@@ -53,7 +82,7 @@ async def cmd_start_lesson(message: Message, state: FSMContext):
             hours_to_wait = 24 - (time_since_last_lesson.total_seconds() / 3600)
             await message.answer(
                 f"Вы уже прошли урок сегодня! Следующий урок будет доступен через {int(hours_to_wait)} часов.\n\n"
-                f"Пока вы ждете, почему бы не повторить пройденный материал?"
+                f"Пока вы ждете, почему бы не повторить пройденный материал с помощью команды /review?"
             )
             return
         
@@ -61,7 +90,7 @@ async def cmd_start_lesson(message: Message, state: FSMContext):
         if user_lesson_data[user_id]["current_lesson"] in user_lesson_data[user_id]["completed_lessons"]:
             # Move to the next lesson
             current_lesson_id = user_lesson_data[user_id]["current_lesson"] + 1
-            if current_lesson_id > len(LESSONS):
+            if current_lesson_id > len(get_catalogue().lessons):
                 # All lessons completed
                 await message.answer(
                     "Поздравляем! Вы прошли все уроки в нашем курсе. 🎉\n\n"
@@ -76,7 +105,8 @@ async def cmd_start_lesson(message: Message, state: FSMContext):
             current_lesson_id = user_lesson_data[user_id]["current_lesson"]
     
     # Get the lesson content
-    lesson = get_lesson_by_id(current_lesson_id)
+    catalogue = get_catalogue()
+    lesson = catalogue.lesson(current_lesson_id)
     if not lesson:
         await message.answer("Урок не найден. Пожалуйста, свяжитесь с администратором.")
         return
@@ -84,21 +114,12 @@ async def cmd_start_lesson(message: Message, state: FSMContext):
     # Set state to viewing theory
     await state.set_state(LessonStates.viewing_theory)
     
-    # Create keyboard
-    builder = InlineKeyboardBuilder()
-    builder.button(text="Перейти к практике", callback_data=f"practice_{current_lesson_id}")
-    
     # Send lesson theory
-    await message.answer(
-        f"<b>Урок {current_lesson_id}: {lesson['topic']}</b>\n\n"
-        f"{lesson['theory']}\n\n"
-        f"<code>{lesson['code_example']}</code>\n\n"
-        f"Когда будете готовы, переходите к практическим заданиям.",
-        reply_markup=builder.as_markup()
-    )
+    template = get_templates(catalogue).lesson(current_lesson_id)
+    await message.answer(template.text, reply_markup=template.reply_markup)
     
     # Award XP for viewing theory
-    await award_xp(user_id, 10, "Просмотр теории")
+    await award_xp(user_id, 10, "theory_viewed", lesson_id=current_lesson_id)
 
 @router.callback_query(F.data.startswith("practice_"))
 async def start_practice(callback: CallbackQuery, state: FSMContext):
@@ -111,7 +132,8 @@ async def start_practice(callback: CallbackQuery, state: FSMContext):
     lesson_id = int(callback.data.split("_")[1])
     
     # Get the lesson content
-    lesson = get_lesson_by_id(lesson_id)
+    catalogue = get_catalogue()
+    lesson = catalogue.lesson(lesson_id)
     if not lesson:
         await callback.message.answer("Урок не найден. Пожалуйста, свяжитесь с администратором.")
         return
@@ -119,52 +141,66 @@ async def start_practice(callback: CallbackQuery, state: FSMContext):
     # Set state to answering questions
     await state.set_state(LessonStates.answering_questions)
     
-    # Store question data
+    # Store question data (questions are looked up by lesson ID in the
+    # content version the practice started with)
     await state.update_data(
         lesson_id=lesson_id,
-        questions=lesson["questions"],
+        content_version=catalogue.version,
+        question_count=len(lesson.questions),
         current_question=0,
         correct_answers=0
     )
     
+    # End the practice if it isn't finished in time, queued behind the
+    # chat's updates so that it never runs in the middle of one
+    chat_id = callback.message.chat.id
+    expire = partial(expire_practice, callback.bot, chat_id, state, lesson_id)
+    timers.schedule(("lesson", user_id), LESSON_TIME_LIMIT, lambda: update_executor.submit(chat_id, expire))
+    
     # Send the first question
     await send_question(callback.message, state)
 
-async def send_question(message: Message, state: FSMContext):
+async def end_outdated_practice(message: Message, state: FSMContext):
+    """
+    End a practice whose content version is no longer kept, so that it is
+    neither scored against other questions nor broken by a removed lesson
+    """
+    timers.cancel(("lesson", message.chat.id))
+    await state.clear()
+    await message.answer(f"{OUTDATED_SESSION_TEXT}\n\nНажмите /lesson, чтобы пройти урок заново.")
+
+async def send_question(message: Message, state: FSMContext, verdict: str = None):
     """
     Send a practice question to the user
+
+    Args:
+        message: Message to answer, or the answered question message to edit
+        state: FSM context
+        verdict: Feedback on the previous answer, shown above the question
     """
     # Get question data
     data = await state.get_data()
     current_idx = data["current_question"]
-    questions = data["questions"]
+    catalogue = get_catalogue(data.get("content_version"))
+    if catalogue is None:
+        await end_outdated_practice(message, state)
+        return
+    questions = catalogue.lesson(data["lesson_id"]).questions
     
     if current_idx >= len(questions):
         # No more questions, finish the practice
-        await finish_practice(message, state)
+        await finish_practice(message, state, verdict)
         return
     
     question = questions[current_idx]
     
-    # Create keyboard with letter options (A, B, C, D)
-    builder = InlineKeyboardBuilder()
-    letters = ['A', 'B', 'C', 'D']
-    for i, _ in enumerate(question["options"]):
-        if i < len(letters):
-            builder.button(text=letters[i], callback_data=f"option_{i}")
-    
-    # Format options with letters
-    options_text = ""
-    for i, option in enumerate(question["options"]):
-        if i < len(letters):
-            options_text += f"{letters[i]}. {option}\n"
-    
     # Send question with options in the message
-    await message.answer(
-        f"Вопрос {current_idx + 1} из {len(questions)}:\n\n"
-        f"{question['text']}\n\n"
-        f"{options_text}",
-        reply_markup=builder.as_markup()
+    template = get_templates(catalogue).question(question.key)
+    await show_quiz_message(
+        message,
+        template.render(current_idx + 1, len(questions)),
+        reply_markup=template.reply_markup,
+        verdict=verdict
     )
 
 @router.callback_query(F.data.startswith("option_"))
@@ -172,62 +208,104 @@ async def process_practice_answer(callback: CallbackQuery, state: FSMContext):
     """
     Process the user's answer to a practice question
     """
-    await callback.answer()
-    
-    # Get selected option
-    selected_option = int(callback.data.split("_")[1])
+    # Get selected option and the question it was given to
+    selected_option, question_key = parse_answer(callback.data)
     
     # Get question data
     data = await state.get_data()
+    if "lesson_id" not in data:
+        # The practice has ended, e.g. by the time limit
+        await callback.answer()
+        await callback.message.answer("Практика уже завершена. Нажмите /lesson, чтобы продолжить обучение.")
+        return
     current_idx = data["current_question"]
-    questions = data["questions"]
+    catalogue = get_catalogue(data.get("content_version"))
+    if catalogue is None:
+        await callback.answer()
+        await end_outdated_practice(callback.message, state)
+        return
+    questions = catalogue.lesson(data["lesson_id"]).questions
+    
+    # Ignore presses on questions that were already answered, e.g. a double tap
+    if is_stale_answer(question_key, questions, current_idx):
+        await callback.answer(STALE_ANSWER_TEXT)
+        return
+    
+    await callback.answer()
     question = questions[current_idx]
     
     # Check if the answer is correct
-    is_correct = selected_option == question["correct_index"]
+    is_correct = selected_option == question.correct_index
+    
+    # Schedule the question for spaced repetition and count it for the category achievements
+    await review_store.record(callback.from_user.id, question.key, is_correct)
+    earned = await record_answer(callback.from_user.id, question.category, is_correct)
     
     # Update correct answer count
     if is_correct:
         data["correct_answers"] += 1
-        await award_xp(callback.from_user.id, 20, "Правильный ответ")
+        await award_xp(
+            callback.from_user.id, 20, "correct_answer",
+            lesson_id=data["lesson_id"], question_key=question.key
+        )
     
     # Move to the next question
     data["current_question"] += 1
     await state.update_data(data)
     
-    # Send feedback
-    letters = ['A', 'B', 'C', 'D']
+    # Show feedback together with the next question
     if is_correct:
-        await callback.message.answer("✅ Правильно!")
+        verdict = CORRECT_VERDICT
     else:
-        correct_idx = question["correct_index"]
-        correct_letter = letters[correct_idx] if correct_idx < len(letters) else ""
-        correct_option = question["options"][correct_idx]
-        await callback.message.answer(f"❌ Неправильно. Правильный ответ: {correct_letter}. {correct_option}")
+        verdict = get_templates(catalogue).question(question.key).wrong_verdict
+    if earned:
+        verdict += "\n" + achievements_text(earned)
     
-    # Send the next question
-    await send_question(callback.message, state)
+    await send_question(callback.message, state, verdict)
 
-async def finish_practice(message: Message, state: FSMContext):
+async def finish_practice(message: Message, state: FSMContext, verdict: str = None):
     """
     Finish the practice part of the lesson
+
+    Args:
+        message: Message to answer, or the answered question message to edit
+        state: FSM context
+        verdict: Feedback on the last answer, shown above the results
     """
     # Get lesson data
     data = await state.get_data()
     lesson_id = data["lesson_id"]
     correct_answers = data["correct_answers"]
-    total_questions = len(data["questions"])
+    total_questions = data["question_count"]
     
     # Calculate score
     score_percentage = (correct_answers / total_questions) * 100
     
     # Mark lesson as completed
     user_id = message.chat.id
+    timers.cancel(("lesson", user_id))
+    earned = []
     if user_id in user_lesson_data:
         if lesson_id not in user_lesson_data[user_id]["completed_lessons"]:
             user_lesson_data[user_id]["completed_lessons"].append(lesson_id)
-            # Award XP for completing the lesson
-            await award_xp(user_id, 50, "Завершение урока")
+            # Award XP for completing the lesson and check lesson achievements
+            result = await award_xp(
+                user_id, 50, "lesson_completed",
+                event="lesson_completed",
+                lesson_id=lesson_id,
+                lessons_completed=1,
+                perfect_lessons=int(correct_answers == total_questions)
+            )
+            earned = result["achievements"]
+            
+            # Remind the user when the next lesson becomes available
+            if get_catalogue().lesson(lesson_id + 1):
+                reminders.schedule(
+                    user_id,
+                    message.chat.id,
+                    lesson_id + 1,
+                    user_lesson_data[user_id]["last_lesson_date"] + timedelta(hours=24)
+                )
     
     # Get user level
     level = await get_user_level(user_id)
@@ -236,13 +314,21 @@ async def finish_practice(message: Message, state: FSMContext):
     builder = InlineKeyboardBuilder()
     builder.button(text="Поделиться прогрессом", callback_data=f"share_{lesson_id}")
     
+    # List achievements earned with this lesson
+    earned_text = achievements_text(earned)
+    if earned_text:
+        earned_text += "\n\n"
+    
     # Send completion message
-    await message.answer(
+    await show_quiz_message(
+        message,
         f"🎉 Урок {lesson_id} завершен!\n\n"
         f"Ваш результат: {correct_answers} из {total_questions} ({score_percentage:.1f}%)\n\n"
         f"Вы заработали XP и достигли уровня {level}!\n\n"
+        f"{earned_text}"
         f"Следующий урок будет доступен через 24 часа. Не забудьте вернуться завтра!",
-        reply_markup=builder.as_markup()
+        reply_markup=builder.as_markup(),
+        verdict=verdict
     )
     
     # Reset state
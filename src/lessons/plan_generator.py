@@ -1,6 +1,17 @@
 """
 Module for generating personalized learning plans
+
+A plan depends only on which known weak areas a user has and in which order,
+so plans are built by a PlanEngine once per weak-area key and memoized in a
+bounded cache; every user with the same weak areas gets the same read-only
+plan. Lessons may list prerequisites: the engine orders lessons by priority
+(weak-area lessons first, then the default order) and puts the unplanned
+prerequisites of a lesson right before it, so the cost of a plan depends on
+the plan length and the prerequisite depth, not on the catalogue size.
 """
+import os
+from functools import lru_cache
+from types import MappingProxyType
 
 # Mapping of topics to lesson IDs
 TOPIC_TO_LESSON = {
@@ -22,36 +33,153 @@ DEFAULT_PLAN = {
     7: "Итераторы и генераторы"
 }
 
+# Lessons that have to come before a lesson in a plan
+LESSON_PREREQUISITES = {
+    4: [1]  # Decorators need basic functions
+}
+
+# Number of days in a learning plan
+PLAN_DAYS = 7
+
+# Number of weak-area keys whose plans are kept
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1024"))
+
+
+class PlanEngine:
+    """
+    Memoizing learning plan builder
+
+    Args:
+        area_lessons: Mapping of weak areas to recommended lesson IDs
+        topics: Mapping of lesson IDs to topics, in the default lesson order
+        prerequisites: Mapping of lesson IDs to the lesson IDs they require
+        days: Number of days in a plan
+        cache_size: Number of weak-area keys whose plans are kept
+
+    Raises:
+        ContentError: If a lesson is unknown or the prerequisites have a cycle
+    """
+
+    def __init__(self, area_lessons=TOPIC_TO_LESSON, topics=DEFAULT_PLAN, prerequisites=LESSON_PREREQUISITES,
+                 days=PLAN_DAYS, cache_size=PLAN_CACHE_SIZE):
+        self.days = days
+        self.topics = dict(topics)
+        self.area_lessons = {area: tuple(lesson_ids) for area, lesson_ids in area_lessons.items()}
+        self.prerequisites = {lesson_id: tuple(required) for lesson_id, required in prerequisites.items()}
+        self._check()
+
+        # Position of each lesson in the default order, to order prerequisites
+        self._rank = {lesson_id: rank for rank, lesson_id in enumerate(self.topics)}
+        for lesson_id, required in self.prerequisites.items():
+            self.prerequisites[lesson_id] = tuple(sorted(required, key=self._rank.__getitem__))
+
+        self._plan = lru_cache(maxsize=cache_size)(self._build)
+        self.default_plan = self._plan(())
+
+    def _check(self):
+        """Validate lesson references and reject prerequisite cycles"""
+        errors = []
+        for area, lesson_ids in self.area_lessons.items():
+            errors.extend(
+                f"area {area!r} refers to lesson {lesson_id} missing from the plan"
+                for lesson_id in lesson_ids if lesson_id not in self.topics
+            )
+        for lesson_id, required in self.prerequisites.items():
+            errors.extend(
+                f"lesson {lesson_id} requires lesson {other} missing from the plan"
+                for other in (lesson_id,) + required if other not in self.topics
+            )
+
+        # Iterative depth-first search, a lesson met again while on the path closes a cycle
+        state = {}
+        for root in self.prerequisites:
+            stack = [(root, iter(self.prerequisites.get(root, ())))]
+            state.setdefault(root, "path")
+            while stack:
+                lesson_id, required = stack[-1]
+                other = next(required, None)
+                if other is None:
+                    state[lesson_id] = "done"
+                    stack.pop()
+                elif state.get(other) == "path":
+                    errors.append(f"lesson {other} is its own prerequisite")
+                elif other not in state:
+                    state[other] = "path"
+                    stack.append((other, iter(self.prerequisites.get(other, ()))))
+
+        if errors:
+            from src.content.registry import ContentError
+            raise ContentError("Invalid learning plan:\n" + "\n".join(errors))
+
+    def key(self, weak_areas):
+        """
+        Get the canonical key of weak areas
+
+        Args:
+            weak_areas: Weak areas, most important first
+
+        Returns:
+            Tuple of the known weak areas without repeats, in their order
+        """
+        return tuple(dict.fromkeys(area for area in weak_areas if area in self.area_lessons))
+
+    def plan(self, weak_areas):
+        """
+        Get the learning plan for weak areas
+
+        Args:
+            weak_areas: Weak areas, most important first
+
+        Returns:
+            Read-only mapping of day numbers to lesson topics, shared between users
+        """
+        return self._plan(self.key(weak_areas))
+
+    def _build(self, key):
+        """Build the plan of a canonical weak-area key"""
+        planned = {}
+
+        def add(lesson_id):
+            # Place the unplanned prerequisites first, depth first
+            stack = [(lesson_id, iter(self.prerequisites.get(lesson_id, ())))]
+            while stack and len(planned) < self.days:
+                current, required = stack[-1]
+                other = next(required, None)
+                if other is None:
+                    stack.pop()
+                    planned.setdefault(current, len(planned) + 1)
+                elif other not in planned:
+                    stack.append((other, iter(self.prerequisites.get(other, ()))))
+
+        for area in key:
+            for lesson_id in self.area_lessons[area]:
+                if len(planned) >= self.days:
+                    break
+                add(lesson_id)
+        for lesson_id in self.topics:
+            if len(planned) >= self.days:
+                break
+            add(lesson_id)
+
+        return MappingProxyType({day: self.topics[lesson_id] for lesson_id, day in planned.items()})
+
+    def cache_info(self):
+        """Get the hit and miss counts of the plan cache"""
+        return self._plan.cache_info()
+
+
+# Engine used for all plans
+plan_engine = PlanEngine()
+
+
 def generate_learning_plan(weak_areas):
     """
     Generate a personalized learning plan based on weak areas
-    
+
     Args:
         weak_areas: List of weak areas (categories)
-        
+
     Returns:
-        Dictionary mapping day numbers to lesson topics
+        Read-only mapping of day numbers to lesson topics
     """
-    # If no weak areas, return default plan
-    if not weak_areas:
-        return DEFAULT_PLAN
-    
-    # Start with an empty plan
-    plan = {}
-    
-    # Add lessons for weak areas first
-    day = 1
-    for area in weak_areas:
-        if area in TOPIC_TO_LESSON:
-            for lesson_id in TOPIC_TO_LESSON[area]:
-                if day <= 7 and lesson_id not in [plan_lesson for plan_lesson in plan.values()]:
-                    plan[day] = DEFAULT_PLAN[lesson_id]
-                    day += 1
-    
-    # Fill remaining days with other lessons
-    for lesson_day, topic in DEFAULT_PLAN.items():
-        if day <= 7 and topic not in plan.values():
-            plan[day] = topic
-            day += 1
-    
-    return plan
\ No newline at end of file
+    return plan_engine.plan(weak_areas)
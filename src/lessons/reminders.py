@@ -0,0 +1,278 @@
+"""
+Module for reminding users that their next lesson is available
+
+Every user waiting for a lesson has one entry in a min-heap ordered by the
+time the lesson unlocks, mirrored in the lesson_reminders table. A single
+background task sleeps until the earliest deadline, then sends the due
+reminders in batches with reminder priority, so the outbound queue keeps
+them behind interactive replies. At startup the heap is rebuilt from the
+table in one query.
+
+Scheduling doesn't touch the database: new reminders are buffered and
+upserted in batches by a second task, like the XP store does, so finishing
+a lesson doesn't open its own write transaction next to the other writers.
+"""
+import asyncio
+import heapq
+import logging
+import os
+from datetime import datetime
+
+from aiogram.exceptions import TelegramForbiddenError
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.bot.outbound import REMINDER, send_priority
+from src.content.registry import get_catalogue
+from src.database.db import async_session
+from src.database.models import LessonReminder
+
+logger = logging.getLogger(__name__)
+
+# Number of reminders sent together
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "100"))
+
+# Maximum reminders per second, leaving room for interactive replies
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "20"))
+
+# Write scheduled reminders at least this often (seconds)
+REMINDER_FLUSH_INTERVAL = float(os.getenv("REMINDER_FLUSH_INTERVAL", "5"))
+
+
+class ReminderScheduler:
+    """
+    Scheduler of "next lesson is available" reminders
+
+    Args:
+        batch_size: Number of reminders sent or written together
+        rate: Maximum reminders per second
+        flush_interval: Maximum number of seconds before a scheduled reminder is written
+    """
+
+    def __init__(self, batch_size=REMINDER_BATCH_SIZE, rate=REMINDER_RATE, flush_interval=REMINDER_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.rate = rate
+        self.flush_interval = flush_interval
+
+        # Heap of (due timestamp, user ID); entries replaced by a later
+        # schedule() stay in the heap and are skipped when popped
+        self._heap = []
+        # Current reminder of each user as (due timestamp, chat ID, lesson ID)
+        self._pending = {}
+        # Users whose reminder is not written to the database yet
+        self._unsaved = set()
+
+        self._bot = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._write_lock = asyncio.Lock()
+        self._write_wakeup = asyncio.Event()
+        self._write_task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def load(self):
+        """Rebuild the heap from the database"""
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(
+                    LessonReminder.telegram_id,
+                    LessonReminder.chat_id,
+                    LessonReminder.lesson_id,
+                    LessonReminder.due_at
+                )
+            )).all()
+
+        self._pending = {
+            user_id: (due_at.timestamp(), chat_id, lesson_id)
+            for user_id, chat_id, lesson_id, due_at in rows
+        }
+        self._heap = [(due, user_id) for user_id, (due, _, _) in self._pending.items()]
+        heapq.heapify(self._heap)
+
+    def schedule(self, user_id, chat_id, lesson_id, due_at):
+        """
+        Remind a user when a lesson becomes available, replacing any earlier reminder
+
+        The reminder is written to the database by the next flush.
+
+        Args:
+            user_id: Telegram user ID
+            chat_id: Chat to send the reminder to
+            lesson_id: Lesson that becomes available
+            due_at: When the lesson becomes available
+        """
+        due = due_at.timestamp()
+        self._pending[user_id] = (due, chat_id, lesson_id)
+        heapq.heappush(self._heap, (due, user_id))
+
+        self._unsaved.add(user_id)
+        if len(self._unsaved) >= self.batch_size:
+            self._write_wakeup.set()
+
+        # Drop replaced entries once they make up most of the heap
+        if len(self._heap) > 2 * len(self._pending) + 1000:
+            self._heap = [(due, user_id) for user_id, (due, _, _) in self._pending.items()]
+            heapq.heapify(self._heap)
+
+        if self._heap[0] == (due, user_id):
+            # New earliest deadline, the loop has to sleep less
+            self._wakeup.set()
+
+    def _pop_due(self, now):
+        """Pop up to batch_size due reminders"""
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            due, user_id = heapq.heappop(self._heap)
+            pending = self._pending.get(user_id)
+            if pending is None or pending[0] != due:
+                # Replaced or already sent
+                continue
+            del self._pending[user_id]
+            # Sent before it was written, there is nothing to save
+            self._unsaved.discard(user_id)
+            batch.append((user_id, pending[1], pending[2]))
+        return batch
+
+    async def flush(self):
+        """
+        Upsert all buffered reminders in a single transaction
+
+        Returns:
+            Number of reminders written
+        """
+        async with self._write_lock:
+            unsaved, self._unsaved = self._unsaved, set()
+            rows = [
+                {
+                    "telegram_id": user_id,
+                    "chat_id": self._pending[user_id][1],
+                    "lesson_id": self._pending[user_id][2],
+                    "due_at": datetime.fromtimestamp(self._pending[user_id][0])
+                }
+                for user_id in unsaved if user_id in self._pending
+            ]
+            if not rows:
+                return 0
+
+            stmt = sqlite_insert(LessonReminder)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[LessonReminder.telegram_id],
+                set_={
+                    "chat_id": stmt.excluded.chat_id,
+                    "lesson_id": stmt.excluded.lesson_id,
+                    "due_at": stmt.excluded.due_at
+                }
+            )
+            try:
+                async with async_session() as session:
+                    async with session.begin():
+                        await session.execute(stmt, rows)
+            except Exception:
+                # The pending reminders hold the latest state, the next flush writes it
+                self._unsaved |= unsaved
+                raise
+
+            return len(rows)
+
+    async def _write_loop(self):
+        """Background loop writing buffered reminders by time or by count"""
+        while True:
+            try:
+                await asyncio.wait_for(self._write_wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._write_wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to write lesson reminders, will retry")
+
+    async def _send(self, chat_id, lesson_id):
+        """Send one reminder"""
+        lesson = get_catalogue().lesson(lesson_id)
+        lesson_text = f"урок {lesson_id}: {lesson.topic}" if lesson else "следующий урок"
+        try:
+            with send_priority(REMINDER):
+                await self._bot.send_message(
+                    chat_id,
+                    f"Сегодняшний урок ждет тебя! 📚\n\n"
+                    f"Нажми /lesson, чтобы начать {lesson_text}."
+                )
+        except TelegramForbiddenError:
+            # The user blocked the bot
+            pass
+        except Exception:
+            logger.exception("Failed to send lesson reminder to chat %s", chat_id)
+
+    async def _dispatch(self, batch, sent_before):
+        """Send a batch of reminders and remove them from the database"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        await asyncio.gather(*(self._send(chat_id, lesson_id) for _, chat_id, lesson_id in batch))
+
+        # Rows rescheduled in the meantime have a later due time and stay;
+        # the lock keeps a flush that is writing one of them from landing after the delete
+        async with self._write_lock, async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    delete(LessonReminder)
+                    .where(LessonReminder.telegram_id.in_([user_id for user_id, _, _ in batch]))
+                    .where(LessonReminder.due_at <= sent_before)
+                )
+
+        # Keep to the reminder rate
+        await asyncio.sleep(max(0.0, len(batch) / self.rate - (loop.time() - started)))
+
+    async def _run(self):
+        """Background loop sleeping until the earliest reminder is due"""
+        while True:
+            now = datetime.now()
+            batch = self._pop_due(now.timestamp())
+            if batch:
+                try:
+                    await self._dispatch(batch, now)
+                except Exception:
+                    logger.exception("Failed to dispatch lesson reminders")
+                continue
+
+            timeout = self._heap[0][0] - now.timestamp() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, bot):
+        """
+        Load the pending reminders and start sending them
+
+        Args:
+            bot: Bot used to send the reminders
+        """
+        self._bot = bot
+        if self._task is None:
+            await self.load()
+            self._task = asyncio.create_task(self._run())
+            self._write_task = asyncio.create_task(self._write_loop())
+
+    async def stop(self):
+        """Stop sending reminders and write the buffered ones, they stay in the database"""
+        for task in (self._task, self._write_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._write_task = None
+
+        await self.flush()
+
+
+# Scheduler shared by the lesson handlers
+reminders = ReminderScheduler()
@@ -0,0 +1,430 @@
+"""
+Module for spaced repetition of answered questions
+
+Every question a user answers in the test, a lesson or a review becomes a
+card scheduled with the SM-2 algorithm: correct answers in a row push the
+next review further out by the card's ease factor, a wrong answer brings the
+card back the next day and lowers its ease.
+
+The cards of a user are loaded on first access and kept in memory with their
+due times in a sorted list, so the next due cards of a user are the head of
+that list and a change is two binary searches. Users are indexed by their
+earliest due time in a min-heap, rebuilt at startup from the
+(telegram_id, due_at) index of the review_cards table, so finding the users
+with cards due now doesn't scan all cards. Review outcomes are written back
+in batches like the XP store does.
+"""
+import asyncio
+import heapq
+import logging
+import os
+from bisect import bisect_right, insort
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from src.database.db import async_session
+from src.database.models import ReviewCard
+
+logger = logging.getLogger(__name__)
+
+# Ease factor of a new card
+INITIAL_EASE = 2.5
+
+# Lowest ease factor, cards below it would come back too often
+MIN_EASE = 1.3
+
+# Longest time between reviews of a card, in days
+MAX_INTERVAL = 365
+
+# SM-2 answer quality (0-5) of a correct and of a wrong multiple choice answer
+CORRECT_QUALITY = 4
+WRONG_QUALITY = 1
+
+# Write review outcomes at least this often (seconds)
+REVIEW_FLUSH_INTERVAL = float(os.getenv("REVIEW_FLUSH_INTERVAL", "5"))
+
+# Write review outcomes immediately once this many cards changed
+REVIEW_FLUSH_BATCH_SIZE = int(os.getenv("REVIEW_FLUSH_BATCH_SIZE", "200"))
+
+
+@dataclass(frozen=True)
+class Card:
+    """SM-2 state of a question for a user"""
+    ease: float
+    interval: float  # days until the next review
+    repetitions: int  # correct answers in a row
+    lapses: int  # wrong answers
+    due: float  # timestamp of the next review
+    reviewed_at: datetime
+
+
+def review_card(card, quality, now):
+    """
+    Schedule the next review of a card with SM-2
+
+    Args:
+        card: Card, or None for a question answered for the first time
+        quality: Answer quality from 0 (blackout) to 5 (perfect)
+        now: Datetime of the answer
+
+    Returns:
+        New card
+    """
+    if card is None:
+        card = Card(INITIAL_EASE, 0.0, 0, 0, now.timestamp(), now)
+
+    if quality >= 3:
+        repetitions = card.repetitions + 1
+        if repetitions == 1:
+            interval = 1.0
+        elif repetitions == 2:
+            interval = 6.0
+        else:
+            interval = float(min(round(card.interval * card.ease), MAX_INTERVAL))
+        lapses = card.lapses
+    else:
+        repetitions = 0
+        interval = 1.0
+        lapses = card.lapses + 1
+
+    ease = max(MIN_EASE, card.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return Card(ease, interval, repetitions, lapses, (now + timedelta(days=interval)).timestamp(), now)
+
+
+class Deck:
+    """
+    Cards of one user, ordered by due time
+
+    Args:
+        cards: Dictionary mapping question keys to cards
+    """
+
+    def __init__(self, cards=None):
+        self.cards = dict(cards or {})
+        # Sorted (due timestamp, question key) of all cards
+        self._due = sorted((card.due, key) for key, card in self.cards.items())
+
+    def __len__(self):
+        return len(self.cards)
+
+    def put(self, key, card):
+        """
+        Add or replace a card
+
+        Args:
+            key: Question key
+            card: Card
+        """
+        old = self.cards.get(key)
+        if old is not None:
+            self._due.pop(bisect_right(self._due, (old.due, key)) - 1)
+        self.cards[key] = card
+        insort(self._due, (card.due, key))
+
+    def due(self, now, limit, valid=None):
+        """
+        Get the keys of the cards due before a moment, earliest first
+
+        Args:
+            now: Timestamp
+            limit: Maximum number of keys
+            valid: Predicate of the keys to return, others are skipped
+
+        Returns:
+            List of question keys
+        """
+        keys = []
+        for due, key in self._due:
+            if due >= now or len(keys) >= limit:
+                break
+            if valid is None or valid(key):
+                keys.append(key)
+        return keys
+
+    def count_due(self, now):
+        """Count the cards due before a moment"""
+        # (now,) sorts before every entry due exactly at now
+        return bisect_right(self._due, (now,))
+
+    def next_due(self):
+        """Get the earliest due timestamp, None if there are no cards"""
+        return self._due[0][0] if self._due else None
+
+
+class ReviewStore:
+    """
+    Write-behind store of review cards with due-time indexes
+
+    Args:
+        flush_interval: Maximum number of seconds between writes
+        batch_size: Number of changed cards that triggers an early write
+    """
+
+    def __init__(self, flush_interval=REVIEW_FLUSH_INTERVAL, batch_size=REVIEW_FLUSH_BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        # Decks of the users that were looked up in the database
+        self.decks = {}
+        # Heap of (earliest due timestamp, user ID); entries replaced by a
+        # later change stay in the heap and are skipped when reached
+        self._heap = []
+        # Current earliest due timestamp of each user with cards
+        self._next_due = {}
+        # (user ID, question key) of cards with unsaved changes
+        self._dirty = set()
+
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def load_index(self):
+        """Rebuild the user heap from the database"""
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(ReviewCard.telegram_id, func.min(ReviewCard.due_at))
+                .group_by(ReviewCard.telegram_id)
+            )).all()
+
+        self._next_due = {user_id: due_at.timestamp() for user_id, due_at in rows}
+        for user_id, deck in self.decks.items():
+            if deck.next_due() is not None:
+                self._next_due[user_id] = deck.next_due()
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        """Build the user heap from the current earliest due times"""
+        self._heap = [(due, user_id) for user_id, due in self._next_due.items()]
+        heapq.heapify(self._heap)
+
+    async def load(self, user_id):
+        """
+        Get the deck of a user, reading it from the database on first access
+
+        Args:
+            user_id: Telegram user ID
+
+        Returns:
+            Deck
+        """
+        deck = self.decks.get(user_id)
+        if deck is not None:
+            return deck
+
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(ReviewCard).where(ReviewCard.telegram_id == user_id)
+            )).scalars().all()
+
+        # Another coroutine may have loaded the deck while we were waiting
+        deck = self.decks.get(user_id)
+        if deck is not None:
+            return deck
+
+        deck = self.decks[user_id] = Deck({
+            row.question_key: Card(
+                row.ease, row.interval, row.repetitions, row.lapses, row.due_at.timestamp(), row.reviewed_at
+            )
+            for row in rows
+        })
+        return deck
+
+    async def record(self, user_id, question_key, correct, now=None):
+        """
+        Schedule the next review of a question after an answer
+
+        Args:
+            user_id: Telegram user ID
+            question_key: Key of the answered question
+            correct: Whether the answer was correct
+            now: Datetime of the answer, defaults to the current time
+
+        Returns:
+            New card
+        """
+        now = now or datetime.now()
+        deck = await self.load(user_id)
+        card = review_card(deck.cards.get(question_key), CORRECT_QUALITY if correct else WRONG_QUALITY, now)
+        deck.put(question_key, card)
+        self._reindex(user_id, deck.next_due())
+
+        self._dirty.add((user_id, question_key))
+        if len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+        return card
+
+    def _reindex(self, user_id, due):
+        """Move a user to a new earliest due time in the heap"""
+        if self._next_due.get(user_id) == due:
+            return
+        self._next_due[user_id] = due
+        heapq.heappush(self._heap, (due, user_id))
+
+        # Drop replaced entries once they make up most of the heap
+        if len(self._heap) > 2 * len(self._next_due) + 1000:
+            self._rebuild_heap()
+
+    async def due(self, user_id, limit, now=None, valid=None):
+        """
+        Get the next due cards of a user
+
+        Args:
+            user_id: Telegram user ID
+            limit: Maximum number of cards
+            now: Datetime, defaults to the current time
+            valid: Predicate of the question keys to return, e.g. that the question still exists
+
+        Returns:
+            List of question keys, the longest overdue first
+        """
+        deck = await self.load(user_id)
+        return deck.due((now or datetime.now()).timestamp(), limit, valid)
+
+    async def next_due_at(self, user_id):
+        """
+        Get when the earliest card of a user is due
+
+        Args:
+            user_id: Telegram user ID
+
+        Returns:
+            Datetime, or None if the user has no cards
+        """
+        due = (await self.load(user_id)).next_due()
+        return datetime.fromtimestamp(due) if due is not None else None
+
+    def users_due(self, now=None, limit=None):
+        """
+        Get the users having cards due
+
+        Args:
+            now: Datetime, defaults to the current time
+            limit: Maximum number of users, all by default
+
+        Returns:
+            List of user IDs, the longest overdue first
+        """
+        now = (now or datetime.now()).timestamp()
+        found = []
+        while self._heap and self._heap[0][0] < now and (limit is None or len(found) < limit):
+            due, user_id = heapq.heappop(self._heap)
+            if self._next_due.get(user_id) == due:
+                found.append((due, user_id))
+
+        # Keep the current entries, the replaced ones are gone for good
+        for entry in found:
+            heapq.heappush(self._heap, entry)
+        return [user_id for _, user_id in found]
+
+    def count_users_due(self, now=None):
+        """
+        Count the users having cards due without changing the heap
+
+        Args:
+            now: Datetime, defaults to the current time
+
+        Returns:
+            Number of users
+        """
+        now = (now or datetime.now()).timestamp()
+        found = set()
+        # Children in the heap are never due before their parent, so only
+        # the due part of the tree is visited
+        stack = [0] if self._heap else []
+        while stack:
+            i = stack.pop()
+            due, user_id = self._heap[i]
+            if due >= now:
+                continue
+            if self._next_due.get(user_id) == due:
+                found.add(user_id)
+            stack.extend(child for child in (2 * i + 1, 2 * i + 2) if child < len(self._heap))
+        return len(found)
+
+    async def flush(self):
+        """
+        Write all changed cards in a single transaction
+
+        Returns:
+            Number of cards written
+        """
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            for user_id, question_key in dirty:
+                card = self.decks[user_id].cards[question_key]
+                rows.append({
+                    "telegram_id": user_id,
+                    "question_key": question_key,
+                    "ease": card.ease,
+                    "interval": card.interval,
+                    "repetitions": card.repetitions,
+                    "lapses": card.lapses,
+                    "due_at": datetime.fromtimestamp(card.due),
+                    "reviewed_at": card.reviewed_at
+                })
+
+            stmt = sqlite_insert(ReviewCard)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ReviewCard.telegram_id, ReviewCard.question_key],
+                set_={
+                    "ease": stmt.excluded.ease,
+                    "interval": stmt.excluded.interval,
+                    "repetitions": stmt.excluded.repetitions,
+                    "lapses": stmt.excluded.lapses,
+                    "due_at": stmt.excluded.due_at,
+                    "reviewed_at": stmt.excluded.reviewed_at
+                }
+            )
+            try:
+                async with async_session() as session:
+                    async with session.begin():
+                        await session.execute(stmt, rows)
+            except Exception:
+                # The decks hold the latest state, the next flush writes it
+                self._dirty |= dirty
+                raise
+
+            return len(rows)
+
+    async def _run(self):
+        """Background loop writing changed cards by time or by count"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to write review cards, will retry")
+
+    async def start(self):
+        """Load the user index and start the background write loop"""
+        if self._task is None:
+            await self.load_index()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background write loop and write any remaining changes"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+
+# Review cards of all users
+review_store = ReviewStore()
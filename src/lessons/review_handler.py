@@ -0,0 +1,193 @@
+"""
+Module for handling spaced-repetition reviews
+"""
+import os
+
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+from src.bot.messages import show_quiz_message
+from src.content.registry import get_catalogue
+from src.content.templates import (
+    CORRECT_VERDICT, OUTDATED_SESSION_TEXT, STALE_ANSWER_TEXT, get_templates, is_stale_answer, parse_answer
+)
+from src.gamification.xp_system import achievements_text, record_answer
+from src.lessons.lesson_handler import LessonStates
+from src.lessons.review import review_store
+
+# Create a router
+router = Router(name="review_router")
+
+# Define states for the review flow
+class ReviewStates(StatesGroup):
+    answering_questions = State()
+
+# Number of due questions asked in one review
+REVIEW_SESSION_SIZE = int(os.getenv("REVIEW_SESSION_SIZE", "10"))
+
+@router.message(Command("review"))
+async def cmd_start_review(message: Message, state: FSMContext):
+    """
+    Start a review of the questions that are due
+    """
+    user_id = message.from_user.id
+
+    if await state.get_state() == LessonStates.answering_questions.state:
+        await message.answer("Сначала завершите практику урока, а потом переходите к повторению.")
+        return
+
+    # Questions removed from the content are skipped
+    catalogue = get_catalogue()
+    keys = await review_store.due(
+        user_id, REVIEW_SESSION_SIZE, valid=lambda key: catalogue.question(key) is not None
+    )
+
+    if not keys:
+        next_due_at = await review_store.next_due_at(user_id)
+        if next_due_at is None:
+            await message.answer(
+                "Вам пока нечего повторять. Пройдите /test или /lesson - "
+                "вопросы, на которые вы ответите, будут возвращаться для повторения."
+            )
+        else:
+            await message.answer(
+                f"Все повторения выполнены! 👍\n\n"
+                f"Следующее повторение: {next_due_at:%d.%m.%Y %H:%M}."
+            )
+        return
+
+    # Set state to answering questions
+    await state.set_state(ReviewStates.answering_questions)
+    await state.update_data(
+        review_keys=keys,
+        content_version=catalogue.version,
+        current_question=0,
+        correct_answers=0
+    )
+
+    await message.answer(f"🔁 Повторение: {len(keys)} вопросов, которые пора освежить в памяти.")
+    await send_question(message, state)
+
+async def end_outdated_review(message: Message, state: FSMContext):
+    """
+    End a review whose content version is no longer kept
+    """
+    await state.clear()
+    await message.answer(f"{OUTDATED_SESSION_TEXT}\n\nНажмите /review, чтобы начать повторение заново.")
+
+async def send_question(message: Message, state: FSMContext, verdict: str = None):
+    """
+    Send a review question to the user
+
+    Args:
+        message: Message to answer, or the answered question message to edit
+        state: FSM context
+        verdict: Feedback on the previous answer, shown above the question
+    """
+    # Get review data
+    data = await state.get_data()
+    current_idx = data["current_question"]
+    keys = data["review_keys"]
+
+    if current_idx >= len(keys):
+        # No more questions, finish the review
+        await finish_review(message, state, verdict)
+        return
+
+    # Send question with options in the message
+    catalogue = get_catalogue(data.get("content_version"))
+    if catalogue is None:
+        await end_outdated_review(message, state)
+        return
+    template = get_templates(catalogue).review_question(keys[current_idx])
+    await show_quiz_message(
+        message,
+        template.render(current_idx + 1, len(keys)),
+        reply_markup=template.reply_markup,
+        verdict=verdict
+    )
+
+@router.callback_query(F.data.startswith("review_"))
+async def process_review_answer(callback: CallbackQuery, state: FSMContext):
+    """
+    Process the user's answer to a review question
+    """
+    # Get selected option and the question it was given to
+    selected_option, question_key = parse_answer(callback.data)
+
+    # Get review data
+    data = await state.get_data()
+    if "review_keys" not in data:
+        await callback.answer()
+        await callback.message.answer("Повторение уже завершено. Нажмите /review, чтобы начать новое.")
+        return
+    current_idx = data["current_question"]
+    catalogue = get_catalogue(data.get("content_version"))
+    if catalogue is None:
+        await callback.answer()
+        await end_outdated_review(callback.message, state)
+        return
+    questions = [catalogue.question(key) for key in data["review_keys"]]
+
+    # Ignore presses on questions that were already answered, e.g. a double tap
+    if is_stale_answer(question_key, questions, current_idx):
+        await callback.answer(STALE_ANSWER_TEXT)
+        return
+
+    await callback.answer()
+    question = questions[current_idx]
+
+    # Check the answer, schedule the next review of the question and count
+    # it for the category achievements
+    is_correct = selected_option == question.correct_index
+    await review_store.record(callback.from_user.id, question.key, is_correct)
+    earned = await record_answer(callback.from_user.id, question.category, is_correct)
+    if is_correct:
+        data["correct_answers"] += 1
+
+    # Move to the next question
+    data["current_question"] += 1
+    await state.update_data(data)
+
+    # Show feedback together with the next question
+    if is_correct:
+        verdict = CORRECT_VERDICT
+    else:
+        verdict = get_templates(catalogue).question(question.key).wrong_verdict
+    if earned:
+        verdict += "\n" + achievements_text(earned)
+
+    await send_question(callback.message, state, verdict)
+
+async def finish_review(message: Message, state: FSMContext, verdict: str = None):
+    """
+    Finish the review and show the result
+
+    Args:
+        message: Message to answer, or the answered question message to edit
+        state: FSM context
+        verdict: Feedback on the last answer, shown above the result
+    """
+    data = await state.get_data()
+    correct_answers = data["correct_answers"]
+    total_questions = len(data["review_keys"])
+
+    next_due_at = await review_store.next_due_at(message.chat.id)
+    next_text = ""
+    if next_due_at is not None:
+        next_text = f"\n\nСледующее повторение: {next_due_at:%d.%m.%Y %H:%M}."
+
+    await show_quiz_message(
+        message,
+        f"🔁 Повторение завершено!\n\n"
+        f"Правильных ответов: {correct_answers} из {total_questions}.\n"
+        f"Вопросы с ошибками вернутся завтра, остальные - позже."
+        f"{next_text}",
+        verdict=verdict
+    )
+
+    # Reset state
+    await state.clear()
@@ -1,6 +1,8 @@
 """
 Module for handling the diagnostic test
 """
+import os
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
@@ -8,12 +10,20 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from src.bot.messages import show_quiz_message
+from src.bot.timers import timers
+from src.content.registry import get_catalogue
+from src.content.templates import (
+    CORRECT_VERDICT, OUTDATED_SESSION_TEXT, STALE_ANSWER_TEXT, get_templates, is_stale_answer, parse_answer
+)
 from src.database.models import User, TestResult
 from src.lessons.test_questions import get_test_questions
 from src.lessons.plan_generator import generate_learning_plan
+from src.gamification.xp_system import achievements_text, record_answer
+from src.lessons.review import review_store
 
 # Create a router
-router = Router()
+router = Router(name="test_router")
 
 # Define states for the test flow
 class TestStates(StatesGroup):
@@ -24,6 +34,23 @@ class TestStates(StatesGroup):
 # Store user test data in memory (in a real app, this would be in a database)
 user_test_data = {}
 
+# Seconds after the last answer before an abandoned test is dropped
+TEST_SESSION_TTL = float(os.getenv("TEST_SESSION_TTL", "3600"))
+
+def touch_test_session(user_id: int):
+    """
+    Restart the idle timer of a user's test data
+    """
+    timers.schedule(("test", user_id), TEST_SESSION_TTL, lambda: user_test_data.pop(user_id, None))
+
+async def end_outdated_test(message: Message, user_id: int):
+    """
+    End a test whose content version is no longer kept
+    """
+    user_test_data.pop(user_id, None)
+    timers.cancel(("test", user_id))
+    await message.answer(f"{OUTDATED_SESSION_TEXT}\n\nНажмите /test, чтобы пройти тест заново.")
+
 @router.message(Command("test"))
 async def cmd_start_test(message: Message, state: FSMContext):
     """
@@ -31,10 +58,16 @@ async def cmd_start_test(message: Message, state: FSMContext):
     """
     # Initialize test data for this user
     user_id = message.from_user.id
-    questions = get_test_questions(10)  # Get 10 random questions
+    catalogue = get_catalogue()
+    
+    # Get 10 questions spread over the categories, preferring ones the user hasn't answered yet
+    deck = await review_store.load(user_id)
+    seen = {question.id for question in map(catalogue.question, deck.cards) if question and question.id is not None}
+    question_ids = get_test_questions(10, catalogue, exclude=seen)
     
     user_test_data[user_id] = {
-        "questions": questions,
+        "content_version": catalogue.version,
+        "question_ids": question_ids,
         "current_question": 0,
         "answers": [],
         "category_scores": {
@@ -53,6 +86,8 @@ async def cmd_start_test(message: Message, state: FSMContext):
         }
     }
     
+    touch_test_session(user_id)
+    
     # Set state to waiting for start
     await state.set_state(TestStates.waiting_for_start)
     
@@ -83,9 +118,14 @@ async def start_test(callback: CallbackQuery, state: FSMContext):
     # Send the first question
     await send_question(callback.message, user_id)
 
-async def send_question(message: Message, user_id: int):
+async def send_question(message: Message, user_id: int, verdict: str = None):
     """
     Send a question to the user
+
+    Args:
+        message: Message to answer, or the answered question message to edit
+        user_id: User ID
+        verdict: Feedback on the previous answer, shown above the question
     """
     # Get user test data
     test_data = user_test_data.get(user_id)
@@ -95,32 +135,25 @@ async def send_question(message: Message, user_id: int):
     
     # Get current question
     current_idx = test_data["current_question"]
-    if current_idx >= len(test_data["questions"]):
+    question_ids = test_data["question_ids"]
+    if current_idx >= len(question_ids):
         # No more questions, finish the test
-        await finish_test(message, user_id)
+        await finish_test(message, user_id, verdict)
         return
     
-    question = test_data["questions"][current_idx]
-    
-    # Create keyboard with letter options (A, B, C, D)
-    builder = InlineKeyboardBuilder()
-    letters = ['A', 'B', 'C', 'D']
-    for i, _ in enumerate(question["options"]):
-        if i < len(letters):
-            builder.button(text=letters[i], callback_data=f"answer_{i}")
-    
-    # Format options with letters
-    options_text = ""
-    for i, option in enumerate(question["options"]):
-        if i < len(letters):
-            options_text += f"{letters[i]}. {option}\n"
+    catalogue = get_catalogue(test_data["content_version"])
+    if catalogue is None:
+        await end_outdated_test(message, user_id)
+        return
+    question = catalogue.test_question(question_ids[current_idx])
     
     # Send question with options in the message
-    await message.answer(
-        f"Вопрос {current_idx + 1} из {len(test_data['questions'])}:\n\n"
-        f"{question['text']}\n\n"
-        f"{options_text}",
-        reply_markup=builder.as_markup()
+    template = get_templates(catalogue).question(question.key)
+    await show_quiz_message(
+        message,
+        template.render(current_idx + 1, len(question_ids)),
+        reply_markup=template.reply_markup,
+        verdict=verdict
     )
 
 @router.callback_query(F.data.startswith("answer_"))
@@ -128,55 +161,74 @@ async def process_answer(callback: CallbackQuery, state: FSMContext):
     """
     Process the user's answer
     """
-    await callback.answer()
-    
     user_id = callback.from_user.id
     
+    # Get selected answer and the question it was given to
+    selected_option, question_key = parse_answer(callback.data)
+    
     # Get user test data
     test_data = user_test_data.get(user_id)
     if not test_data:
+        await callback.answer()
         await callback.message.answer("Произошла ошибка. Пожалуйста, начните тест заново с помощью команды /test")
         return
     
-    # Get current question
+    # Ignore presses on questions that were already answered, e.g. a double tap
     current_idx = test_data["current_question"]
-    question = test_data["questions"][current_idx]
+    catalogue = get_catalogue(test_data["content_version"])
+    if catalogue is None:
+        await callback.answer()
+        await end_outdated_test(callback.message, user_id)
+        return
+    questions = [catalogue.test_question(question_id) for question_id in test_data["question_ids"]]
+    if is_stale_answer(question_key, questions, current_idx):
+        await callback.answer(STALE_ANSWER_TEXT)
+        return
     
-    # Get selected answer
-    selected_option = int(callback.data.split("_")[1])
+    await callback.answer()
+    
+    # Get current question
+    question = questions[current_idx]
     
     # Store the answer
     test_data["answers"].append({
-        "question_id": question["id"],
+        "question_id": question.id,
         "selected_option": selected_option,
-        "is_correct": selected_option == question["correct_index"]
+        "is_correct": selected_option == question.correct_index
     })
     
     # Update category scores
-    category = question["category"]
+    category = question.category
     test_data["category_counts"][category] += 1
-    if selected_option == question["correct_index"]:
+    if selected_option == question.correct_index:
         test_data["category_scores"][category] += 1
     
+    # Schedule the question for spaced repetition and count it for the category achievements
+    await review_store.record(user_id, question.key, selected_option == question.correct_index)
+    earned = await record_answer(user_id, category, selected_option == question.correct_index)
+    
     # Move to the next question
     test_data["current_question"] += 1
+    touch_test_session(user_id)
     
-    # Send feedback
-    letters = ['A', 'B', 'C', 'D']
-    if selected_option == question["correct_index"]:
-        await callback.message.answer("✅ Правильно!")
+    # Show feedback together with the next question
+    if selected_option == question.correct_index:
+        verdict = CORRECT_VERDICT
     else:
-        correct_idx = question["correct_index"]
-        correct_letter = letters[correct_idx] if correct_idx < len(letters) else ""
-        correct_option = question["options"][correct_idx]
-        await callback.message.answer(f"❌ Неправильно. Правильный ответ: {correct_letter}. {correct_option}")
+        verdict = get_templates(catalogue).question(question.key).wrong_verdict
+    if earned:
+        verdict += "\n" + achievements_text(earned)
     
-    # Send the next question
-    await send_question(callback.message, user_id)
+    await send_question(callback.message, user_id, verdict)
 
-async def finish_test(message: Message, user_id: int):
+async def finish_test(message: Message, user_id: int, verdict: str = None):
     """
     Finish the test and show results
+
+    Args:
+        message: Message to answer, or the answered question message to edit
+        user_id: User ID
+        verdict: Feedback on the last answer, shown above the results
     """
     # Get user test data
     test_data = user_test_data.get(user_id)
@@ -216,7 +268,8 @@ async def finish_test(message: Message, user_id: int):
     plan_text = "\n".join([f"День {day}: {topic}" for day, topic in learning_plan.items()])
     
     # Show results
-    await message.answer(
+    await show_quiz_message(
+        message,
         "🎉 Тест завершен! Вот ваши результаты:\n\n"
         + "\n".join([f"{category.capitalize()}: {percentage:.1f}%" for category, percentage in category_percentages.items()])
         + "\n\n"
@@ -224,8 +277,10 @@ async def finish_test(message: Message, user_id: int):
         + "На основе результатов мы создали для вас индивидуальный план обучения:\n\n"
         + plan_text
         + "\n\n"
-        + "Готовы начать первый урок? Нажмите /lesson для начала обучения!"
+        + "Готовы начать первый урок? Нажмите /lesson для начала обучения!",
+        verdict=verdict
     )
     
     # Clean up test data
-    del user_test_data[user_id]
\ No newline at end of file
+    del user_test_data[user_id]
+    timers.cancel(("test", user_id))
\ No newline at end of file
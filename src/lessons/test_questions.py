@@ -1,6 +1,15 @@
 """
 Module containing diagnostic test questions
+
+Tests are drawn by a QuestionSampler built once per catalogue. It keeps the
+question IDs of each category in a tuple, spreads the questions of a test
+evenly over the categories and picks random positions within each category,
+so drawing a test costs O(count) however large the bank is, and every
+category gets scored. Questions a user has already seen can be excluded;
+they are only used again when there are not enough unseen ones.
 """
+import random
+import weakref
 
 # Initial set of diagnostic test questions
 DIAGNOSTIC_TEST = [
@@ -141,18 +150,140 @@ DIAGNOSTIC_TEST = [
     }
 ]
 
-def get_test_questions(count=10):
+class QuestionSampler:
+    """
+    Stratified sampler of diagnostic test question IDs
+
+    Args:
+        questions: Test question records
+        seed: Random seed, None for a random one
+    """
+
+    def __init__(self, questions, seed=None):
+        self.rng = random.Random(seed)
+
+        ids_by_category = {}
+        for question in questions:
+            ids_by_category.setdefault(question.category, []).append(question.id)
+        self.ids_by_category = {category: tuple(ids) for category, ids in ids_by_category.items()}
+        self._category = {question.id: question.category for question in questions}
+
+    def sample(self, count, exclude=None, rng=None):
+        """
+        Draw the question IDs of a test
+
+        Args:
+            count: Number of questions
+            exclude: Set of question IDs to avoid, e.g. the ones the user has seen
+            rng: Random generator, defaults to the sampler's own
+
+        Returns:
+            List of distinct question IDs in random order, fewer than count
+            only if the bank is smaller
+        """
+        rng = rng or self.rng
+        chosen = []
+        picked = set()
+        self._fill(chosen, count, exclude or frozenset(), picked, rng)
+        if len(chosen) < count and exclude:
+            # Not enough unseen questions: top up with seen ones
+            self._fill(chosen, count, frozenset(), picked, rng)
+
+        rng.shuffle(chosen)
+        return chosen
+
+    def _fill(self, chosen, count, exclude, picked, rng):
+        """Add questions to chosen until it has count or the categories run out"""
+        # Most questions each category can still give; excluded ones are only
+        # found out about while drawing
+        room = {category: len(ids) for category, ids in self.ids_by_category.items()}
+        for question_id in picked:
+            room[self._category[question_id]] -= 1
+
+        while len(chosen) < count:
+            quotas = self._allocate(count - len(chosen), room, rng)
+            if not quotas:
+                break
+            for category, quota in quotas.items():
+                drawn = self._draw(self.ids_by_category[category], quota, exclude, picked, rng)
+                chosen += drawn
+                # A category that fell short has nothing left to give
+                room[category] = room[category] - quota if len(drawn) == quota else 0
+
+    @staticmethod
+    def _allocate(count, room, rng):
+        """Spread count over the categories as evenly as their room allows"""
+        quotas = dict.fromkeys(room, 0)
+        open_categories = [category for category, left in room.items() if left > 0]
+        while count and open_categories:
+            share, extra = divmod(count, len(open_categories))
+            # Categories getting one question more when count doesn't divide evenly
+            lucky = set(rng.sample(open_categories, extra))
+            still_open = []
+            for category in open_categories:
+                take = min(share + (category in lucky), room[category] - quotas[category])
+                quotas[category] += take
+                count -= take
+                if quotas[category] < room[category]:
+                    still_open.append(category)
+            open_categories = still_open
+        return {category: quota for category, quota in quotas.items() if quota}
+
+    @staticmethod
+    def _draw(ids, count, exclude, picked, rng):
+        """Pick up to count IDs of a category that are neither excluded nor picked yet"""
+        drawn = []
+        # Random positions, retried when taken; a few tries per question
+        # suffice unless most of the category is excluded or picked
+        for _ in range(4 * count + 4):
+            if len(drawn) == count:
+                return drawn
+            question_id = ids[rng.randrange(len(ids))]
+            if question_id not in exclude and question_id not in picked:
+                picked.add(question_id)
+                drawn.append(question_id)
+        if len(drawn) == count:
+            return drawn
+
+        # Out of tries: pick from the IDs that are left
+        left = [question_id for question_id in ids if question_id not in exclude and question_id not in picked]
+        rest = rng.sample(left, min(count - len(drawn), len(left)))
+        picked.update(rest)
+        return drawn + rest
+
+
+# Samplers for each catalogue that is still in use
+_samplers = weakref.WeakKeyDictionary()
+
+def get_sampler(catalogue=None):
+    """
+    Get the question sampler of a catalogue, building it on first use
+
+    Args:
+        catalogue: Content catalogue, defaults to the current one
+
+    Returns:
+        QuestionSampler
+    """
+    from src.content.registry import get_catalogue
+
+    catalogue = catalogue or get_catalogue()
+    sampler = _samplers.get(catalogue)
+    if sampler is None:
+        sampler = _samplers[catalogue] = QuestionSampler(catalogue.test_questions)
+    return sampler
+
+def get_test_questions(count=10, catalogue=None, exclude=None, rng=None):
     """
-    Get a subset of test questions
+    Get a subset of test questions, balanced across categories
     
     Args:
         count: Number of questions to return
+        catalogue: Content catalogue to draw from, defaults to the current one
+        exclude: Set of question IDs the user has already seen
+        rng: Random generator, e.g. a seeded one for reproducible tests
         
     Returns:
-        List of question dictionaries
+        List of question IDs
     """
-    import random
-    # Ensure we don't request more questions than available
-    count = min(count, len(DIAGNOSTIC_TEST))
-    # Return a random selection of questions
-    return random.sample(DIAGNOSTIC_TEST, count)
\ No newline at end of file
+    return get_sampler(catalogue).sample(count, exclude, rng)
@@ -0,0 +1,134 @@
+"""
+Module for rendering share images outside of the event loop
+
+Pillow drawing and PNG encoding are CPU-bound, so images are rendered in a
+bounded pool of worker processes. Requests beyond the queue limit are
+rejected instead of piling up.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from src.social.share_generator import preload_fonts, render_share_image
+
+# Number of worker processes
+SHARE_RENDER_WORKERS = int(os.getenv("SHARE_RENDER_WORKERS", "2"))
+
+# Maximum number of images rendering or waiting for a worker
+SHARE_RENDER_MAX_PENDING = int(os.getenv("SHARE_RENDER_MAX_PENDING", "32"))
+
+
+class RendererOverloaded(Exception):
+    """Raised when the render queue is full"""
+
+
+class ShareRenderer:
+    """
+    Render share images in a process pool
+
+    Args:
+        max_workers: Number of worker processes
+        max_pending: Maximum number of renders in flight before shedding load
+    """
+
+    def __init__(self, max_workers=SHARE_RENDER_WORKERS, max_pending=SHARE_RENDER_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+
+        self._executor = None
+        self._stats = {
+            "rendered": 0,
+            "rejected": 0,
+            "failed": 0,
+            "total_seconds": 0.0,
+            "max_seconds": 0.0
+        }
+
+    def _get_executor(self):
+        """Create the process pool on first use"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                # Spawn fresh workers instead of forking the bot with its open connections
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=preload_fonts
+            )
+        return self._executor
+
+    async def render(self, level, lessons_completed, streak_days, image_format="png"):
+        """
+        Render a share image in a worker process
+
+        Args:
+            level: User level
+            lessons_completed: Number of completed lessons
+            streak_days: Number of days in a row
+            image_format: Encoding, see share_generator.encode_image
+
+        Returns:
+            Encoded image bytes
+
+        Raises:
+            RendererOverloaded: If max_pending renders are already in flight
+        """
+        if self.pending >= self.max_pending:
+            self._stats["rejected"] += 1
+            raise RendererOverloaded(f"{self.pending} share images are already being rendered")
+
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            image_bytes = await loop.run_in_executor(
+                self._get_executor(),
+                render_share_image,
+                level,
+                lessons_completed,
+                streak_days,
+                image_format
+            )
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next render
+            self._stats["failed"] += 1
+            self._executor = None
+            raise
+        except Exception:
+            self._stats["failed"] += 1
+            raise
+        finally:
+            self.pending -= 1
+
+        elapsed = time.perf_counter() - started
+        self._stats["rendered"] += 1
+        self._stats["total_seconds"] += elapsed
+        self._stats["max_seconds"] = max(self._stats["max_seconds"], elapsed)
+
+        return image_bytes
+
+    def get_stats(self):
+        """
+        Get render timing and load-shedding counters
+
+        Returns:
+            Dictionary with counters, timings and the current queue depth
+        """
+        rendered = self._stats["rendered"]
+        return {
+            **self._stats,
+            "avg_seconds": self._stats["total_seconds"] / rendered if rendered else 0.0,
+            "pending": self.pending
+        }
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Shared renderer used by the share handler
+share_renderer = ShareRenderer()
@@ -0,0 +1,170 @@
+"""
+Module for caching rendered share images
+
+Share images depend only on (level, completed lessons, streak), so users with
+the same values get identical pictures. The cache keeps the encoded images in
+a bounded LRU and remembers the Telegram file_id of every uploaded image, so
+repeated shares are sent without rendering or uploading anything.
+"""
+import os
+from collections import OrderedDict
+
+# Maximum number of encoded images kept in memory
+SHARE_CACHE_MAX_IMAGES = int(os.getenv("SHARE_CACHE_MAX_IMAGES", "256"))
+
+# Maximum total size of encoded images kept in memory
+SHARE_CACHE_MAX_BYTES = int(os.getenv("SHARE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Maximum number of remembered Telegram file IDs
+SHARE_CACHE_MAX_FILE_IDS = int(os.getenv("SHARE_CACHE_MAX_FILE_IDS", "100000"))
+
+
+def share_card_key(user_data):
+    """
+    Get the cache key for a user's share image
+
+    Args:
+        user_data: Dictionary with user data (level, lessons completed, etc.)
+
+    Returns:
+        Tuple of the values drawn on the image
+    """
+    return (
+        user_data.get("level", 1),
+        len(user_data.get("completed_lessons", [])),
+        user_data.get("streak_days", 0)
+    )
+
+
+class ShareCardCache:
+    """
+    LRU cache of encoded share images and their Telegram file IDs
+
+    Args:
+        max_images: Maximum number of encoded images
+        max_bytes: Maximum total size of encoded images
+        max_file_ids: Maximum number of file IDs
+    """
+
+    def __init__(self, max_images=SHARE_CACHE_MAX_IMAGES, max_bytes=SHARE_CACHE_MAX_BYTES,
+                 max_file_ids=SHARE_CACHE_MAX_FILE_IDS):
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.max_file_ids = max_file_ids
+
+        self._images = OrderedDict()
+        self._file_ids = OrderedDict()
+        self._bytes = 0
+
+        self._stats = {
+            "file_id_hits": 0,
+            "image_hits": 0,
+            "misses": 0,
+            "image_evictions": 0,
+            "file_id_evictions": 0
+        }
+
+    def get_file_id(self, key):
+        """
+        Get the Telegram file ID of an already uploaded image
+
+        Args:
+            key: Share card key
+
+        Returns:
+            File ID or None
+        """
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            self._file_ids.move_to_end(key)
+            self._stats["file_id_hits"] += 1
+        return file_id
+
+    def set_file_id(self, key, file_id):
+        """
+        Remember the Telegram file ID of an uploaded image
+
+        The encoded image is no longer needed once Telegram has it.
+
+        Args:
+            key: Share card key
+            file_id: Telegram file ID
+        """
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+            self._stats["file_id_evictions"] += 1
+
+        image_bytes = self._images.pop(key, None)
+        if image_bytes is not None:
+            self._bytes -= len(image_bytes)
+
+    def forget_file_id(self, key):
+        """
+        Drop a file ID that Telegram no longer accepts
+
+        Args:
+            key: Share card key
+        """
+        self._file_ids.pop(key, None)
+
+    def get_image(self, key):
+        """
+        Get an encoded image
+
+        Args:
+            key: Share card key
+
+        Returns:
+            Image bytes or None
+        """
+        image_bytes = self._images.get(key)
+        if image_bytes is None:
+            self._stats["misses"] += 1
+            return None
+
+        self._images.move_to_end(key)
+        self._stats["image_hits"] += 1
+        return image_bytes
+
+    def put_image(self, key, image_bytes):
+        """
+        Store an encoded image, evicting the least recently used ones
+
+        Args:
+            key: Share card key
+            image_bytes: Encoded image
+        """
+        old = self._images.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+
+        self._images[key] = image_bytes
+        self._bytes += len(image_bytes)
+
+        while self._images and (len(self._images) > self.max_images or self._bytes > self.max_bytes):
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= len(evicted)
+            self._stats["image_evictions"] += 1
+
+    def get_stats(self):
+        """
+        Get cache counters for monitoring
+
+        Returns:
+            Dictionary with hit, miss and eviction counters, sizes and hit rate
+        """
+        lookups = self._stats["file_id_hits"] + self._stats["image_hits"] + self._stats["misses"]
+        hits = self._stats["file_id_hits"] + self._stats["image_hits"]
+        return {
+            **self._stats,
+            "images": len(self._images),
+            "image_bytes": self._bytes,
+            "file_ids": len(self._file_ids),
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+
+
+# Shared cache used by the share handler
+share_cache = ShareCardCache()
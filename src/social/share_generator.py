@@ -2,21 +2,102 @@
 Module for generating social media shares
 """
 import os
-from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 
-async def generate_share_image(user_data):
+from PIL import Image, ImageDraw, ImageFont
+
+# Encoding of share images: png, palette (8-bit PNG), jpeg or webp
+SHARE_IMAGE_FORMAT = os.getenv("SHARE_IMAGE_FORMAT", "png")
+
+# Size budget for jpeg and webp images, quality is lowered until it fits
+SHARE_IMAGE_MAX_BYTES = int(os.getenv("SHARE_IMAGE_MAX_BYTES", str(64 * 1024)))
+
+# File extension for each encoding
+IMAGE_EXTENSIONS = {
+    "png": "png",
+    "palette": "png",
+    "jpeg": "jpg",
+    "webp": "webp"
+}
+
+# Fonts loaded once per process (see preload_fonts)
+_fonts = None
+
+def load_fonts():
     """
-    Generate an image for social media sharing
+    Load the fonts used on the share image
+    
+    Returns:
+        Tuple of large, medium and small fonts
+    """
+    # Try to load a font, fall back to default if not available
+    try:
+        return (
+            ImageFont.truetype("arial.ttf", 60),
+            ImageFont.truetype("arial.ttf", 40),
+            ImageFont.truetype("arial.ttf", 30)
+        )
+    except IOError:
+        return (
+            ImageFont.load_default(),
+            ImageFont.load_default(),
+            ImageFont.load_default()
+        )
+
+def preload_fonts():
+    """Load fonts ahead of the first render (used as the worker initializer)"""
+    global _fonts
+    _fonts = load_fonts()
+
+def encode_image(image, image_format="png", max_bytes=SHARE_IMAGE_MAX_BYTES):
+    """
+    Encode an image
     
     Args:
-        user_data: Dictionary with user data (level, lessons completed, etc.)
+        image: PIL image
+        image_format: png, palette, jpeg or webp
+        max_bytes: Size budget for lossy formats
         
     Returns:
-        BytesIO object with the image
+        Encoded image bytes
     """
-    # In a real implementation, this would create an actual image
-    # For MVP, we'll just create a simple image with text
+    if image_format == "palette":
+        # The card uses a handful of flat colors, 64 are enough for the text edges
+        bio = BytesIO()
+        image.quantize(colors=64).save(bio, 'PNG', optimize=True)
+        return bio.getvalue()
+    
+    if image_format in ("jpeg", "webp"):
+        # Lower the quality step by step until the image fits the budget
+        for quality in (85, 70, 55, 40):
+            bio = BytesIO()
+            image.save(bio, image_format.upper(), quality=quality)
+            if bio.tell() <= max_bytes:
+                break
+        return bio.getvalue()
+    
+    bio = BytesIO()
+    image.save(bio, 'PNG')
+    return bio.getvalue()
+
+def render_share_image(level, lessons_completed, streak_days, image_format="png"):
+    """
+    Draw the share image
+    
+    This is CPU-bound and meant to run in a worker process (see renderer).
+    
+    Args:
+        level: User level
+        lessons_completed: Number of completed lessons
+        streak_days: Number of days in a row
+        image_format: Encoding, see encode_image
+        
+    Returns:
+        Encoded image bytes
+    """
+    if _fonts is None:
+        preload_fonts()
+    font_large, font_medium, font_small = _fonts
     
     # Create a blank image
     width, height = 1200, 630
@@ -25,16 +106,6 @@ async def generate_share_image(user_data):
     # Get a drawing context
     draw = ImageDraw.Draw(image)
     
-    # Try to load a font, fall back to default if not available
-    try:
-        font_large = ImageFont.truetype("arial.ttf", 60)
-        font_medium = ImageFont.truetype("arial.ttf", 40)
-        font_small = ImageFont.truetype("arial.ttf", 30)
-    except IOError:
-        font_large = ImageFont.load_default()
-        font_medium = ImageFont.load_default()
-        font_small = ImageFont.load_default()
-    
     # Draw title
     draw.text(
         (width/2, 100),
@@ -47,7 +118,7 @@ async def generate_share_image(user_data):
     # Draw level
     draw.text(
         (width/2, 250),
-        f"Уровень {user_data.get('level', 1)}",
+        f"Уровень {level}",
         font=font_large,
         fill=(85, 239, 196),
         anchor="mm"
@@ -56,7 +127,7 @@ async def generate_share_image(user_data):
     # Draw lessons completed
     draw.text(
         (width/2, 350),
-        f"Пройдено уроков: {len(user_data.get('completed_lessons', []))}",
+        f"Пройдено уроков: {lessons_completed}",
         font=font_medium,
         fill=(255, 255, 255),
         anchor="mm"
@@ -65,7 +136,7 @@ async def generate_share_image(user_data):
     # Draw streak
     draw.text(
         (width/2, 450),
-        f"Дней подряд: {user_data.get('streak_days', 0)}",
+        f"Дней подряд: {streak_days}",
         font=font_medium,
         fill=(255, 255, 255),
         anchor="mm"
@@ -80,9 +151,45 @@ async def generate_share_image(user_data):
         anchor="mm"
     )
     
-    # Save image to BytesIO
-    bio = BytesIO()
-    image.save(bio, 'PNG')
-    bio.seek(0)
+    return encode_image(image, image_format)
+
+async def render_share_bytes(user_data, image_format=SHARE_IMAGE_FORMAT):
+    """
+    Render the share image for a user
+    
+    Rendering runs in the renderer process pool, so the event loop keeps
+    serving other users in the meantime.
+    
+    Args:
+        user_data: Dictionary with user data (level, lessons completed, etc.)
+        image_format: Encoding, see encode_image
+        
+    Returns:
+        Encoded image bytes
+        
+    Raises:
+        RendererOverloaded: If too many images are already being rendered
+    """
+    from src.social.renderer import share_renderer
+    
+    return await share_renderer.render(
+        user_data.get('level', 1),
+        len(user_data.get('completed_lessons', [])),
+        user_data.get('streak_days', 0),
+        image_format
+    )
+
+async def generate_share_image(user_data):
+    """
+    Generate an image for social media sharing
     
-    return bio
\ No newline at end of file
+    Args:
+        user_data: Dictionary with user data (level, lessons completed, etc.)
+        
+    Returns:
+        BytesIO object with the image
+        
+    Raises:
+        RendererOverloaded: If too many images are already being rendered
+    """
+    return BytesIO(await render_share_bytes(user_data))
@@ -2,19 +2,17 @@
 Module for handling social media sharing
 """
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-import os
-import tempfile
 
-from src.social.share_generator import generate_share_image
-from src.gamification.xp_system import user_xp_data, award_achievement
+from src.social.renderer import RendererOverloaded
+from src.social.share_cache import share_cache, share_card_key
+from src.social.share_generator import IMAGE_EXTENSIONS, SHARE_IMAGE_FORMAT, render_share_bytes
+from src.gamification.xp_system import award_xp, get_user_data
 
 # Create a router
-router = Router()
-
-# Store user share count (in a real app, this would be in a database)
-user_shares = {}
+router = Router(name="share_router")
 
 @router.callback_query(F.data.startswith("share_"))
 async def share_progress(callback: CallbackQuery):
@@ -27,30 +25,48 @@ async def share_progress(callback: CallbackQuery):
     lesson_id = int(callback.data.split("_")[1])
     
     # Get user data
-    if user_id not in user_xp_data:
+    user_data = await get_user_data(user_id)
+    if user_data is None:
         await callback.message.answer("Произошла ошибка. Пожалуйста, начните обучение заново.")
         return
     
-    user_data = user_xp_data[user_id]
-    
-    # Generate share image
-    image_bio = await generate_share_image(user_data)
+    caption = (
+        f"🚀 Я на уровне {user_data['level']} в Python Tutor Bot!\n"
+        f"Пройдено уроков: {len(user_data.get('completed_lessons', []))}\n"
+        f"Дней подряд: {user_data['streak_days']}\n\n"
+        f"Присоединяйся к обучению! t.me/your_bot_username"
+    )
     
-    # Save image to temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-        temp_file.write(image_bio.getvalue())
-        temp_file_path = temp_file.name
+    # Resend an already uploaded image if someone shared the same card before
+    card_key = share_card_key(user_data)
+    file_id = share_cache.get_file_id(card_key)
+    sent = False
+    if file_id:
+        try:
+            await callback.message.answer_photo(file_id, caption=caption)
+            sent = True
+        except TelegramBadRequest:
+            share_cache.forget_file_id(card_key)
     
-    # Send image to user
-    await callback.message.answer_photo(
-        FSInputFile(temp_file_path),
-        caption=(
-            f"🚀 Я на уровне {user_data['level']} в Python Tutor Bot!\n"
-            f"Пройдено уроков: {len(user_data.get('completed_lessons', []))}\n"
-            f"Дней подряд: {user_data['streak_days']}\n\n"
-            f"Присоединяйся к обучению! t.me/your_bot_username"
+    if not sent:
+        # Generate share image unless it is cached
+        image_bytes = share_cache.get_image(card_key)
+        if image_bytes is None:
+            try:
+                image_bytes = await render_share_bytes(user_data)
+            except RendererOverloaded:
+                await callback.message.answer("Сейчас слишком много запросов. Попробуйте поделиться прогрессом через минуту.")
+                return
+            share_cache.put_image(card_key, image_bytes)
+        
+        # Upload the image straight from memory
+        photo_message = await callback.message.answer_photo(
+            BufferedInputFile(image_bytes, filename=f"progress.{IMAGE_EXTENSIONS[SHARE_IMAGE_FORMAT]}"),
+            caption=caption
         )
-    )
+        
+        # Remember the uploaded file for the next share of the same card
+        share_cache.set_file_id(card_key, photo_message.photo[-1].file_id)
     
     # Create keyboard with share buttons
     builder = InlineKeyboardBuilder()
@@ -62,15 +78,5 @@ async def share_progress(callback: CallbackQuery):
         reply_markup=builder.as_markup()
     )
     
-    # Clean up temporary file
-    os.unlink(temp_file_path)
-    
-    # Track share count
-    if user_id not in user_shares:
-        user_shares[user_id] = 1
-    else:
-        user_shares[user_id] += 1
-    
-    # Check for social butterfly achievement
-    if user_shares[user_id] == 3:
-        await award_achievement(user_id, "social_butterfly", "Социальная бабочка", "Вы поделились своим прогрессом 3 раза!")
\ No newline at end of file
+    # Track share count, which unlocks the social butterfly achievement
+    await award_xp(user_id, 0, "share", event="share", lesson_id=lesson_id, shares=1)
\ No newline at end of file
@@ -0,0 +1,37 @@
+"""
+Tests of the database startup migration
+"""
+import asyncio
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.database.db import init_db
+from src.database.models import User
+
+
+def test_init_db_adds_columns_to_existing_tables(tmp_path):
+    """A users table created by the first release gets the columns added since"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
+
+    async def migrate():
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "CREATE TABLE users ("
+                "id INTEGER PRIMARY KEY, telegram_id INTEGER NOT NULL UNIQUE, username VARCHAR, "
+                "first_name VARCHAR, last_name VARCHAR, registration_date DATETIME, "
+                "last_activity DATETIME, xp INTEGER, level INTEGER, streak_days INTEGER, "
+                "last_lesson_date DATETIME)"
+            ))
+            await conn.execute(text("INSERT INTO users (telegram_id, xp, level) VALUES (12345, 10, 1)"))
+
+        await init_db(engine)
+
+        async with engine.connect() as conn:
+            row = (await conn.execute(
+                select(User.weekly_xp, User.xp_week, User.counters).where(User.telegram_id == 12345)
+            )).one()
+        await engine.dispose()
+        return row
+
+    assert tuple(asyncio.run(migrate())) == (0, None, None)
@@ -0,0 +1,23 @@
+"""
+Tests of the content catalogue versions
+"""
+from collections import OrderedDict
+
+from src.content import registry
+from src.content.registry import KEEP_VERSIONS, get_catalogue, set_catalogue
+
+
+def test_dropped_version_is_not_replaced_by_the_current_one(monkeypatch):
+    """A session whose version is no longer kept gets no catalogue instead of another one"""
+    monkeypatch.setattr(registry, "_versions", OrderedDict(registry._versions))
+    monkeypatch.setattr(registry, "_catalogue", registry._catalogue)
+    first = get_catalogue()
+
+    for i in range(KEEP_VERSIONS):
+        catalogue = registry.build_catalogue()
+        catalogue.version = f"reload-{i}"
+        set_catalogue(catalogue)
+
+    assert get_catalogue("reload-0").version == "reload-0"
+    assert get_catalogue(first.version) is None
+    assert get_catalogue().version == f"reload-{KEEP_VERSIONS - 1}"
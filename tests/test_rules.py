@@ -0,0 +1,40 @@
+"""
+Tests of the achievement rules against the built-in content
+"""
+import asyncio
+
+from src.content.registry import get_catalogue
+from src.gamification.xp_system import record_answer, user_xp_data
+
+
+def test_category_achievements_can_be_earned():
+    """Answering every built-in question of a category correctly earns its achievement"""
+    catalogue = get_catalogue()
+    user_id = 1
+    user_xp_data[user_id] = {
+        "xp": 0,
+        "level": 1,
+        "streak_days": 0,
+        "last_activity": None,
+        "weekly_xp": 0,
+        "xp_week": None,
+        "first_name": None,
+        "counters": {},
+        "achievement_bits": 0,
+        "achievements": []
+    }
+
+    async def answer_everything():
+        earned = []
+        questions = list(catalogue.test_questions)
+        questions += [question for lesson in catalogue.lessons for question in lesson.questions]
+        for question in questions:
+            earned += await record_answer(user_id, question.category, True)
+        return earned
+
+    try:
+        earned = {achievement["id"] for achievement in asyncio.run(answer_everything())}
+    finally:
+        del user_xp_data[user_id]
+
+    assert {"functions_guru", "oop_master"} <= earned